@@ -1,8 +1,10 @@
 #pylint: disable=missing-class-docstring, raise-missing-from
 """Central controller"""
 import asyncio
-from collections import defaultdict
+from collections import defaultdict, deque
+import copy
 import dataclasses
+import json
 import logging
 import math
 import os
@@ -19,11 +21,14 @@ from starlette.datastructures import QueryParams
 from starlette.middleware.cors import CORSMiddleware
 import uvicorn
 
-from alpa_serve.http_util import (HTTPRequestWrapper, receive_http_body,
-                                  Response, set_socket_reuse_port, ASGIHandler,
+from alpa_serve.dispatch_policy import DispatchPolicy, get_dispatch_policy
+from alpa_serve.http_util import (HTTPRequestWrapper, CompactRequest,
+                                  receive_http_body, Response,
+                                  set_socket_reuse_port, ASGIHandler,
                                   build_starlette_request, new_port,
                                   RelayException, make_error_response)
-from alpa_serve.util import build_logger, add_sync_method, to_str_round
+from alpa_serve.util import (build_logger, add_sync_method, to_str_round,
+                             batchsize_config)
 
 logger = logging.getLogger(__file__)
 
@@ -56,6 +61,7 @@ class ModelInfo:
     create_info: CreateInfo
     group_ids: List[int]
     group_pt: int
+    starlette_request: bool = False
 
 
 @dataclasses.dataclass
@@ -76,10 +82,200 @@ class DummyRequest:
         return self.obj
 
 
+class CompactRequestView:
+    """Mimic starlette.requests.Request on top of a CompactRequest.
+    The body is parsed lazily on the first call of `json`."""
+
+    def __init__(self, message: CompactRequest):
+        self.message = message
+        self.obj = None
+        self.scope = {"ts": message.ts}
+
+    async def json(self):
+        if self.obj is None:
+            self.obj = json.loads(self.message.body)
+        return self.obj
+
+
+@dataclasses.dataclass
+class QueuedRequest:
+    request: Any
+    deadline: float
+    enter_time: float
+    future: asyncio.Future
+
+
+class DynamicBatcher:
+    """Batch the requests of one model replica on a group.
+
+    Requests are queued until the first pipeline stage of the group is free,
+    the oldest request has waited `max_wait` seconds, or waiting longer would
+    make it miss its deadline. Then the largest batch size in
+    `batchsize_config` whose predicted finish time still meets the earliest
+    deadline in the batch is dispatched as one `replica.handle_batch` call.
+    A request that cannot meet its deadline even alone is rejected.
+
+    `stage_clock` holds the predicted stage clocks of the group shared by all
+    its models and is updated in place. After a batch with a deadline
+    returns, `adjust_latency_prediction(start_time, ret_time, deadline,
+    num_stages)` is called to correct the prediction.
+    """
+
+    def __init__(self,
+                 name: str,
+                 replica: Any,
+                 latency_dict: Dict[int, List[float]],
+                 stage_clock: List[float],
+                 latency_scale: Dict[str, float],
+                 max_wait: float = 0.01,
+                 fixed_overhead: float = 0.004,
+                 adjust_latency_prediction: Optional[Callable] = None):
+        assert 1 in latency_dict, "The latency of batch size 1 is required"
+        self.name = name
+        self.replica = replica
+        self.latency_dict = latency_dict
+        self.stage_clock = stage_clock
+        self.latency_scale = latency_scale
+        self.max_wait = max_wait
+        self.fixed_overhead = fixed_overhead
+        self.adjust_latency_prediction = adjust_latency_prediction
+        self.batch_sizes = [b for b in batchsize_config if b in latency_dict]
+
+        self.queue = deque()
+        self.event = asyncio.Event()
+        self.task = None
+
+        # Statistics
+        self.batch_size_counts = defaultdict(int)
+        self.num_rejected = 0
+
+    async def submit(self, request: Any, submit_time: Optional[float] = None,
+                     slo: Optional[float] = None):
+        enter_time = time.time()
+        if slo is None:
+            deadline = math.inf
+        else:
+            deadline = (enter_time if submit_time is None else submit_time) + slo
+        future = asyncio.get_running_loop().create_future()
+        self.queue.append(QueuedRequest(request, deadline, enter_time, future))
+
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+            self.task.add_done_callback(self.on_task_done)
+        self.event.set()
+        return await future
+
+    def on_task_done(self, task: asyncio.Task):
+        """Fail the queued requests if the batching loop stops, so that they
+        do not hang. The next request starts a new loop."""
+        if self.task is task:
+            self.task = None
+        while self.queue:
+            x = self.queue.popleft()
+            if x.future.done():
+                continue
+            if task.cancelled():
+                x.future.cancel()
+            else:
+                x.future.set_exception(task.exception() or RuntimeError(
+                    "The batching loop stopped"))
+
+    def predict_stage_clock(self, batch_size: int, now: float):
+        k = self.latency_scale.get(self.name, 1.0)
+        req_stage_clock = []
+        t = now
+        for i, latency in enumerate(self.latency_dict[batch_size]):
+            t = max(self.stage_clock[i], t) + latency * k
+            req_stage_clock.append(t)
+        return req_stage_clock
+
+    async def run(self):
+        while True:
+            if not self.queue:
+                self.event.clear()
+                await self.event.wait()
+                continue
+
+            # Wait for more requests while the pipeline is busy
+            now = time.time()
+            head = self.queue[0]
+            k = self.latency_scale.get(self.name, 1.0)
+            latest_start = (head.deadline - self.fixed_overhead -
+                            sum(self.latency_dict[1]) * k)
+            dispatch_time = min(max(self.stage_clock[0], now),
+                                head.enter_time + self.max_wait, latest_start)
+            if dispatch_time > now and len(self.queue) < self.batch_sizes[-1]:
+                self.event.clear()
+                try:
+                    await asyncio.wait_for(self.event.wait(), dispatch_time - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self.dispatch()
+
+    def dispatch(self):
+        """Dispatch one batch from the head of the queue."""
+        now = time.time()
+        while self.queue:
+            for batch_size in reversed(self.batch_sizes):
+                if batch_size > len(self.queue):
+                    continue
+                deadline = min(self.queue[i].deadline for i in range(batch_size))
+                req_stage_clock = self.predict_stage_clock(batch_size, now)
+                if req_stage_clock[-1] + self.fixed_overhead + 0.001 <= deadline:
+                    break
+            else:
+                # The head request will exceed its deadline even if it runs alone
+                head = self.queue.popleft()
+                ts = getattr(head.request, "scope", {}).get("ts", [])
+                head.future.set_result({"rejected": True, "ts": ts})
+                self.num_rejected += 1
+                continue
+
+            batch = [self.queue.popleft() for _ in range(batch_size)]
+            for i in range(len(req_stage_clock)):
+                self.stage_clock[i] = req_stage_clock[i]
+            self.batch_size_counts[batch_size] += 1
+            asyncio.create_task(self.run_batch(
+                batch, now, req_stage_clock[-1], deadline))
+            return
+
+    async def run_batch(self, batch: List[QueuedRequest], start_time: float,
+                        ret_time: float, deadline: float):
+        try:
+            rets = await self.replica.handle_batch([x.request for x in batch])
+            assert len(rets) == len(batch), (
+                f"handle_batch returned {len(rets)} results for {len(batch)} requests")
+        except Exception as e:  # pylint: disable=broad-except
+            rets = [RelayException(e)] * len(batch)
+
+        if self.adjust_latency_prediction and deadline < math.inf:
+            self.adjust_latency_prediction(start_time, ret_time, deadline,
+                                           len(self.latency_dict[len(batch)]))
+
+        for x, ret in zip(batch, rets):
+            if not x.future.done():
+                x.future.set_result(ret)
+
+    def get_stats(self):
+        num_batches = sum(self.batch_size_counts.values())
+        num_requests = sum(b * n for b, n in self.batch_size_counts.items())
+        return {"batch_size_counts": dict(self.batch_size_counts),
+                "mean_batch_size": num_requests / max(num_batches, 1),
+                "num_rejected": self.num_rejected}
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
 @ray.remote(num_cpus=1)
 class GroupManager:
 
-    def __init__(self, virtual_mesh_shape: Optional[Tuple[int]] = None):
+    def __init__(self, virtual_mesh_shape: Optional[Tuple[int]] = None,
+                 enable_batching: bool = False, max_batch_wait: float = 0.01):
         from alpa.api import init as alpa_init
 
         if virtual_mesh_shape:
@@ -106,6 +302,12 @@ class GroupManager:
         # Constants
         self.fixed_overhead = 0.004
 
+        # Dynamic batching for the replicas that implement handle_batch
+        # Dict[model_name -> DynamicBatcher]
+        self.enable_batching = enable_batching
+        self.max_batch_wait = max_batch_wait
+        self.batchers = {}
+
     def create_replica(self, name: str, create_info: CreateInfo):
         assert name not in self.replicas
 
@@ -120,26 +322,45 @@ class GroupManager:
         else:
             self.latency_dict[name] = defaultdict(lambda: [0])
 
+        if (self.enable_batching and hasattr(self.replicas[name], "handle_batch") and
+            hasattr(self.replicas[name], "get_latency_dict")):
+            self.batchers[name] = DynamicBatcher(
+                name, self.replicas[name], self.latency_dict[name], self.stage_clock,
+                self.latency_scale, self.max_batch_wait, self.fixed_overhead,
+                self.adjust_latency_prediction)
+
+        return list(self.latency_dict[name][1])
+
     def delete_replica(self, name: str):
         assert name in self.replicas
         del self.replicas[name]
+        if name in self.batchers:
+            self.batchers.pop(name).close()
 
-    async def handle_request(self, name: str, request_wrapper: Union[bytes, dict]):
+    async def handle_request(self, name: str,
+                             request_wrapper: Union[CompactRequest, bytes, dict]):
         enter_time = time.time()
 
-        if isinstance(request_wrapper, bytes):
-            request_wrapper = pickle.loads(request_wrapper)
-            request = build_starlette_request(request_wrapper)
-        elif isinstance(request_wrapper, dict):
-            request = DummyRequest(request_wrapper)
+        if isinstance(request_wrapper, CompactRequest):
+            request = CompactRequestView(request_wrapper)
+            submit_time, slo = request_wrapper.submit_time, request_wrapper.slo
         else:
-            raise ValueError(f"Invalid request type: {request_wrapper}")
+            if isinstance(request_wrapper, bytes):
+                request_wrapper = pickle.loads(request_wrapper)
+                request = build_starlette_request(request_wrapper)
+            elif isinstance(request_wrapper, dict):
+                request = DummyRequest(request_wrapper)
+            else:
+                raise ValueError(f"Invalid request type: {request_wrapper}")
+            obj = await request.json()
+            submit_time, slo = obj.get("submit_time"), obj.get("slo")
 
         request.scope["ts"].append(("b", enter_time))
-        obj = await request.json()
 
-        if "slo" in obj:
-            slo = obj["slo"]
+        if name in self.batchers:
+            return await self.batchers[name].submit(request, submit_time, slo)
+
+        if slo is not None:
             k = self.latency_scale[name]
             # SLO awareness
             stage_latency = self.latency_dict[name][1]
@@ -153,7 +374,7 @@ class GroupManager:
             ret_time = req_stage_clock[-1]
 
             # Drop this request if it will exceed deadline
-            if ret_time + self.fixed_overhead + 0.001 > obj["submit_time"] + slo:
+            if ret_time + self.fixed_overhead + 0.001 > submit_time + slo:
                 return {"rejected": True, "ts": request.scope["ts"]}
 
             # Accept this request
@@ -168,36 +389,43 @@ class GroupManager:
             ret = RelayException(e)
 
         if ret_time:
-            if time.time() + self.fixed_overhead > obj["submit_time"] + slo:
-                underestimated = True
-            else:
-                underestimated = False
-
-            if start_time > self.freeze_end and underestimated:
-                actual_runtime = time.time() - start_time
-                predicted_runtime = ret_time - start_time
-                ratio = actual_runtime / predicted_runtime
-
-                # Adjust the clock to block all requests temporarily
-                num_stages = len(stage_latency)
-                queue_size = (self.stage_clock[0] - start_time) / (
-                    predicted_runtime / num_stages)
-                adjust_clock = actual_runtime / num_stages * queue_size / 2
-                for i in range(len(stage_latency)):
-                    self.stage_clock[i] += adjust_clock
-                print(f"adjust clock: {adjust_clock:.2f}, queue size: {queue_size:.2f}, ratio: {ratio:.2f}")
-
-                # Adjust the scale
-                if ratio > 1.2:
-                    for key in self.latency_scale:
-                        self.latency_scale[key] = min(
-                            self.max_latency_scale,
-                            self.latency_scale[key] + 0.03)
-                    print(f"adjust latency scale: {to_str_round(self.latency_scale, 2)}")
-                self.freeze_end = self.stage_clock[-1]
+            self.adjust_latency_prediction(start_time, ret_time,
+                                           submit_time + slo, len(stage_latency))
 
         return ret
 
+    def adjust_latency_prediction(self, start_time: float, ret_time: float,
+                                  deadline: float, num_stages: int):
+        """Correct the predicted clocks after a request or a batch that was
+        started at `start_time` and predicted to return at `ret_time`
+        finishes."""
+        if time.time() + self.fixed_overhead > deadline:
+            underestimated = True
+        else:
+            underestimated = False
+
+        if start_time > self.freeze_end and underestimated:
+            actual_runtime = time.time() - start_time
+            predicted_runtime = ret_time - start_time
+            ratio = actual_runtime / predicted_runtime
+
+            # Adjust the clock to block all requests temporarily
+            queue_size = (self.stage_clock[0] - start_time) / (
+                predicted_runtime / num_stages)
+            adjust_clock = actual_runtime / num_stages * queue_size / 2
+            for i in range(num_stages):
+                self.stage_clock[i] += adjust_clock
+            print(f"adjust clock: {adjust_clock:.2f}, queue size: {queue_size:.2f}, ratio: {ratio:.2f}")
+
+            # Adjust the scale
+            if ratio > 1.2:
+                for key in self.latency_scale:
+                    self.latency_scale[key] = min(
+                        self.max_latency_scale,
+                        self.latency_scale[key] + 0.03)
+                print(f"adjust latency scale: {to_str_round(self.latency_scale, 2)}")
+            self.freeze_end = self.stage_clock[-1]
+
     async def warmup(self):
         n_iter = 12
         n_warmup = 6
@@ -230,6 +458,9 @@ class GroupManager:
             self.latency_scale[name] = np.median(list(self.latency_scale.values()))
         print(f"latency scale: {to_str_round(self.latency_scale, 2)}")
 
+    def get_batch_stats(self):
+        return {name: batcher.get_stats() for name, batcher in self.batchers.items()}
+
     def shutdown(self):
         from alpa.api import shutdown as alpa_shutdown
 
@@ -237,146 +468,71 @@ class GroupManager:
         alpa_shutdown()
 
 
-@ray.remote(num_cpus=0)
-class Controller:
+class HTTPIngress:
+    """Parse, route and dispatch HTTP requests to group managers.
 
-    def __init__(self,
-                 host: str,
-                 port: int,
-                 root_path: str,
-                 ssl_keyfile: Optional[str] = None,
-                 ssl_certfile: Optional[Union[str, os.PathLike]] = None):
+    This is shared by the controller and the ingress proxies. The subclass
+    provides `model_info`, `group_info`, `dispatch_policy` and `logger`.
+    """
+
+    def init_http_server(self,
+                         host: str,
+                         port: int,
+                         root_path: str,
+                         ssl_keyfile: Optional[str] = None,
+                         ssl_certfile: Optional[Union[str, os.PathLike]] = None,
+                         reuse_port: bool = SOCKET_REUSE_PORT_ENABLED):
         self.host = host
         self.port = port
         self.root_path = root_path
         self.ssl_keyfile = ssl_keyfile
         self.ssl_certfile = ssl_certfile
+        self.reuse_port = reuse_port
 
-        # Controller metadata
-        self.manager_lock = defaultdict(asyncio.Lock)
-
-        # Dict[str -> ModelInfo]
-        self.model_info = {}
-        # Dict[int -> GroupInfo]
-        self.group_info = {}
-
-        self.logger = build_logger()
-
-        self.group_manager_class = GroupManager
+        # Statistics
+        self.num_http_requests = 0
+        self.last_stats = (time.time(), 0)
 
         # Http server
         self.server = None
         self.setup_complete = asyncio.Event()
         self.http_server_task = asyncio.create_task(self.run_http_server())
 
-    async def create_mesh_group_manager(
-            self,
-            group_id: int,
-            virtual_mesh_shape: Optional[Tuple[int]] = None,
-            num_gpus: int = 0):
-        assert group_id not in self.group_info, (
-            f"Mesh group {group_id} is already launched")
-        self.logger.info(f"Create mesh group manager {group_id} with "
-                         f"shape={virtual_mesh_shape}")
-        manager = (self.group_manager_class.options(
-            name=f"mesh_group_manager_{group_id}",
-            num_gpus=num_gpus).remote(virtual_mesh_shape))
-        self.group_info[group_id] = GroupInfo(
-            manager=manager, queue_size=0, num_total_requests=0)
-
-    async def register_model(self,
-                             name: str,
-                             model_def: Callable,
-                             init_args: Optional[List] = None,
-                             init_kwargs: Optional[Dict] = None,
-                             override: bool = False):
-        async with self.manager_lock[name]:
-            if name in self.model_info:
-                if override:
-                    for group_id in self.model_info[name].group_ids:
-                        await self.group_info[group_id
-                            ].manager.delete_replica.remote(name)
-                else:
-                    raise ValueError(f"Model {name} is already registered")
-
-            self.model_info[name] = ModelInfo(
-                CreateInfo(model_def, init_args, init_kwargs), [], 0)
-
-    async def create_replica(self,
-                             name: str,
-                             group_id: int,
-                             append_init_args: Optional[List] = None,
-                             append_init_kwargs: Optional[Dict] = None):
-        async with self.manager_lock[name]:
-            assert group_id in self.group_info, (
-                f"Group {group_id} does not exist")
-            model_info = self.model_info[name]
-            manager = self.group_info[group_id].manager
-            assert group_id not in model_info.group_ids, (
-                f"Model {name} is already created on group {group_id}")
-            create_info = model_info.create_info.append_init_args(
-                append_init_args, append_init_kwargs)
-
-            self.logger.info(f"Create replica of {name} on group {group_id}")
-            model_info.group_ids.append(group_id)
-        await manager.create_replica.remote(name, create_info)
-
-    def select_group_id(self, group_ids):
-        min_id = -1
-        min_size = math.inf
-        for group_id in group_ids:
-            if self.group_info[group_id].queue_size < min_size:
-                min_size = self.group_info[group_id].queue_size
-                min_id = group_id
-        assert min_id != -1
-        return min_id
-
-    async def handle_request(self, request):
-        ts = [("a", time.time())]
-        name = request["model"]
-
-        assert name in self.model_info, (
-            f"Model '{name}' is not registered.")
-        model_info = self.model_info[name]
-        #assert model_info.group_ids, (
-        #    f"No replica of model '{name}' is created.")
-
-        if not model_info.group_ids:
-            return {"rejected": True}
-        else:
-            # Dispatch
-            group_id = self.select_group_id(model_info.group_ids)
-            manager = self.group_info[group_id].manager
-
-            self.group_info[group_id].queue_size += 1
-            response = await manager.handle_request.remote(name, request)
-            self.group_info[group_id].queue_size -= 1
-            self.group_info[group_id].num_total_requests += 1
+    def select_group_id(self, name, group_ids):
+        return self.dispatch_policy.select(name, group_ids, time.time())
 
-            response["ts"] = ts + response["ts"]
+    def dispatch_begin(self, name, group_id):
+        self.group_info[group_id].queue_size += 1
+        self.dispatch_policy.on_dispatch(name, group_id, time.time())
 
-            return response
+    def dispatch_end(self, name, group_id):
+        self.group_info[group_id].queue_size -= 1
+        self.group_info[group_id].num_total_requests += 1
+        self.dispatch_policy.on_complete(name, group_id, time.time())
 
     async def handle_asgi(self, scope, receive, send):
         scope["ts"] = [("a", time.time())]
         assert scope["type"] == "http"
+        self.num_http_requests += 1
 
         # Receive request
         http_body_bytes = await receive_http_body(scope, receive, send)
-        request_wrapper = HTTPRequestWrapper(scope, http_body_bytes)
-        request_wrapper_bytes = pickle.dumps(request_wrapper)
 
         query_params = QueryParams(scope["query_string"])
 
         # Route
         try:
+            # Parse the JSON body only once
+            try:
+                obj = json.loads(http_body_bytes)
+            except ValueError:
+                obj = None
+
             if "model" in query_params:
                 name = query_params["model"]
             else:
-                request = build_starlette_request(request_wrapper)
-                obj = await request.json()
-
-                assert "model" in obj, "Model name is not specified in the request."
+                assert isinstance(obj, dict) and "model" in obj, (
+                    "Model name is not specified in the request.")
                 name = obj["model"]
 
             assert name in self.model_info, (
@@ -390,14 +546,21 @@ class Controller:
                 response = {"rejected": True}
             else:
                 # Dispatch
-                group_id = self.select_group_id(model_info.group_ids)
+                group_id = self.select_group_id(name, model_info.group_ids)
                 manager = self.group_info[group_id].manager
 
-                self.group_info[group_id].queue_size += 1
-                response = await manager.handle_request.remote(
-                    name, request_wrapper_bytes)
-                self.group_info[group_id].queue_size -= 1
-                self.group_info[group_id].num_total_requests += 1
+                if model_info.starlette_request or not isinstance(obj, dict):
+                    message = pickle.dumps(HTTPRequestWrapper(scope, http_body_bytes))
+                else:
+                    message = CompactRequest(name, obj.get("submit_time"), obj.get("slo"),
+                                             obj.get("idx"), http_body_bytes, scope["ts"])
+
+                self.dispatch_begin(name, group_id)
+                try:
+                    response = await manager.handle_request.remote(name, message)
+                finally:
+                    # Also release the group if the group manager fails
+                    self.dispatch_end(name, group_id)
 
                 if isinstance(response, RelayException):
                     response = make_error_response(response)
@@ -411,29 +574,14 @@ class Controller:
         await Response(response,
                        status_code=status_code).send(scope, receive, send)
 
-    def get_info(self):
-        return {
-            "host": self.host,
-            "port": self.port,
-            "root_path": self.root_path,
-        }
-
-    async def warmup(self):
-        # Warm up each single model replica in each group
-        tasks = []
-        for g in self.group_info.values():
-            tasks.append(g.manager.warmup.remote())
-        ray.get(tasks)
-
-        # Warm up the whole path from the controller to groups
-        for name, info in self.model_info.items():
-            request = {"model": name, "input": "Test"}
-            objs = []
-            for i in range(len(info.group_ids)):
-                objs.append(self.handle_request(request))
-            await asyncio.gather(*objs)
+    def get_http_stats(self):
+        """Return the number of HTTP requests and the QPS since the last call."""
+        now = time.time()
+        last_time, last_num = self.last_stats
+        self.last_stats = (now, self.num_http_requests)
+        return {"num_requests": self.num_http_requests,
+                "qps": (self.num_http_requests - last_num) / max(now - last_time, 1e-6)}
 
-    ##### HTTP related functions #####
     async def ready(self):
         """Returns when HTTP proxy is ready to serve traffic.
         Or throw exception when it is not able to serve traffic.
@@ -442,7 +590,7 @@ class Controller:
             [
                 # Either the HTTP setup has completed.
                 # The event is set inside self.run.
-                self.setup_complete.wait(),
+                asyncio.create_task(self.setup_complete.wait()),
                 # Or self.run errored.
                 self.http_server_task,
             ],
@@ -454,7 +602,7 @@ class Controller:
 
     async def run_http_server(self):
         sock = socket.socket()
-        if SOCKET_REUSE_PORT_ENABLED:
+        if self.reuse_port:
             set_socket_reuse_port(sock)
 
         try:
@@ -497,12 +645,297 @@ class Controller:
         self.setup_complete.set()
         await self.server.serve(sockets=[sock])
 
+
+class IngressProxy(HTTPIngress):
+    """An HTTP ingress proxy.
+
+    Several proxies listen on the same port with SO_REUSEPORT, so the kernel
+    balances the connections among them. Each proxy parses and routes
+    requests with its own replica of the controller's routing table and
+    sends them to the group managers directly.
+    """
+
+    def __init__(self,
+                 proxy_id: int,
+                 host: str,
+                 port: int,
+                 root_path: str,
+                 ssl_keyfile: Optional[str] = None,
+                 ssl_certfile: Optional[Union[str, os.PathLike]] = None,
+                 dispatch_policy: Union[str, DispatchPolicy, None] = None):
+        self.proxy_id = proxy_id
+
+        # The replicated routing table
+        self.routes_version = -1
+        # Dict[str -> ModelInfo]
+        self.model_info = {}
+        # Dict[int -> GroupInfo]
+        self.group_info = {}
+        # Each proxy balances its own load
+        if isinstance(dispatch_policy, DispatchPolicy):
+            dispatch_policy = copy.deepcopy(dispatch_policy)
+        self.dispatch_policy = get_dispatch_policy(dispatch_policy)
+
+        self.logger = build_logger()
+
+        self.init_http_server(host, port, root_path, ssl_keyfile, ssl_certfile,
+                              reuse_port=True)
+
+    def update_routes(self,
+                      version: int,
+                      group_managers: Dict[int, ActorHandle],
+                      model_info: Dict[str, ModelInfo],
+                      stage_latency: Dict[Tuple[str, int], List[float]]):
+        """Replace the routing table with a newer version."""
+        if version <= self.routes_version:
+            return
+        self.routes_version = version
+
+        for group_id, manager in group_managers.items():
+            if group_id not in self.group_info:
+                self.group_info[group_id] = GroupInfo(
+                    manager=manager, queue_size=0, num_total_requests=0)
+                self.dispatch_policy.add_group(group_id)
+
+        # Apply the difference of replicas to the dispatch policy
+        old_replicas = {(name, group_id) for name, info in self.model_info.items()
+                        for group_id in info.group_ids}
+        new_replicas = {(name, group_id) for name, info in model_info.items()
+                        for group_id in info.group_ids}
+        for name, group_id in old_replicas - new_replicas:
+            self.dispatch_policy.remove_replica(name, group_id)
+        for name, group_id in new_replicas - old_replicas:
+            self.dispatch_policy.add_replica(name, group_id,
+                                             stage_latency[(name, group_id)])
+        self.model_info = model_info
+
+    def get_stats(self):
+        stats = self.get_http_stats()
+        stats["proxy_id"] = self.proxy_id
+        stats["routes_version"] = self.routes_version
+        return stats
+
+    async def shutdown(self):
+        if self.server is not None:
+            self.server.should_exit = True
+        await asyncio.sleep(0.5)
+
+
+@ray.remote(num_cpus=0)
+class Controller(HTTPIngress):
+
+    def __init__(self,
+                 host: str,
+                 port: int,
+                 root_path: str,
+                 ssl_keyfile: Optional[str] = None,
+                 ssl_certfile: Optional[Union[str, os.PathLike]] = None,
+                 dispatch_policy: Union[str, DispatchPolicy, None] = None,
+                 num_proxies: int = 0,
+                 enable_batching: bool = False,
+                 max_batch_wait: float = 0.01):
+        # Controller metadata
+        self.manager_lock = defaultdict(asyncio.Lock)
+
+        # Dict[str -> ModelInfo]
+        self.model_info = {}
+        # Dict[int -> GroupInfo]
+        self.group_info = {}
+        # Dict[(model_name, group_id) -> List[stage_latency]]
+        self.stage_latency = {}
+        # Set[(model_name, group_id)] of the replicas being created
+        self.pending_replicas = set()
+        self.dispatch_policy = get_dispatch_policy(dispatch_policy)
+
+        self.logger = build_logger()
+
+        self.group_manager_class = GroupManager
+        # The default batching options of the group managers
+        self.enable_batching = enable_batching
+        self.max_batch_wait = max_batch_wait
+
+        # Http server
+        self.init_http_server(host, port, root_path, ssl_keyfile, ssl_certfile,
+                              reuse_port=SOCKET_REUSE_PORT_ENABLED or num_proxies > 0)
+
+        # Ingress proxies that share the port with the controller
+        proxy_class = ray.remote(num_cpus=0)(IngressProxy)
+        self.proxies = [
+            proxy_class.options(
+                scheduling_strategy=NodeAffinitySchedulingStrategy(
+                    node_id=ray.get_runtime_context().node_id,
+                    soft=False,
+                )).remote(i, host, port, root_path, ssl_keyfile, ssl_certfile,
+                          dispatch_policy)
+            for i in range(num_proxies)
+        ]
+        self.routes_version = 0
+
+    async def create_mesh_group_manager(
+            self,
+            group_id: int,
+            virtual_mesh_shape: Optional[Tuple[int]] = None,
+            num_gpus: int = 0,
+            enable_batching: Optional[bool] = None,
+            max_batch_wait: Optional[float] = None):
+        assert group_id not in self.group_info, (
+            f"Mesh group {group_id} is already launched")
+        if enable_batching is None:
+            enable_batching = self.enable_batching
+        if max_batch_wait is None:
+            max_batch_wait = self.max_batch_wait
+        self.logger.info(f"Create mesh group manager {group_id} with "
+                         f"shape={virtual_mesh_shape}")
+        manager = (self.group_manager_class.options(
+            name=f"mesh_group_manager_{group_id}",
+            num_gpus=num_gpus).remote(virtual_mesh_shape, enable_batching,
+                                      max_batch_wait))
+        self.group_info[group_id] = GroupInfo(
+            manager=manager, queue_size=0, num_total_requests=0)
+        self.dispatch_policy.add_group(group_id)
+        self.sync_routes()
+
+    async def register_model(self,
+                             name: str,
+                             model_def: Callable,
+                             init_args: Optional[List] = None,
+                             init_kwargs: Optional[Dict] = None,
+                             override: bool = False,
+                             starlette_request: bool = False):
+        """Register a model.
+
+        Args:
+            starlette_request: Whether the replicas of this model receive
+              full Starlette requests. Otherwise, the controller parses the
+              JSON body once and forwards a CompactRequest.
+        """
+        async with self.manager_lock[name]:
+            if name in self.model_info:
+                if override:
+                    for group_id in self.model_info[name].group_ids:
+                        await self.group_info[group_id
+                            ].manager.delete_replica.remote(name)
+                        self.dispatch_policy.remove_replica(name, group_id)
+                else:
+                    raise ValueError(f"Model {name} is already registered")
+
+            self.model_info[name] = ModelInfo(
+                CreateInfo(model_def, init_args, init_kwargs), [], 0,
+                starlette_request)
+            self.sync_routes()
+
+    async def create_replica(self,
+                             name: str,
+                             group_id: int,
+                             append_init_args: Optional[List] = None,
+                             append_init_kwargs: Optional[Dict] = None):
+        async with self.manager_lock[name]:
+            assert group_id in self.group_info, (
+                f"Group {group_id} does not exist")
+            model_info = self.model_info[name]
+            manager = self.group_info[group_id].manager
+            assert (group_id not in model_info.group_ids and
+                    (name, group_id) not in self.pending_replicas), (
+                f"Model {name} is already created on group {group_id}")
+            create_info = model_info.create_info.append_init_args(
+                append_init_args, append_init_kwargs)
+
+            self.logger.info(f"Create replica of {name} on group {group_id}")
+            # Reserve the slot, so the replicas of a model on different
+            # groups are still created concurrently
+            self.pending_replicas.add((name, group_id))
+        try:
+            stage_latency = await manager.create_replica.remote(name, create_info)
+        finally:
+            self.pending_replicas.discard((name, group_id))
+        # Route requests to the replica only after the policy knows it
+        self.dispatch_policy.add_replica(name, group_id, stage_latency)
+        self.stage_latency[(name, group_id)] = stage_latency
+        model_info.group_ids.append(group_id)
+        self.sync_routes()
+
+    def sync_routes(self):
+        """Broadcast the routing table to the ingress proxies."""
+        if not self.proxies:
+            return
+        self.routes_version += 1
+        group_managers = {
+            group_id: info.manager for group_id, info in self.group_info.items()}
+        model_info = {
+            name: ModelInfo(None, list(info.group_ids), 0, info.starlette_request)
+            for name, info in self.model_info.items()}
+        for proxy in self.proxies:
+            proxy.update_routes.remote(self.routes_version, group_managers,
+                                       model_info, dict(self.stage_latency))
+
+    async def get_ingress_stats(self):
+        """Return the HTTP statistics of the controller and each ingress proxy."""
+        stats = self.get_http_stats()
+        stats["proxy_id"] = -1
+        return [stats] + list(await asyncio.gather(
+            *[proxy.get_stats.remote() for proxy in self.proxies]))
+
+    async def handle_request(self, request):
+        ts = [("a", time.time())]
+        name = request["model"]
+
+        assert name in self.model_info, (
+            f"Model '{name}' is not registered.")
+        model_info = self.model_info[name]
+        #assert model_info.group_ids, (
+        #    f"No replica of model '{name}' is created.")
+
+        if not model_info.group_ids:
+            return {"rejected": True}
+        else:
+            # Dispatch
+            group_id = self.select_group_id(name, model_info.group_ids)
+            manager = self.group_info[group_id].manager
+
+            self.dispatch_begin(name, group_id)
+            try:
+                response = await manager.handle_request.remote(name, request)
+            finally:
+                self.dispatch_end(name, group_id)
+
+            response["ts"] = ts + response["ts"]
+
+            return response
+
+    def get_info(self):
+        return {
+            "host": self.host,
+            "port": self.port,
+            "root_path": self.root_path,
+        }
+
+    async def warmup(self):
+        # Warm up each single model replica in each group
+        tasks = []
+        for g in self.group_info.values():
+            tasks.append(g.manager.warmup.remote())
+        ray.get(tasks)
+
+        # Warm up the whole path from the controller to groups
+        for name, info in self.model_info.items():
+            request = {"model": name, "input": "Test"}
+            objs = []
+            for i in range(len(info.group_ids)):
+                objs.append(self.handle_request(request))
+            await asyncio.gather(*objs)
+
+    async def ready(self):
+        await super().ready()
+        await asyncio.gather(*[proxy.ready.remote() for proxy in self.proxies])
+
     async def shutdown(self):
         if self.server is not None:
             self.server.should_exit = True
         tasks = []
         for g in self.group_info.values():
             tasks.append(g.manager.shutdown.remote())
+        for proxy in self.proxies:
+            tasks.append(proxy.shutdown.remote())
         await asyncio.sleep(0.5)
         await asyncio.gather(*tasks)
 
@@ -512,8 +945,15 @@ def run_controller(host,
                    root_path="/",
                    name=CONTROLLER_NAME,
                    ssl_keyfile: Optional[str] = None,
-                   ssl_certfile: Optional[Union[str, os.PathLike]] = None):
-    """Launch a controller"""
+                   ssl_certfile: Optional[Union[str, os.PathLike]] = None,
+                   dispatch_policy: Union[str, DispatchPolicy, None] = None,
+                   num_proxies: int = 0,
+                   enable_batching: bool = False,
+                   max_batch_wait: float = 0.01):
+    """Launch a controller and `num_proxies` ingress proxies on this node.
+
+    With `enable_batching`, the group managers batch the requests of the
+    replicas that implement `handle_batch`."""
     controller = Controller.options(
         name=name,
         scheduling_strategy=NodeAffinitySchedulingStrategy(
@@ -525,6 +965,10 @@ def run_controller(host,
             root_path=root_path,
             ssl_keyfile=ssl_keyfile,
             ssl_certfile=ssl_certfile,
+            dispatch_policy=dispatch_policy,
+            num_proxies=num_proxies,
+            enable_batching=enable_batching,
+            max_batch_wait=max_batch_wait,
         )
     ray.get(controller.ready.remote())
 
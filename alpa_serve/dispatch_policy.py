@@ -0,0 +1,209 @@
+"""Dispatch policies that select a replica group for each request.
+
+A policy object is shared by alpa_serve/controller.py::Controller and
+alpa_serve/simulator/controller.py::Controller, so a policy can be evaluated
+offline in the simulator before it is deployed.
+
+Each group keeps a predicted time at which its first pipeline stage becomes
+free. Dispatching a request to a group predicts its completion time as
+`max(now, free_time) + sum(stage_latency)` and advances the free time by the
+latency of the slowest stage.
+"""
+import random
+from typing import Dict, List, Optional, Sequence, Union
+
+
+class DispatchPolicy:
+    """The base class of dispatch policies."""
+
+    def __init__(self):
+        # Dict[group_id -> predicted time when the first stage is free]
+        self.free_time = {}
+        # Dict[group_id -> number of requests in flight]
+        self.queue_size = {}
+        # Dict[(model_name, group_id) -> (sum of stage latency, max stage latency)]
+        self.latency = {}
+        # Dict[model_name -> List[group_id]]
+        self.model_groups = {}
+
+    def add_group(self, group_id: int):
+        self.free_time[group_id] = 0.0
+        self.queue_size[group_id] = 0
+
+    def add_replica(self, name: str, group_id: int,
+                    stage_latency: Optional[Sequence[float]] = None):
+        stage_latency = stage_latency or [0.0]
+        self.latency[(name, group_id)] = (sum(stage_latency), max(stage_latency))
+        self.model_groups.setdefault(name, []).append(group_id)
+
+    def remove_replica(self, name: str, group_id: int):
+        del self.latency[(name, group_id)]
+        self.model_groups[name].remove(group_id)
+
+    def predict_completion_time(self, name: str, group_id: int, now: float):
+        return max(now, self.free_time[group_id]) + self.latency[(name, group_id)][0]
+
+    def select(self, name: str, group_ids: List[int], now: float):
+        """Select a group among `group_ids` for a request of model `name`.
+
+        The controllers pass the groups of the replicas added with
+        `add_replica`, and policies may index their state on that set, but
+        the returned group is always one of `group_ids`.
+        """
+        raise NotImplementedError()
+
+    def on_dispatch(self, name: str, group_id: int, now: float):
+        self.queue_size[group_id] += 1
+        self.free_time[group_id] = (max(now, self.free_time[group_id]) +
+                                    self.latency[(name, group_id)][1])
+
+    def on_complete(self, name: str, group_id: int, now: float):
+        self.queue_size[group_id] -= 1
+        # Correct the prediction when the group is drained earlier than predicted
+        if self.queue_size[group_id] == 0:
+            self.free_time[group_id] = min(self.free_time[group_id], now)
+
+
+class LeastQueuePolicy(DispatchPolicy):
+    """Scan all groups and select the one with the fewest requests in flight."""
+
+    def select(self, name: str, group_ids: List[int], now: float):
+        return min(group_ids, key=self.queue_size.__getitem__)
+
+
+class IndexedHeapPolicy(DispatchPolicy):
+    """Keep an indexed min-heap of the groups of each model keyed on the
+    predicted completion time.
+
+    Selection is O(1) and each dispatch or completion is O(log #replicas) per
+    model on the group. The heap key is `free_time + latency`, so among groups
+    that are already idle the one that has been idle for the longest wins.
+    """
+
+    def __init__(self):
+        super().__init__()
+        # Dict[model_name -> List[(key, queue_size, group_id)]]
+        self.heaps = {}
+        # Dict[model_name -> Dict[group_id -> position in the heap]]
+        self.positions = {}
+        # Dict[group_id -> List[model_name]]
+        self.group_models = {}
+
+    def add_group(self, group_id: int):
+        super().add_group(group_id)
+        self.group_models[group_id] = []
+
+    def add_replica(self, name: str, group_id: int,
+                    stage_latency: Optional[Sequence[float]] = None):
+        super().add_replica(name, group_id, stage_latency)
+        self.group_models[group_id].append(name)
+        heap = self.heaps.setdefault(name, [])
+        positions = self.positions.setdefault(name, {})
+        heap.append(None)
+        positions[group_id] = len(heap) - 1
+        self.update(name, group_id)
+
+    def remove_replica(self, name: str, group_id: int):
+        heap, positions = self.heaps[name], self.positions[name]
+        i = positions.pop(group_id)
+        last = heap.pop()
+        if i < len(heap):
+            heap[i] = last
+            positions[last[2]] = i
+            self.sift(name, i)
+        self.group_models[group_id].remove(name)
+        super().remove_replica(name, group_id)
+
+    def heap_key(self, name: str, group_id: int):
+        return (self.free_time[group_id] + self.latency[(name, group_id)][0],
+                self.queue_size[group_id], group_id)
+
+    def update(self, name: str, group_id: int):
+        i = self.positions[name][group_id]
+        self.heaps[name][i] = self.heap_key(name, group_id)
+        self.sift(name, i)
+
+    def sift(self, name: str, i: int):
+        heap, positions = self.heaps[name], self.positions[name]
+        item = heap[i]
+        # Sift up
+        while i > 0:
+            parent = (i - 1) // 2
+            if heap[parent] <= item:
+                break
+            heap[i] = heap[parent]
+            positions[heap[i][2]] = i
+            i = parent
+        # Sift down
+        n = len(heap)
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and heap[child + 1] < heap[child]:
+                child += 1
+            if item <= heap[child]:
+                break
+            heap[i] = heap[child]
+            positions[heap[i][2]] = i
+            i = child
+        heap[i] = item
+        positions[item[2]] = i
+
+    def update_group(self, group_id: int):
+        for name in self.group_models[group_id]:
+            self.update(name, group_id)
+
+    def select(self, name: str, group_ids: List[int], now: float):
+        heap = self.heaps.get(name)
+        # The heap holds exactly the groups of the replicas of the model, so
+        # it matches group_ids if the sizes are equal and the top is offered
+        if heap and len(heap) == len(group_ids) and heap[0][2] in group_ids:
+            return heap[0][2]
+        # Otherwise scan the offered groups
+        return min(group_ids, key=lambda g: (
+            self.free_time[g] + self.latency.get((name, g), (0.0, 0.0))[0],
+            self.queue_size[g], g))
+
+    def on_dispatch(self, name: str, group_id: int, now: float):
+        super().on_dispatch(name, group_id, now)
+        self.update_group(group_id)
+
+    def on_complete(self, name: str, group_id: int, now: float):
+        super().on_complete(name, group_id, now)
+        self.update_group(group_id)
+
+
+class PowerOfTwoPolicy(DispatchPolicy):
+    """Sample two groups at random and select the one with the earlier
+    predicted completion time."""
+
+    def __init__(self, seed: int = 0):
+        super().__init__()
+        self.rng = random.Random(seed)
+
+    def select(self, name: str, group_ids: List[int], now: float):
+        if len(group_ids) <= 2:
+            candidates = group_ids
+        else:
+            candidates = self.rng.sample(group_ids, 2)
+        return min(candidates, key=lambda g: (
+            self.predict_completion_time(name, g, now), self.queue_size[g]))
+
+
+dispatch_policies: Dict[str, type] = {
+    "least_queue": LeastQueuePolicy,
+    "indexed_heap": IndexedHeapPolicy,
+    "power_of_two": PowerOfTwoPolicy,
+}
+
+
+def get_dispatch_policy(policy: Union[str, DispatchPolicy, None]):
+    """Create a dispatch policy from its name or return the given object."""
+    if policy is None:
+        return LeastQueuePolicy()
+    if isinstance(policy, str):
+        if policy not in dispatch_policies:
+            raise ValueError(f"Invalid dispatch policy: {policy}")
+        return dispatch_policies[policy]()
+    return policy
@@ -11,7 +11,7 @@ import json
 import random
 import socket
 import traceback
-from typing import Any, Dict, Type
+from typing import Any, Dict, List, Optional, Type
 
 from fastapi.encoders import jsonable_encoder
 import numpy as np
@@ -31,6 +31,18 @@ class HTTPRequestWrapper:
     body: bytes
 
 
+@dataclass
+class CompactRequest:
+    """The fields of a JSON request the group manager needs, plus the raw
+    HTTP body. It is much cheaper to serialize than a HTTPRequestWrapper."""
+    model: str
+    submit_time: Optional[float]
+    slo: Optional[float]
+    idx: Optional[int]
+    body: bytes
+    ts: List
+
+
 def build_starlette_request(request_wrapper):
     """Build and return a Starlette Request from ASGI payload.
 
@@ -1,18 +1,31 @@
 """The baseclass of model placement policy"""
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import dataclasses
 from functools import partial
+import hashlib
+import heapq
+import itertools
 import logging
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+import pickle
 import time
-from typing import List
+from typing import List, Optional, Sequence, Union
 
+import numba
 import numpy as np
 import ray
+from scipy.stats import spearmanr
 
 from alpa_serve.profiling import ProfilingResult, ParallelConfig
-from alpa_serve.simulator.controller import simulate_one_case, approximate_one_case
+from alpa_serve.simulator.controller import (simulate_one_case,
+    approximate_one_case, pack_placements, simulate_requests_mixed_multi)
 from alpa_serve.simulator.executable import Executable
-from alpa_serve.simulator.workload import Workload, GammaProcess
-from alpa_serve.util import ServingCase, inf, to_str_round
+from alpa_serve.simulator.workload import (Workload, GammaProcess,
+    StatsResult, PerModelStatsResult, generate_multi_model_workload)
+from alpa_serve.util import ServingCase, inf, eps, to_str_round
 
 
 @dataclasses.dataclass
@@ -55,6 +68,49 @@ class ModelPlacement:
         assert all(len(set(ms)) == len(ms) for ms in self.group_models)
 
 
+def normalize_indices(sol: ModelPlacement):
+    """Return the group indices of `sol` in the order of `sol.normalize()`."""
+    group_models = [tuple(sorted(x)) for x in sol.group_models]
+    return sorted(range(len(group_models)), key=lambda i: group_models[i])
+
+
+def placement_key(sol: ModelPlacement):
+    """Return a hashable key of the normalized placement."""
+    sol = sol.normalize()
+    return (tuple(tuple(c) for c in sol.group_configs), sol.group_models)
+
+
+def placement_components(sol: ModelPlacement):
+    """Split the groups of `sol` into the connected components of the
+    model-group graph. Returns a list of sorted group id lists."""
+    parent = list(range(len(sol.group_models)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    model2group = {}
+    for g_id, m_ids in enumerate(sol.group_models):
+        for m_id in m_ids:
+            if m_id in model2group:
+                parent[find(g_id)] = find(model2group[m_id])
+            else:
+                model2group[m_id] = g_id
+
+    components = OrderedDict()
+    for g_id in range(len(sol.group_models)):
+        components.setdefault(find(g_id), []).append(g_id)
+    return list(components.values())
+
+
+def component_key(sol: ModelPlacement, g_ids: List[int]):
+    """Return a hashable key of the groups `g_ids` of `sol`."""
+    return tuple((tuple(sol.group_configs[g_id]), tuple(sorted(sol.group_models[g_id])))
+                 for g_id in g_ids)
+
+
 @dataclasses.dataclass
 class ModelPlacementWithReplacement:
     start_times: List[float]
@@ -85,10 +141,34 @@ class ClusterEnv:
 
 
 class BasePlacementPolicy:
-    """The baseclass of placement policy"""
+    """The baseclass of placement policy
+
+    Search policies stop at `time_budget` seconds and return the best
+    placement found so far. If `checkpoint_dir` is set, they periodically
+    save their search state there and resume an interrupted search.
+    """
 
-    def __init__(self, verbose: int = 0):
+    def __init__(self, verbose: int = 0,
+                 time_budget: Optional[float] = None,
+                 checkpoint_dir: Optional[str] = None):
         self.verbose = verbose
+        self.time_budget = time_budget
+        self.checkpoint_dir = checkpoint_dir
+
+    def get_deadline(self):
+        """Return the wall-clock deadline of a search that starts now."""
+        if self.time_budget is None:
+            return None
+        return time.time() + self.time_budget
+
+    def get_checkpoint(self, name: str, model_datas: List[ModelData],
+                       cluster_env: ClusterEnv, workload: Workload):
+        """Return the checkpoint of the search stage `name` on this problem."""
+        if self.checkpoint_dir is None:
+            return None
+        key = workload_fingerprint(model_datas, workload, repr(cluster_env))
+        path = os.path.join(self.checkpoint_dir, f"{name}-{key[:16]}.pkl")
+        return SearchCheckpoint(path, key)
 
     def place_models(self, controller, cluster_env: ClusterEnv,
                      model_datas: List[ModelData], train_workload: Workload = None):
@@ -140,21 +220,122 @@ class BasePlacementPolicy:
         controller.sync()
 
 
+def workload_fingerprint(model_datas: List[ModelData], workload: Workload,
+                         method: str):
+    """Return a hash identifying the simulation inputs other than the placement."""
+    h = hashlib.sha1()
+    h.update(method.encode())
+    h.update(pickle.dumps([(x.name, x.profiling_result) for x in model_datas]))
+    h.update(np.asarray(workload.arrivals, dtype=np.float64).tobytes())
+    model_ids, slos, model_names = workload.get_columns()
+    h.update("\n".join(model_names).encode())
+    h.update(model_ids.tobytes())
+    h.update(slos.tobytes())
+    return h.hexdigest()
+
+
+class SearchCheckpoint:
+    """Save the state of a search to `path` at most every `interval` seconds,
+    so that an interrupted search can resume. A checkpoint is only restored
+    if it was saved with the same `key`."""
+
+    def __init__(self, path: str, key: str, interval: float = 60):
+        self.path = os.path.expanduser(path)
+        self.key = key
+        self.interval = interval
+        self.save_time = time.time()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                key, state = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError, ValueError):
+            return None
+        return state if key == self.key else None
+
+    def save(self, state: dict, force: bool = False):
+        if not force and time.time() - self.save_time < self.interval:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((self.key, state), f)
+        os.replace(tmp_path, self.path)
+        self.save_time = time.time()
+
+
 class PlacementEvaluator:
     """Evaluate the scores of model placements via the simulator or other
-    approximations."""
+    approximations.
+
+    If `parallel` is true, the placements are evaluated by ray tasks
+    (backend="ray") or by a local process pool (backend="process"). A
+    process pool can be shared by several evaluators on the same workload
+    by passing an EvaluatorPool as `pool`; otherwise the evaluator creates
+    its own pool. Call `close` to shut down an owned pool.
+
+    The results are memoized in a bounded LRU cache keyed by the normalized
+    placement. If `cache_dir` (default: $ALPA_SERVE_EVALUATOR_CACHE_DIR) is set,
+    the cache is persisted to `cache_dir/<workload fingerprint>.pkl` and
+    reused across runs.
+
+    `get_stats_incremental` evaluates a placement component by component
+    and reuses the simulation of components that did not change.
+    """
 
     def __init__(self,
                  model_datas: List[ModelData],
                  cluster_env: ClusterEnv,
                  workload: Workload,
                  method: str,
-                 parallel: bool):
+                 parallel: bool,
+                 cache_size: int = 4096,
+                 cache_dir: Optional[str] = None,
+                 backend: str = "ray",
+                 num_workers: Optional[int] = None,
+                 pool: Optional["EvaluatorPool"] = None):
+        assert backend in ["ray", "process"], f"Invalid backend: {backend}"
         self.parallel = parallel
+        self.backend = backend
+        self.pool = None
+        self.owns_pool = False
 
         workload.cached_data = None
 
-        if parallel:
+        # The LRU cache of scores and stats
+        self.cache = OrderedDict()  # Dict[(kind, placement key) -> result]
+        self.cache_size = cache_size
+        self.cache_hits = self.cache_misses = 0
+        self.cache_path = None
+        self.cache_dirty = False
+        self.cache_save_time = time.time()
+        if cache_size > 0:
+            self.fingerprint = workload_fingerprint(model_datas, workload, method)
+            cache_dir = cache_dir or os.environ.get("ALPA_SERVE_EVALUATOR_CACHE_DIR")
+            if cache_dir:
+                cache_dir = os.path.expanduser(cache_dir)
+                os.makedirs(cache_dir, exist_ok=True)
+                self.cache_path = os.path.join(cache_dir, f"{self.fingerprint}.pkl")
+                self.cache.update(self.load_cache_file(self.cache_path))
+                self.shrink_cache()
+
+        if parallel and backend == "process":
+            self.model_datas = model_datas
+            self.cluster_env = cluster_env
+            self.workload = workload
+            self.method = method
+            if pool is None:
+                pool = EvaluatorPool(workload, num_workers)
+                self.owns_pool = True
+            assert pool.workload is workload, "The pool holds another workload"
+            self.pool = pool
+            self.num_workers = pool.num_workers
+            # The workers create a serial evaluator for each problem once
+            self.problem = (next(evaluator_problem_ids), model_datas,
+                            cluster_env, method)
+        elif parallel:
             self.model_datas = ray.put(model_datas)
             self.cluster_env = ray.put(cluster_env)
             self.workload = ray.put(workload)
@@ -172,7 +353,166 @@ class PlacementEvaluator:
             self.get_score_one_sol = self.get_goodput_simulation
             self.get_stats_one_sol = self.get_stats_simulation
 
+        # The fast simulator can evaluate a batch of placements in one kernel
+        self.batched = method == "fast_simulator" and not parallel
+        self.batched_data = None
+
+        # The LRU cache of simulated components for incremental evaluation
+        self.component_cache = OrderedDict()  # Dict[component key -> result]
+        self.component_cache_size = max(cache_size, 4096)
+        self.model_request_indices = None
+        self.delta_evaluations = self.delta_fallbacks = 0
+        self.component_hits = self.component_misses = 0
+        self.simulated_requests = 0
+
+        # The counters of the bound-based pruning
+        self.bound_pruned = self.bound_simulated = 0
+
     def get_scores(self, sols: List[ModelPlacement]):
+        if self.cache_size <= 0:
+            return self.get_scores_impl(sols)
+        return self.get_cached("score", sols, self.get_scores_impl)
+
+    def get_stats(self, sols: List[ModelPlacement]):
+        if self.cache_size <= 0:
+            return self.get_stats_impl(sols)
+        stats = self.get_cached("stats", sols, self.get_stats_impl)
+
+        # The cache holds the stats of the normalized placements.
+        # Map the per-group stats back to the group order of the inputs.
+        ret = []
+        for sol, (goodput, model_goodput, group_num_requests, fullstats) in zip(sols, stats):
+            indices = normalize_indices(sol)
+            tmp = [None] * len(indices)
+            for i, g_id in enumerate(indices):
+                tmp[g_id] = group_num_requests[i]
+            group_num_requests = tuple(tmp)
+            fullstats = dataclasses.replace(fullstats, group_num_requests=group_num_requests)
+            ret.append((goodput, model_goodput, group_num_requests, fullstats))
+        return ret
+
+    def get_cached(self, kind: str, sols: List[ModelPlacement], func):
+        """Look up the results of `sols` in the cache and evaluate the missing
+        ones with `func` on their normalized placements."""
+        keys = [(kind, placement_key(sol)) for sol in sols]
+
+        miss_sols = []
+        miss_keys = {}
+        for sol, key in zip(sols, keys):
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.cache_hits += 1
+            elif key in miss_keys:
+                self.cache_hits += 1
+            else:
+                miss_keys[key] = len(miss_sols)
+                miss_sols.append(sol.normalize())
+                self.cache_misses += 1
+
+        if not miss_sols:
+            return [self.cache[key] for key in keys]
+
+        miss_results = func(miss_sols)
+        rets = [self.cache[key] if key not in miss_keys else
+                miss_results[miss_keys[key]] for key in keys]
+
+        for key, idx in miss_keys.items():
+            self.cache[key] = miss_results[idx]
+        self.shrink_cache()
+        self.cache_dirty = True
+        if self.cache_path is not None and time.time() - self.cache_save_time > 30:
+            self.save_cache()
+        return rets
+
+    def shrink_cache(self):
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def cache_info(self):
+        return {"hits": self.cache_hits, "misses": self.cache_misses,
+                "size": len(self.cache), "max_size": self.cache_size}
+
+    def delta_info(self):
+        """Counters of the incremental evaluation. `saved_simulations` is the
+        number of full simulations of the workload that were avoided."""
+        num_requests = max(len(self.workload), 1) if self.batched else 1
+        return {"evaluations": self.delta_evaluations,
+                "fallbacks": self.delta_fallbacks,
+                "component_hits": self.component_hits,
+                "component_misses": self.component_misses,
+                "simulated_requests": self.simulated_requests,
+                "saved_simulations": (self.delta_evaluations -
+                                      self.simulated_requests / num_requests)}
+
+    def prune_info(self):
+        return {"pruned": self.bound_pruned, "simulated": self.bound_simulated}
+
+    @staticmethod
+    def load_cache_file(path: str):
+        if not os.path.exists(path):
+            return {}
+        try:
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except (EOFError, pickle.UnpicklingError):
+            return {}
+
+    def save_cache(self):
+        """Persist the cache to disk. Entries written by other processes with
+        the same workload fingerprint are merged."""
+        if self.cache_path is None or not self.cache_dirty:
+            return
+
+        cache = self.load_cache_file(self.cache_path)
+        cache.update(self.cache)
+        cache = list(cache.items())[-self.cache_size:]
+
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(OrderedDict(cache), f)
+        os.replace(tmp_path, self.cache_path)
+        self.cache_dirty = False
+        self.cache_save_time = time.time()
+
+    def close(self):
+        """Shut down the process pool if it is owned by this evaluator."""
+        if self.pool is not None:
+            if self.owns_pool:
+                self.pool.close()
+            self.pool = None
+
+    def __del__(self):
+        try:
+            self.save_cache()
+            self.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+    def map_in_workers(self, func, args_list: List[tuple]):
+        """Run `func(*args, evaluator=worker_evaluator)` for each args in the
+        process pool, where worker_evaluator is the serial evaluator of this
+        problem in the worker."""
+        assert self.pool is not None
+        return list(self.pool.map(call_with_worker_evaluator,
+                                  [self.problem] * len(args_list),
+                                  [func] * len(args_list), args_list))
+
+    def evaluate_in_pool(self, kind: str, sols: List[ModelPlacement]):
+        # Send a few large chunks, so the batched kernel is used in the workers
+        # and the pickling cost is amortized
+        num_chunks = min(len(sols), self.num_workers * 2)
+        chunks = [sols[i * len(sols) // num_chunks:(i + 1) * len(sols) // num_chunks]
+                  for i in range(num_chunks)]
+        rets = self.pool.map(evaluate_in_worker, [self.problem] * num_chunks,
+                             [kind] * num_chunks, chunks)
+        return sum(rets, [])
+
+    def get_scores_impl(self, sols: List[ModelPlacement]):
+        if self.batched:
+            return self.get_scores_batched(sols)
+        if self.pool is not None:
+            return self.evaluate_in_pool("score", sols)
+
         scores = [self.get_score_one_sol(sol, self.model_datas,
             self.cluster_env, self.workload, self.method) for sol in sols]
 
@@ -180,7 +520,47 @@ class PlacementEvaluator:
             scores = ray.get(scores)
         return scores
 
-    def get_stats(self, sols: List[ModelPlacement]):
+    def get_scores_with_bounds(self, sols: List[ModelPlacement], k: int):
+        """Return the scores of `sols`, but only simulate the candidates that
+        can still be in the top-k.
+
+        The candidates are simulated in decreasing order of their score upper
+        bounds (see get_score_upper_bounds). Once the k-th best simulated score
+        beats the bounds of all remaining candidates, they are pruned and get
+        a score of -inf. Other methods than the serial fast simulator
+        simulate all candidates.
+        """
+        if not self.batched:
+            self.bound_simulated += len(sols)
+            return self.get_scores(sols)
+
+        upper_bounds = np.array(self.get_score_upper_bounds(sols))
+        order = np.argsort(-upper_bounds, kind="stable")
+        scores = np.full(len(sols), -inf)
+
+        top_k = []  # A min-heap of the k best scores
+        pos = 0
+        while pos < len(order):
+            if len(top_k) == k and upper_bounds[order[pos]] < top_k[0]:
+                break
+            i = order[pos]
+            scores[i] = self.get_scores_incremental([sols[i]])[0]
+            if len(top_k) < k:
+                heapq.heappush(top_k, scores[i])
+            else:
+                heapq.heappushpop(top_k, scores[i])
+            pos += 1
+
+        self.bound_simulated += pos
+        self.bound_pruned += len(sols) - pos
+        return list(scores)
+
+    def get_stats_impl(self, sols: List[ModelPlacement]):
+        if self.batched:
+            return self.get_stats_batched(sols)
+        if self.pool is not None:
+            return self.evaluate_in_pool("stats", sols)
+
         stats = [self.get_stats_one_sol(sol, self.model_datas,
             self.cluster_env, self.workload, self.method) for sol in sols]
 
@@ -188,6 +568,230 @@ class PlacementEvaluator:
             stats = ray.get(stats)
         return stats
 
+    def get_batched_data(self):
+        if self.batched_data is None:
+            name2model_id = {x.name: i for i, x in enumerate(self.model_datas)}
+            model_ids, slos, model_names = self.workload.get_columns()
+            model_ids = np.array([name2model_id.get(m, -1) for m in model_names],
+                                 dtype=np.int32)[model_ids]
+            prof_ress = [x.profiling_result for x in self.model_datas]
+            # The simulator kernels use float32 SLOs
+            self.batched_data = (model_ids, slos.astype(np.float32), prof_ress)
+        return self.batched_data
+
+    def simulate_batched(self, sols: List[ModelPlacement]):
+        """Simulate a batch of placements with the fast simulator in one
+        parallel numba kernel. The requests are shared by all placements."""
+        model_ids, slos, prof_ress = self.get_batched_data()
+
+        (m_id2g_id, group_config_ids, num_groups, config_num_stages,
+         config_stage_latency) = pack_placements(sols, prof_ress)
+        res = simulate_requests_mixed_multi(
+            self.workload.arrivals, model_ids, slos, m_id2g_id, group_config_ids,
+            config_num_stages, config_stage_latency, len(self.workload))
+        return num_groups, res
+
+    def get_scores_batched(self, sols: List[ModelPlacement]):
+        if not sols:
+            return []
+
+        _, (num_good_requests, latency_sum, *_) = self.simulate_batched(sols)
+        num_requests = len(self.workload)
+        goodput = num_good_requests / num_requests
+        latency_mean = latency_sum / num_requests
+        num_replicas = np.array([sum(len(x) for x in sol.group_models) for sol in sols])
+        return list(goodput - latency_mean / 10000 + num_replicas / 1000000)
+
+    def get_stats_batched(self, sols: List[ModelPlacement]):
+        if not sols:
+            return []
+
+        num_groups, (num_good_requests, latency_sum,
+            model_num_requests, model_num_good_requests,
+            group_num_requests, _) = self.simulate_batched(sols)
+        return [self.make_fast_stats(num_good_requests[p], latency_sum[p],
+                                     model_num_requests[p], model_num_good_requests[p],
+                                     group_num_requests[p][:num_groups[p]])
+                for p in range(len(sols))]
+
+    def make_fast_stats(self, num_good_requests, latency_sum, model_num_requests,
+                        model_num_good_requests, group_num_requests):
+        """Assemble the stats tuple of one placement from the aggregated
+        counters. Same as approximate_one_case(fast_stats=True)."""
+        model_names = [x.name for x in self.model_datas]
+        num_requests = len(self.workload)
+        arrivals = self.workload.arrivals
+        interval = arrivals[-1] - arrivals[0]
+
+        per_model_stats = [PerModelStatsResult(
+            model_names[i], model_num_requests[i],
+            model_num_good_requests[i] / (model_num_requests[i] + eps),
+            model_num_requests[i] / interval,
+            0, 0, 0, 0, [], [], []) for i in range(len(model_names))]
+        stats = StatsResult(per_model_stats,
+                            tuple(group_num_requests),
+                            num_good_requests / num_requests,
+                            latency_sum / num_requests,
+                            num_requests, num_requests / interval)
+        model_goodput = [x.goodput for x in per_model_stats]
+        return (stats.goodput, model_goodput, stats.group_num_requests, stats)
+
+    def get_stats_incremental(self, sols: List[ModelPlacement]):
+        """Evaluate the stats of `sols` component by component.
+
+        With the fast simulator, a request only touches the device clocks of
+        the groups of its model, so the connected components of the
+        model-group graph can be simulated independently over the requests of
+        their models. The results of the components are cached, so adding a
+        replica to a placement only re-simulates the component it changes.
+        Other methods fall back to the full simulation.
+        """
+        if not self.batched:
+            self.delta_fallbacks += len(sols)
+            return self.get_stats(sols)
+
+        self.get_model_request_indices()
+        num_models = len(self.model_datas)
+
+        ret = []
+        for sol in sols:
+            num_good_requests, latency_sum = 0, 0.0
+            model_num_requests = np.array([len(x) for x in self.model_request_indices])
+            model_num_good_requests = np.zeros(num_models, dtype=np.int64)
+            group_num_requests = [0] * len(sol.group_configs)
+
+            for g_ids in placement_components(sol):
+                key = component_key(sol, g_ids)
+                if key in self.component_cache:
+                    self.component_cache.move_to_end(key)
+                    self.component_hits += 1
+                    res = self.component_cache[key]
+                else:
+                    self.component_misses += 1
+                    res = self.simulate_component(sol, g_ids)
+                    self.component_cache[key] = res
+                    while len(self.component_cache) > self.component_cache_size:
+                        self.component_cache.popitem(last=False)
+
+                m_ids, comp_num_good, comp_latency_sum, comp_model_num_good, comp_group_num = res
+                num_good_requests += comp_num_good
+                latency_sum += comp_latency_sum
+                model_num_good_requests[m_ids] = comp_model_num_good
+                for g_id, x in zip(g_ids, comp_group_num):
+                    group_num_requests[g_id] = x
+
+            self.delta_evaluations += 1
+            ret.append(self.make_fast_stats(num_good_requests, latency_sum,
+                                            model_num_requests, model_num_good_requests,
+                                            group_num_requests))
+        return ret
+
+    def get_model_request_indices(self):
+        """Return the indices of the requests of each model."""
+        if self.model_request_indices is None:
+            model_ids, _, _ = self.get_batched_data()
+            order = np.argsort(model_ids, kind="stable")
+            splits = np.searchsorted(model_ids[order], np.arange(len(self.model_datas) + 1))
+            self.model_request_indices = [order[splits[i]:splits[i + 1]]
+                                          for i in range(len(self.model_datas))]
+        return self.model_request_indices
+
+    def get_scores_incremental(self, sols: List[ModelPlacement]):
+        num_replicas = [sum(len(x) for x in sol.group_models) for sol in sols]
+        return [stats.goodput - stats.latency_mean / 10000 + n / 1000000
+                for (_, _, _, stats), n in zip(self.get_stats_incremental(sols),
+                                               num_replicas)]
+
+    def get_score_upper_bounds(self, sols: List[ModelPlacement], max_bs: int = 1):
+        """Return optimistic bounds of the scores of `sols` without simulation.
+
+        The components in the component cache (see get_stats_incremental) are
+        exact. In the other components, a model serves at most its own
+        requests, none on a group config with zero capability (see
+        compute_capability), and at most one request per bottleneck stage
+        latency within the workload duration plus its SLO.
+        """
+        model_ids, slos, _ = self.get_batched_data()
+        indices = self.get_model_request_indices()
+        num_models = len(self.model_datas)
+        num_requests = len(self.workload)
+        arrivals = self.workload.arrivals
+        duration = arrivals[-1] - arrivals[0] if num_requests else 0
+        model_num_requests = np.array([len(x) for x in indices])
+
+        capacity = {}  # Dict[(parallel_config, model_id) -> max #good requests]
+
+        def get_capacity(c, m_id):
+            if (c, m_id) in capacity:
+                return capacity[(c, m_id)]
+            model_data = self.model_datas[m_id]
+            latency_mem = model_data.profiling_result.para_dict.get(c, None)
+            model_slos = slos[indices[m_id]]
+            if latency_mem is None or len(model_slos) == 0:
+                cap = 0
+            elif np.any(np.isnan(model_slos)):
+                cap = inf
+            else:
+                slo = float(np.max(model_slos))
+                if compute_capability(dataclasses.replace(model_data, slo=slo),
+                                      c, max_bs) <= 0:
+                    cap = 0
+                else:
+                    bottleneck = min(max(ls) for b, ls in latency_mem.latency.items()
+                                     if b <= max_bs)
+                    cap = (duration + slo) / bottleneck + 1
+            capacity[(c, m_id)] = cap
+            return cap
+
+        bounds = []
+        for sol in sols:
+            num_good_requests, latency_sum = 0, 0.0
+            for g_ids in placement_components(sol):
+                key = component_key(sol, g_ids)
+                if key in self.component_cache:
+                    res = self.component_cache[key]
+                    num_good_requests += res[1]
+                    latency_sum += res[2]
+                    continue
+
+                model_cap = {}
+                for g_id in g_ids:
+                    c = sol.group_configs[g_id]
+                    for m_id in sol.group_models[g_id]:
+                        model_cap[m_id] = model_cap.get(m_id, 0) + get_capacity(c, m_id)
+                num_good_requests += sum(min(model_num_requests[m_id], cap)
+                                         for m_id, cap in model_cap.items())
+            num_replicas = sum(len(x) for x in sol.group_models)
+            bounds.append((num_good_requests - latency_sum / 10000) / num_requests +
+                          num_replicas / 1000000)
+        return bounds
+
+    def simulate_component(self, sol: ModelPlacement, g_ids: List[int]):
+        """Simulate the groups `g_ids` of `sol` over the requests of their models."""
+        model_ids, slos, prof_ress = self.get_batched_data()
+        m_ids = np.array(sorted(set(m for g_id in g_ids for m in sol.group_models[g_id])),
+                         dtype=np.int32)
+        if len(m_ids) == 0:
+            return m_ids, 0, 0.0, np.zeros(0, dtype=np.int64), [0] * len(g_ids)
+
+        indices = np.sort(np.concatenate([self.model_request_indices[m] for m in m_ids]))
+        local_model_ids = np.searchsorted(m_ids, model_ids[indices]).astype(np.int32)
+        sub_sol = ModelPlacement(
+            [sol.group_configs[g_id] for g_id in g_ids],
+            [[int(np.searchsorted(m_ids, m)) for m in sol.group_models[g_id]]
+             for g_id in g_ids])
+
+        (m_id2g_id, group_config_ids, _, config_num_stages,
+         config_stage_latency) = pack_placements([sub_sol], [prof_ress[m] for m in m_ids])
+        (num_good_requests, latency_sum, _, model_num_good_requests,
+         group_num_requests, _) = simulate_requests_mixed_multi(
+            self.workload.arrivals[indices], local_model_ids, slos[indices],
+            m_id2g_id, group_config_ids, config_num_stages, config_stage_latency,
+            len(indices))
+        self.simulated_requests += len(indices)
+        return (m_ids, num_good_requests[0], latency_sum[0], model_num_good_requests[0],
+                list(group_num_requests[0][:len(g_ids)]))
+
     @staticmethod
     def get_goodput_simulation(sol: ModelPlacement,
                                model_datas: List[ModelData],
@@ -264,6 +868,374 @@ class PlacementEvaluator:
         return (stats.goodput, model_goodput, stats.group_num_requests, stats)
 
 
+class MultiFidelityEvaluator:
+    """Evaluate placements by successive halving over workload fidelities.
+
+    All candidates are first scored on short prefixes of the workload
+    (`fidelities` are the fractions of the workload duration of the lower
+    rungs). At each rung, only the top `promote_ratio` of the candidates (at
+    least `min_promoted`) are promoted to the next rung. The last rung is
+    scored by `evaluator` on the full workload.
+
+    A candidate keeps the score of the highest rung it reached. The scores of
+    the candidates that were not promoted are clipped below the scores of the
+    next rung, so the promoted candidates always rank first.
+    The Spearman rank correlation between consecutive rungs is recorded over
+    the promoted candidates to tune the schedule.
+    """
+
+    def __init__(self,
+                 model_datas: List[ModelData],
+                 cluster_env: ClusterEnv,
+                 workload: Workload,
+                 evaluator: PlacementEvaluator,
+                 fidelities: Sequence[float] = (0.25,),
+                 promote_ratio: Union[float, Sequence[float]] = 0.25,
+                 min_promoted: int = 1,
+                 method: str = "fast_simulator"):
+        assert all(0 < x < 1 for x in fidelities), "Fidelities must be in (0, 1)"
+        assert list(fidelities) == sorted(fidelities), "Fidelities must be increasing"
+        if isinstance(promote_ratio, (int, float)):
+            promote_ratio = [promote_ratio] * len(fidelities)
+        assert len(promote_ratio) == len(fidelities)
+
+        self.fidelities = list(fidelities) + [1.0]
+        self.promote_ratio = list(promote_ratio)
+        self.min_promoted = min_promoted
+
+        # The lower rungs simulate a rate-preserving prefix of the workload
+        self.evaluators = []
+        arrivals = workload.arrivals
+        for fidelity in fidelities:
+            end = arrivals[0] + fidelity * (arrivals[-1] - arrivals[0])
+            prefix = workload[:np.searchsorted(arrivals, end, side="right")]
+            self.evaluators.append(PlacementEvaluator(
+                model_datas, cluster_env, prefix, method, False))
+        self.evaluators.append(evaluator)
+
+        self.num_evaluated = [0] * len(self.evaluators)
+        self.rank_correlations = [[] for _ in fidelities]
+
+    def get_scores(self, sols: List[ModelPlacement]):
+        return self.evaluate("score", sols)
+
+    def get_stats(self, sols: List[ModelPlacement]):
+        return self.evaluate("stats", sols)
+
+    def evaluate(self, kind: str, sols: List[ModelPlacement]):
+        results = [None] * len(sols)
+        scores = np.zeros(len(sols))
+        rungs = np.zeros(len(sols), dtype=np.int32)
+
+        cur = np.arange(len(sols))
+        prev_scores = None
+        for r, evaluator in enumerate(self.evaluators):
+            cur_sols = [sols[i] for i in cur]
+            if kind == "score":
+                res = evaluator.get_scores(cur_sols)
+                cur_scores = np.array(res, dtype=np.float64)
+            else:
+                res = evaluator.get_stats(cur_sols)
+                cur_scores = np.array([x[0] for x in res], dtype=np.float64)
+            self.num_evaluated[r] += len(cur)
+
+            if prev_scores is not None and len(cur) >= 3:
+                rho = spearmanr(prev_scores, cur_scores).correlation
+                if not np.isnan(rho):
+                    self.rank_correlations[r - 1].append(rho)
+
+            for i, x, score in zip(cur, res, cur_scores):
+                results[i] = x
+                scores[i] = score
+                rungs[i] = r
+
+            # Promote the top candidates to the next rung
+            if r == len(self.evaluators) - 1:
+                break
+            num_promoted = max(self.min_promoted,
+                               int(np.ceil(self.promote_ratio[r] * len(cur))))
+            order = np.argsort(-cur_scores, kind="stable")[:num_promoted]
+            cur = cur[order]
+            prev_scores = cur_scores[order]
+
+        # Rank the candidates by (rung, score)
+        for r in reversed(range(len(self.evaluators) - 1)):
+            upper = scores[rungs > r]
+            if len(upper):
+                floor = np.nextafter(np.min(upper), -inf)
+                scores[rungs == r] = np.minimum(scores[rungs == r], floor)
+
+        if kind == "score":
+            return list(scores)
+        return [(score,) + tuple(x[1:]) for score, x in zip(scores, results)]
+
+    def fidelity_info(self):
+        return {"fidelities": self.fidelities,
+                "num_evaluated": self.num_evaluated,
+                "rank_correlation": [np.mean(x) if x else None
+                                     for x in self.rank_correlations]}
+
+    def close(self):
+        # The full-fidelity evaluator is owned by the caller
+        for evaluator in self.evaluators[:-1]:
+            evaluator.close()
+
+
+class SurrogateModel:
+    """An online ridge regression that predicts the score of placements.
+
+    The features of a placement are the replica count and the served
+    capacity over the rate of each model, the load share of the groups, and
+    the memory slack. The model is refit on the recent (placement, score)
+    samples from the evaluator. Before a batch of samples is added, the
+    current model predicts their scores to track its out-of-sample error.
+    """
+
+    def __init__(self,
+                 model_datas: List[ModelData],
+                 cluster_env: ClusterEnv,
+                 keep_ratio: float = 0.25,
+                 min_samples: int = 256,
+                 max_samples: int = 16384,
+                 l2_reg: float = 1e-3):
+        self.model_datas = model_datas
+        self.mem_budget = cluster_env.mem_budget
+        self.keep_ratio = keep_ratio
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self.l2_reg = l2_reg
+
+        self.rates = np.array([x.rate for x in model_datas], dtype=np.float64)
+        self.config_info = {}  # Dict[parallel_config -> (bottleneck latency, weight mem)]
+
+        self.xs = []
+        self.ys = []
+        self.weights = None
+        self.errors = []  # List[(predicted, actual)]
+
+    def get_config_info(self, c: ParallelConfig):
+        if c not in self.config_info:
+            latency = np.full(len(self.model_datas), inf)
+            weight_mem = np.full(len(self.model_datas), inf)
+            for m_id, x in enumerate(self.model_datas):
+                value = x.profiling_result.para_dict.get(c, None)
+                if value:
+                    latency[m_id] = max(value.latency[1])
+                    weight_mem[m_id] = max(value.weight_mem)
+            self.config_info[c] = (latency, weight_mem)
+        return self.config_info[c]
+
+    def features(self, sols: List[ModelPlacement]):
+        num_models = len(self.model_datas)
+        ret = np.empty((len(sols), 2 * num_models + 5))
+        for i, sol in enumerate(sols):
+            num_replicas = np.zeros(num_models)
+            for m_ids in sol.group_models:
+                num_replicas[list(m_ids)] += 1
+
+            capacity = np.zeros(num_models)
+            group_load = np.zeros(len(sol.group_models))
+            mem_slack = 0
+            for g_id, (c, m_ids) in enumerate(zip(sol.group_configs, sol.group_models)):
+                if not m_ids:
+                    mem_slack += 1
+                    continue
+                m_ids = list(m_ids)
+                latency, weight_mem = self.get_config_info(c)
+                capacity[m_ids] += 1 / latency[m_ids] / len(m_ids)
+                group_load[g_id] = min(np.sum(self.rates[m_ids] / num_replicas[m_ids] *
+                                              latency[m_ids]), 4)
+                mem_slack += 1 - np.sum(weight_mem[m_ids]) / self.mem_budget
+
+            ret[i, :num_models] = num_replicas
+            ret[i, num_models:2 * num_models] = np.minimum(
+                capacity / (self.rates + eps), 4)
+            ret[i, 2 * num_models:] = (
+                np.max(group_load), np.mean(group_load), np.mean(group_load > 1),
+                mem_slack / len(sol.group_models), 1)
+        return ret
+
+    def is_ready(self):
+        return self.weights is not None
+
+    def predict(self, sols: List[ModelPlacement]):
+        return self.features(sols) @ self.weights
+
+    def update(self, sols: List[ModelPlacement], scores: List[float]):
+        xs = self.features(sols)
+        ys = np.asarray(scores, dtype=np.float64)
+        if self.is_ready():
+            self.errors.extend(zip(xs @ self.weights, ys))
+
+        self.xs.append(xs)
+        self.ys.append(ys)
+        num_samples = sum(len(x) for x in self.ys)
+        while num_samples - len(self.ys[0]) >= self.max_samples:
+            num_samples -= len(self.ys.pop(0))
+            self.xs.pop(0)
+        if num_samples < self.min_samples:
+            return
+
+        # Ridge regression
+        x = np.concatenate(self.xs)
+        y = np.concatenate(self.ys)
+        a = x.T @ x + self.l2_reg * num_samples * np.eye(x.shape[1])
+        self.weights = np.linalg.solve(a, x.T @ y)
+
+    def get_state(self):
+        return {"xs": self.xs, "ys": self.ys, "weights": self.weights,
+                "errors": self.errors}
+
+    def set_state(self, state: dict):
+        self.xs, self.ys, self.weights, self.errors = (
+            state["xs"], state["ys"], state["weights"], state["errors"])
+
+    def select(self, sols: List[ModelPlacement]):
+        """Return the top `keep_ratio` of `sols` by the predicted score."""
+        if not self.is_ready() or not sols:
+            return sols
+        num_keep = max(1, int(np.ceil(len(sols) * self.keep_ratio)))
+        order = np.argsort(-self.predict(sols), kind="stable")[:num_keep]
+        return [sols[i] for i in order]
+
+    def error_info(self):
+        if not self.errors:
+            return {"num_samples": sum(len(x) for x in self.ys), "num_predictions": 0}
+        predicted, actual = map(np.array, zip(*self.errors))
+        rho = spearmanr(predicted, actual).correlation if len(actual) > 2 else None
+        return {"num_samples": sum(len(x) for x in self.ys),
+                "num_predictions": len(actual),
+                "mae": float(np.mean(np.abs(predicted - actual))),
+                "rmse": float(np.sqrt(np.mean((predicted - actual) ** 2))),
+                "rank_correlation": rho}
+
+
+# The problem ids of the evaluators that share a process pool
+evaluator_problem_ids = itertools.count()
+
+# The workload and the serial evaluators of a process pool worker
+worker_shm = None
+worker_columns = None
+worker_evaluators = OrderedDict()  # Dict[problem id -> PlacementEvaluator]
+worker_max_evaluators = 8
+
+
+def shared_workload_columns(shm: shared_memory.SharedMemory, num_requests: int):
+    n = num_requests
+    return (np.ndarray((n,), dtype=np.float64, buffer=shm.buf),
+            np.ndarray((n,), dtype=np.int32, buffer=shm.buf, offset=16 * n),
+            np.ndarray((n,), dtype=np.float64, buffer=shm.buf, offset=8 * n))
+
+
+class EvaluatorPool:
+    """A process pool whose workers evaluate placements with serial
+    PlacementEvaluators.
+
+    The request arrays of `workload` are shipped to the workers once through
+    shared memory. Each task carries its problem (model datas, cluster env
+    and method), and a worker creates the serial evaluator of a problem on
+    its first task, so one pool serves all the evaluators of a search on the
+    same workload (e.g., the ecos of a separation).
+    """
+
+    def __init__(self, workload: Workload, num_workers: Optional[int] = None):
+        self.workload = workload
+        self.num_workers = num_workers or os.cpu_count()
+
+        n = len(workload)
+        model_ids, slos, model_names = workload.get_columns()
+
+        # Layout: arrivals (float64), slos (float64), model_ids (int32)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(20 * n, 1))
+        arrivals_buf, model_ids_buf, slos_buf = shared_workload_columns(self.shm, n)
+        arrivals_buf[:] = workload.arrivals
+        model_ids_buf[:] = model_ids
+        slos_buf[:] = slos
+        del arrivals_buf, model_ids_buf, slos_buf
+
+        # Use spawn because forking a process that has started the numba
+        # thread pool can deadlock
+        self.pool = ProcessPoolExecutor(
+            self.num_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_evaluator_worker,
+            initargs=(self.shm.name, n, model_names))
+
+    def map(self, func, *iterables):
+        return self.pool.map(func, *iterables)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.shm.close()
+            self.shm.unlink()
+            self.pool = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:  # pylint: disable=broad-except
+            pass
+
+
+def init_evaluator_worker(shm_name: str, num_requests: int, model_names: List[str]):
+    global worker_shm, worker_columns
+
+    # The workers already run in parallel
+    numba.set_num_threads(1)
+
+    # Keep the shared memory mapped, the workload columns are views of it
+    worker_shm = shared_memory.SharedMemory(name=shm_name)
+    worker_columns = (*shared_workload_columns(worker_shm, num_requests), model_names)
+
+
+def get_worker_evaluator(problem: tuple):
+    problem_id, model_datas, cluster_env, method = problem
+    if problem_id in worker_evaluators:
+        worker_evaluators.move_to_end(problem_id)
+        return worker_evaluators[problem_id]
+
+    # Each evaluator gets its own Workload object, because the simulator
+    # caches data that depends on the models in the workload
+    workload = Workload.from_columns(*worker_columns)
+    evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                   method, False, cache_size=0)
+    worker_evaluators[problem_id] = evaluator
+    while len(worker_evaluators) > worker_max_evaluators:
+        worker_evaluators.popitem(last=False)
+    return evaluator
+
+
+def evaluate_in_worker(problem: tuple, kind: str, sols: List[ModelPlacement]):
+    evaluator = get_worker_evaluator(problem)
+    if kind == "score":
+        return evaluator.get_scores(sols)
+    return evaluator.get_stats(sols)
+
+
+def call_with_worker_evaluator(problem: tuple, func, args: tuple):
+    return func(*args, evaluator=get_worker_evaluator(problem))
+
+
+def compute_capability(model_data, parallel_config, max_bs):
+    slo = model_data.slo
+    latency_mem = model_data.profiling_result.para_dict.get(parallel_config, None)
+
+    if latency_mem is None:
+        return 0
+
+    num_stages = parallel_config.pp
+    max_cap = 0
+    for b, ls in latency_mem.latency.items():
+        if b > max_bs:
+            continue
+
+        # slo = sum(ls) + (n-1) * max(ls)
+        # so, n = ceil((slo - sum(ls)) / max(ls)) + 1
+        max_cap = max(max_cap, (slo - sum(ls)) // max(ls) + 1)
+
+    return max_cap * (0.99 ** num_stages)
+
+
 def gen_train_workload(model_datas: List[ModelData],
                        seed: int = 0,
                        simulation_min_duration: float = 100,
@@ -272,12 +1244,10 @@ def gen_train_workload(model_datas: List[ModelData],
     total_rate = sum(d.rate for d in model_datas)
     duration = max(simulation_min_duration, simulation_min_samples / total_rate)
 
-    ws = []
-    for i, data in enumerate(model_datas):
-        ws.append(GammaProcess(data.rate, data.cv).generate_workload(
-            data.name, 0, duration=duration,
-            slo=data.slo, seed=seed + i))
-    train_workload = Workload.merge(*ws)
+    train_workload = generate_multi_model_workload(
+        [GammaProcess(data.rate, data.cv) for data in model_datas],
+        [data.name for data in model_datas], 0, duration,
+        slos=[data.slo for data in model_datas], seed=seed)
     return train_workload
 
 
@@ -331,8 +1301,15 @@ def replica_placement_fast_greedy(init_sol: ModelPlacement,
                                   cluster_env: ClusterEnv,
                                   workload: Workload,
                                   evaluator: PlacementEvaluator,
-                                  verbose: int):
-    """Use a fast greedy heuristic to place replicas on groups."""
+                                  verbose: int,
+                                  incremental: bool = True,
+                                  deadline: Optional[float] = None):
+    """Use a fast greedy heuristic to place replicas on groups.
+
+    If `incremental` is true, each step only re-simulates the groups
+    connected to the changed group (see PlacementEvaluator.get_stats_incremental).
+    The greedy stops adding replicas at the wall-clock `deadline`.
+    """
     tic = time.time()
 
     if evaluator is None:
@@ -356,9 +1333,11 @@ def replica_placement_fast_greedy(init_sol: ModelPlacement,
     # Greedy placement
     sol = init_sol
     it = 0
+    get_stats = evaluator.get_stats_incremental if incremental else evaluator.get_stats
+    saved_simulations = evaluator.delta_info()["saved_simulations"]
 
     while True:
-        stats = evaluator.get_stats([sol])[0]
+        stats = get_stats([sol])[0]
         overall_goodput, goodputs, group_num_requests, fullstats = stats
 
         # Find the most unserved model and the most available group
@@ -397,17 +1376,45 @@ def replica_placement_fast_greedy(init_sol: ModelPlacement,
                   f"best placement: {sol}, ")
         it += 1
 
+        if deadline is not None and time.time() > deadline:
+            break
+
+    if verbose >= 1 and incremental:
+        saved_simulations = evaluator.delta_info()["saved_simulations"] - saved_simulations
+        print(f"fast greedy: iters: {it}, saved simulations: {saved_simulations:.1f}, "
+              f"elapsed: {time.time() - tic:.2f}")
+
     return sol
 
 
+def replica_placement_fast_greedy_in_worker(init_sol: ModelPlacement,
+                                            verbose: int,
+                                            deadline: Optional[float],
+                                            evaluator: PlacementEvaluator):
+    """Run replica_placement_fast_greedy with the evaluator of a process pool worker."""
+    return replica_placement_fast_greedy(
+        init_sol, evaluator.model_datas, evaluator.cluster_env,
+        evaluator.workload, evaluator, verbose, deadline=deadline)
+
+
 def replica_placement_beam_search(init_sol: ModelPlacement,
                                   model_datas: List[ModelData],
                                   cluster_env: ClusterEnv,
                                   workload: Workload,
                                   evaluator: PlacementEvaluator,
                                   beam_size: int,
-                                  verbose: int):
-    """Use beam search to place replicas on groups."""
+                                  verbose: int,
+                                  deadline: Optional[float] = None,
+                                  checkpoint: Optional[SearchCheckpoint] = None,
+                                  prune: bool = True):
+    """Use beam search to place replicas on groups.
+
+    The search stops at the wall-clock `deadline` and returns the best
+    placement so far. If `checkpoint` is given, the search state is saved
+    periodically and a previous search is resumed from it.
+    If `prune` is true, the candidates whose score upper bound cannot reach
+    the top-k of their layer are not simulated.
+    """
     tic = time.time()
 
     if evaluator is None:
@@ -436,7 +1443,20 @@ def replica_placement_beam_search(init_sol: ModelPlacement,
     best_sol = init_sol
     visited = set()
 
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None:
+        it, beam, best_score, best_sol, visited = (
+            state["it"], state["beam"], state["best_score"], state["best_sol"],
+            state["visited"])
+
+    def get_state():
+        return {"it": it, "beam": beam, "best_score": best_score,
+                "best_sol": best_sol, "visited": visited}
+
     while True:
+        if deadline is not None and time.time() > deadline:
+            break
+
         # Expand one layer
         next_sols = []
         for sol in beam:
@@ -458,7 +1478,10 @@ def replica_placement_beam_search(init_sol: ModelPlacement,
             break
 
         # Pick the new top-k
-        next_scores = evaluator.get_scores(next_sols)
+        if prune and isinstance(evaluator, PlacementEvaluator):
+            next_scores = evaluator.get_scores_with_bounds(next_sols, beam_size)
+        else:
+            next_scores = evaluator.get_scores(next_sols)
         next_indices = np.argsort(next_scores)[::-1][:beam_size]
 
         beam = []
@@ -476,6 +1499,16 @@ def replica_placement_beam_search(init_sol: ModelPlacement,
                   f"best placement: {best_sol}, ")
         it += 1
 
+        if checkpoint is not None:
+            checkpoint.save(get_state())
+
+    if checkpoint is not None:
+        checkpoint.save(get_state(), force=True)
+    if verbose >= 1 and isinstance(evaluator, MultiFidelityEvaluator):
+        print(f"multi-fidelity: {evaluator.fidelity_info()}")
+    if verbose >= 1 and prune and isinstance(evaluator, PlacementEvaluator):
+        print(f"bound pruning: {evaluator.prune_info()}")
+
     return best_sol
 
 
@@ -485,8 +1518,13 @@ def replica_placement_on_last_group(init_sol: ModelPlacement,
                                     workload: Workload,
                                     evaluator: PlacementEvaluator,
                                     beam_size: int,
-                                    verbose: int):
-    """Use beam search to place replicas on the last group."""
+                                    verbose: int,
+                                    deadline: Optional[float] = None,
+                                    checkpoint: Optional[SearchCheckpoint] = None):
+    """Use beam search to place replicas on the last group.
+
+    The deadline and checkpoint work as in replica_placement_beam_search.
+    """
     tic = time.time()
 
     if evaluator is None:
@@ -515,7 +1553,20 @@ def replica_placement_on_last_group(init_sol: ModelPlacement,
     best_sol = init_sol
     visited = set()
 
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None:
+        it, beam, best_score, best_sol, visited = (
+            state["it"], state["beam"], state["best_score"], state["best_sol"],
+            state["visited"])
+
+    def get_state():
+        return {"it": it, "beam": beam, "best_score": best_score,
+                "best_sol": best_sol, "visited": visited}
+
     while True:
+        if deadline is not None and time.time() > deadline:
+            break
+
         # Expand one layer
         next_sols = []
         for sol in beam:
@@ -577,6 +1628,12 @@ def replica_placement_on_last_group(init_sol: ModelPlacement,
                   f"best placement: {best_sol}, ")
         it += 1
 
+        if checkpoint is not None:
+            checkpoint.save(get_state())
+
+    if checkpoint is not None:
+        checkpoint.save(get_state(), force=True)
+
     return best_sol
 
 
@@ -625,7 +1682,18 @@ def evolutionary_search(init_sols: List[ModelPlacement],
                         cluster_env: ClusterEnv,
                         evaluator: PlacementEvaluator,
                         num_iter: int,
-                        verbose: int):
+                        verbose: int,
+                        deadline: Optional[float] = None,
+                        checkpoint: Optional[SearchCheckpoint] = None,
+                        surrogate: Optional[SurrogateModel] = None):
+    """Evolve a population of placements for `num_iter` iterations.
+
+    The search stops at the wall-clock `deadline` and returns the best
+    placement so far. If `checkpoint` is given, the search state is saved
+    periodically and a previous search is resumed from it.
+    If `surrogate` is given, it is trained on the evaluated placements and
+    only its top predicted children are simulated.
+    """
     tic = time.time()
 
     # Constants
@@ -651,6 +1719,23 @@ def evolutionary_search(init_sols: List[ModelPlacement],
 
     # Iterative search
     cur_sols = init_sols
+
+    state = checkpoint.load() if checkpoint is not None else None
+    if state is not None:
+        it, cur_sols, best_score, best_sol, visited = (
+            state["it"], state["cur_sols"], state["best_score"], state["best_sol"],
+            state["visited"])
+        np.random.set_state(state["random_state"])
+        # Resume with the trained surrogate
+        if surrogate is not None and state.get("surrogate") is not None:
+            surrogate.set_state(state["surrogate"])
+
+    def get_state():
+        return {"it": it, "cur_sols": cur_sols, "best_score": best_score,
+                "best_sol": best_sol, "visited": visited,
+                "random_state": np.random.get_state(),
+                "surrogate": surrogate.get_state() if surrogate is not None else None}
+
     while it < num_iter:
         stats = evaluator.get_stats(cur_sols)
         scores = np.array([x[0] for x in stats])
@@ -662,6 +1747,12 @@ def evolutionary_search(init_sols: List[ModelPlacement],
             best_score = scores[tmp_best_idx]
             best_sol = cur_sols[tmp_best_idx]
 
+        if surrogate is not None:
+            surrogate.update(cur_sols, scores)
+
+        if deadline is not None and time.time() > deadline:
+            break
+
         next_sols = []
         while len(next_sols) < pop_size:
             idx = np.random.choice(len(scores), p=weights)
@@ -712,8 +1803,20 @@ def evolutionary_search(init_sols: List[ModelPlacement],
                   f"best sol: {best_sol}, ")
 
         it += 1
+        if surrogate is not None:
+            next_sols = surrogate.select(next_sols)
         cur_sols = next_sols + [best_sol]
 
+        if checkpoint is not None:
+            checkpoint.save(get_state())
+
+    if checkpoint is not None:
+        checkpoint.save(get_state(), force=True)
+    if verbose >= 1 and isinstance(evaluator, MultiFidelityEvaluator):
+        print(f"multi-fidelity: {evaluator.fidelity_info()}")
+    if verbose >= 1 and surrogate is not None:
+        print(f"surrogate: {surrogate.error_info()}")
+
     return best_sol
 
 
@@ -5,7 +5,7 @@ import logging
 import math
 import multiprocessing
 import time
-from typing import List, Tuple
+from typing import List, Optional, Sequence, Tuple
 
 import numpy as np
 import ray
@@ -13,10 +13,13 @@ import ray
 from alpa_serve.profiling import ParallelConfig
 from alpa_serve.placement_policy.base_policy import (
     BasePlacementPolicy, ModelData, ClusterEnv, ModelPlacement,
-    PlacementEvaluator, gen_train_workload,
+    PlacementEvaluator, EvaluatorPool, MultiFidelityEvaluator, SurrogateModel,
+    gen_train_workload,
+    compute_capability,
     replica_placement_round_robin,
-    replica_placement_fast_greedy, replica_placement_beam_search,
-    replica_placement_on_last_group, evolutionary_search)
+    replica_placement_fast_greedy, replica_placement_fast_greedy_in_worker,
+    replica_placement_beam_search, replica_placement_on_last_group,
+    evolutionary_search)
 from alpa_serve.simulator.controller import simulate_one_case
 from alpa_serve.simulator.executable import Executable
 from alpa_serve.simulator.workload import Workload, GammaProcess
@@ -26,26 +29,6 @@ from alpa_serve.util import (
     ServingCase, eps)
 
 
-def compute_capability(model_data, parallel_config, max_bs):
-    slo = model_data.slo
-    latency_mem = model_data.profiling_result.para_dict.get(parallel_config, None)
-
-    if latency_mem is None:
-        return 0
-
-    num_stages = parallel_config.pp
-    max_cap = 0
-    for b, ls in latency_mem.latency.items():
-        if b > max_bs:
-            continue
-
-        # slo = sum(ls) + (n-1) * max(ls)
-        # so, n = ceil((slo - sum(ls)) / max(ls)) + 1
-        max_cap = max(max_cap, (slo - sum(ls)) // max(ls) + 1)
-
-    return max_cap * (0.99 ** num_stages)
-
-
 class ModelParallelismILP(BasePlacementPolicy):
     def __init__(self, verbose: int = 0):
         super().__init__(verbose=verbose)
@@ -209,8 +192,11 @@ class ModelParallelismGreedy(BasePlacementPolicy):
 
     def __init__(self, group_size: int = 2,
                  use_evo_search: bool = False,
+                 time_budget: Optional[float] = None,
+                 checkpoint_dir: Optional[str] = None,
                  verbose: int = 0):
-        super().__init__(verbose=verbose)
+        super().__init__(verbose=verbose, time_budget=time_budget,
+                         checkpoint_dir=checkpoint_dir)
 
         self.group_size = group_size
         self.use_evo_search = use_evo_search
@@ -223,6 +209,8 @@ class ModelParallelismGreedy(BasePlacementPolicy):
         if train_workload is None:
             train_workload = gen_train_workload(model_datas)
 
+        deadline = self.get_deadline()
+
         # Run greedy placement
         evaluator = PlacementEvaluator(model_datas, cluster_env, train_workload,
                                        "fast_simulator", False)
@@ -233,22 +221,28 @@ class ModelParallelismGreedy(BasePlacementPolicy):
                              [[] for _ in range(num_groups)])
         sol = replica_placement_fast_greedy(
             sol, model_datas, cluster_env, train_workload,
-            evaluator, self.verbose)
+            evaluator, self.verbose, deadline=deadline)
 
         if self.use_evo_search:
+            checkpoint = self.get_checkpoint("evolutionary_search", model_datas,
+                                             cluster_env, train_workload)
             sol = evolutionary_search([sol], model_datas, cluster_env,
-                                      evaluator, 200, self.verbose)
+                                      evaluator, 200, self.verbose,
+                                      deadline=deadline, checkpoint=checkpoint)
         return sol, None
 
 
 def solve_separation_placement(self,
                                eco_separation: List[Tuple[List[ModelData], ClusterEnv]],
                                model_id_map,
-                               train_workload: Workload):
+                               train_workload: Workload,
+                               deadline: Optional[float] = None,
+                               pool: Optional[EvaluatorPool] = None):
     sol = ModelPlacement([],[])
     for i, eco in enumerate(eco_separation):
         sub_model_datas, sub_cluster_env = eco
-        eco_sol, _ = self.solve_placement_one_eco(sub_model_datas, sub_cluster_env, train_workload)
+        eco_sol, _ = self.solve_placement_one_eco(sub_model_datas, sub_cluster_env,
+                                                  train_workload, deadline, pool)
         sol.group_configs += eco_sol.group_configs
         sol.group_models += [[model_id_map[(i, model_id)] for model_id in group]
                              for group in eco_sol.group_models]
@@ -299,8 +293,18 @@ class ModelParallelismSearch(BasePlacementPolicy):
                  max_op: int = 4,
                  use_evo_search: bool = False,
                  use_separation: bool = False,
+                 parallel_evaluator: bool = False,
+                 parallel_initial_placement: bool = False,
+                 parallel_backend: str = "ray",
+                 num_workers: Optional[int] = None,
+                 fidelities: Optional[Sequence[float]] = None,
+                 promote_ratio: float = 0.25,
+                 use_surrogate: bool = False,
+                 time_budget: Optional[float] = None,
+                 checkpoint_dir: Optional[str] = None,
                  verbose: int = 0):
-        super().__init__(verbose=verbose)
+        super().__init__(verbose=verbose, time_budget=time_budget,
+                         checkpoint_dir=checkpoint_dir)
 
         self.max_bs = max_bs
         self.max_pp = max_pp
@@ -312,39 +316,87 @@ class ModelParallelismSearch(BasePlacementPolicy):
         self.use_separation = use_separation
 
         self.evaluator_method = "fast_simulator"
-        self.parallel_evaluator = False
-        self.parallel_initial_placement = False
+        self.parallel_evaluator = parallel_evaluator
+        self.parallel_initial_placement = parallel_initial_placement
+        # The backend of parallel evaluation. Choices: {"ray", "process"}
+        self.parallel_backend = parallel_backend
+        # The number of worker processes of the "process" backend
+        self.num_workers = num_workers
+        # The workload fractions of the low-fidelity rungs of the evolutionary
+        # search. None disables the multi-fidelity evaluation.
+        self.fidelities = fidelities
+        self.promote_ratio = promote_ratio
+        # Pre-filter the children of the evolutionary search with a surrogate
+        self.use_surrogate = use_surrogate
 
         if ((self.parallel_evaluator or self.parallel_initial_placement)
-            and not ray.is_initialized()):
+            and self.parallel_backend == "ray" and not ray.is_initialized()):
             ray.init(address="auto", ignore_reinit_error=True)
 
 
     def solve_placement_one_eco(self,
                                 model_datas: List[ModelData],
                                 cluster_env: ClusterEnv,
-                                train_workload: Workload = None):
+                                train_workload: Workload = None,
+                                deadline: Optional[float] = None,
+                                pool: Optional[EvaluatorPool] = None):
+        use_pool = self.use_process_pool()
         evaluator = PlacementEvaluator(model_datas, cluster_env, train_workload,
-            self.evaluator_method, self.parallel_evaluator)
+            self.evaluator_method, self.parallel_evaluator or use_pool,
+            backend=self.parallel_backend, num_workers=self.num_workers, pool=pool)
+        try:
+            return self.solve_placement_one_eco_impl(
+                model_datas, cluster_env, train_workload, deadline, evaluator)
+        finally:
+            evaluator.close()
+
+    def use_process_pool(self):
+        return (self.parallel_backend == "process" and
+                (self.parallel_evaluator or self.parallel_initial_placement))
+
+    def solve_placement_one_eco_impl(self,
+                                     model_datas: List[ModelData],
+                                     cluster_env: ClusterEnv,
+                                     train_workload: Workload,
+                                     deadline: Optional[float],
+                                     evaluator: PlacementEvaluator):
+        use_pool = self.use_process_pool()
 
         # Get initial solutions
         initial_sols = self.enumerate_group_configs_uneven(cluster_env)
 
-        if self.parallel_initial_placement:
+        if self.parallel_initial_placement and use_pool:
+            initial_sols = evaluator.map_in_workers(
+                replica_placement_fast_greedy_in_worker,
+                [(sol, self.verbose, deadline) for sol in initial_sols])
+        elif self.parallel_initial_placement:
             func = ray.remote(replica_placement_fast_greedy).remote
             for i in range(len(initial_sols)):
                 initial_sols[i] = func(
                     initial_sols[i], model_datas, cluster_env, train_workload, None,
-                    self.verbose)
+                    self.verbose, deadline=deadline)
             initial_sols = ray.get(initial_sols)
         else:
+            # Resume the finished initial solutions from the checkpoint
+            checkpoint = self.get_checkpoint("initial_sols", model_datas,
+                                             cluster_env, train_workload)
+            done_sols = checkpoint and checkpoint.load() or []
             for i in range(len(initial_sols)):
+                if i < len(done_sols):
+                    initial_sols[i] = done_sols[i]
+                    continue
+                if i > 0 and deadline is not None and time.time() > deadline:
+                    initial_sols = initial_sols[:i]
+                    break
                 initial_sols[i] = replica_placement_fast_greedy(
                     initial_sols[i], model_datas, cluster_env, train_workload, evaluator,
-                    self.verbose)
+                    self.verbose, deadline=deadline)
                 #initial_sols[i] = replica_placement_beam_search(
                 #    initial_sols[i], model_datas, cluster_env, train_workload, evaluator,
                 #     self.beam_size, self.verbose)
+                # Do not checkpoint a placement cut short by the deadline
+                if checkpoint is not None and (deadline is None or time.time() <= deadline):
+                    checkpoint.save(initial_sols[:i + 1], force=True)
 
         scores = evaluator.get_scores(initial_sols)
         best_idx = np.argmax(scores)
@@ -416,7 +468,30 @@ class ModelParallelismSearch(BasePlacementPolicy):
         if train_workload is None:
             train_workload = gen_train_workload(model_datas)
 
-        best_sol, _ = self.solve_placement_one_eco(model_datas, cluster_env, train_workload)
+        deadline = self.get_deadline()
+
+        # Share one process pool among all the evaluators of the search, so
+        # the workers are spawned and warmed up only once
+        pool = None
+        try:
+            if self.use_process_pool():
+                pool = EvaluatorPool(train_workload, self.num_workers)
+            return self.solve_placement_impl(model_datas, cluster_env, train_workload,
+                                             deadline, pool)
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def solve_placement_impl(self,
+                             model_datas: List[ModelData],
+                             cluster_env: ClusterEnv,
+                             train_workload: Workload,
+                             deadline: Optional[float],
+                             pool: Optional[EvaluatorPool]):
+        best_sol, _ = self.solve_placement_one_eco(model_datas, cluster_env, train_workload,
+                                                   deadline, pool)
+        if not (self.use_separation or self.use_evo_search):
+            return best_sol, {}
 
         # Separate unequal model
         if self.use_separation:
@@ -431,28 +506,46 @@ class ModelParallelismSearch(BasePlacementPolicy):
 
             sols = []
             for eco_separation in eco_separations:
-                sols.append(func(self, eco_separation, model_id_map, train_workload))
+                if deadline is not None and time.time() > deadline:
+                    break
+                sols.append(func(self, eco_separation, model_id_map, train_workload,
+                                 deadline, pool))
 
             if parallel:
                 sols = ray.get(sols)
 
-            evaluator = PlacementEvaluator(model_datas, cluster_env, train_workload,
-                self.evaluator_method, self.parallel_evaluator)
-            scores = evaluator.get_scores(sols)
-            best_idx = np.argmax(scores)
-
-            evaluator = PlacementEvaluator(model_datas, cluster_env, train_workload,
-                self.evaluator_method, self.parallel_evaluator)
-            score_mixed = evaluator.get_scores([best_sol])[0]
-
-            print(f"score_mixed: {score_mixed:.3f}, score_separate: {scores[best_idx]:.3f}")
-            if scores[best_idx] > score_mixed:
-                best_sol = sols[best_idx]
-
-        if self.use_evo_search:
-            best_sol = evolutionary_search(
-                [best_sol], model_datas, cluster_env,
-                evaluator, 200, self.verbose)
+        # Create the evaluator of the whole problem after the ecos are solved,
+        # because a serial evaluator resets the simulator cache of the workload
+        evaluator = PlacementEvaluator(model_datas, cluster_env, train_workload,
+            self.evaluator_method, self.parallel_evaluator,
+            backend=self.parallel_backend, num_workers=self.num_workers, pool=pool)
+        search_evaluator = evaluator
+        try:
+            if self.use_separation and sols:
+                scores = evaluator.get_scores(sols)
+                best_idx = np.argmax(scores)
+                score_mixed = evaluator.get_scores([best_sol])[0]
+
+                print(f"score_mixed: {score_mixed:.3f}, score_separate: {scores[best_idx]:.3f}")
+                if scores[best_idx] > score_mixed:
+                    best_sol = sols[best_idx]
+
+            if self.use_evo_search:
+                if self.fidelities:
+                    search_evaluator = MultiFidelityEvaluator(model_datas, cluster_env,
+                        train_workload, evaluator, self.fidelities, self.promote_ratio)
+                checkpoint = self.get_checkpoint("evolutionary_search", model_datas,
+                                                 cluster_env, train_workload)
+                surrogate = (SurrogateModel(model_datas, cluster_env)
+                             if self.use_surrogate else None)
+                best_sol = evolutionary_search(
+                    [best_sol], model_datas, cluster_env,
+                    search_evaluator, 200, self.verbose,
+                    deadline=deadline, checkpoint=checkpoint, surrogate=surrogate)
+        finally:
+            if search_evaluator is not evaluator:
+                search_evaluator.close()
+            evaluator.close()
         return best_sol, {}
 
 
@@ -2,7 +2,7 @@
 import logging
 import multiprocessing
 import time
-from typing import List
+from typing import List, Optional
 
 import numpy as np
 import ray
@@ -11,7 +11,8 @@ from alpa_serve.profiling import ParallelConfig
 from alpa_serve.placement_policy.base_policy import (
     BasePlacementPolicy, ModelPlacement, ModelData, ClusterEnv,
     PlacementEvaluator, gen_train_workload, ModelPlacementWithReplacement,
-    replica_placement_fast_greedy, replica_placement_beam_search)
+    replica_placement_fast_greedy, replica_placement_beam_search,
+    evolutionary_search)
 from alpa_serve.simulator.workload import Workload
 from alpa_serve.util import eps, inf, to_str_round
 
@@ -125,8 +126,12 @@ class SelectiveReplicationILP(BasePlacementPolicy):
 
 class SelectiveReplicationGreedy(BasePlacementPolicy):
 
-    def __init__(self, use_evo_search: bool = False, verbose: int = 0):
-        super().__init__(verbose=verbose)
+    def __init__(self, use_evo_search: bool = False,
+                 time_budget: Optional[float] = None,
+                 checkpoint_dir: Optional[str] = None,
+                 verbose: int = 0):
+        super().__init__(verbose=verbose, time_budget=time_budget,
+                         checkpoint_dir=checkpoint_dir)
 
         self.use_evo_search = use_evo_search
 
@@ -138,6 +143,8 @@ class SelectiveReplicationGreedy(BasePlacementPolicy):
         if train_workload is None:
             train_workload = gen_train_workload(model_datas)
 
+        deadline = self.get_deadline()
+
         # Run greedy placement
         evaluator = PlacementEvaluator(model_datas, cluster_env, train_workload,
                                        "fast_simulator", False)
@@ -146,10 +153,14 @@ class SelectiveReplicationGreedy(BasePlacementPolicy):
 
         sol = replica_placement_fast_greedy(
             sol, model_datas, cluster_env, train_workload,
-            evaluator, self.verbose)
+            evaluator, self.verbose, deadline=deadline)
 
         if self.use_evo_search:
-            sol = evolutionary_search([sol], model_datas, evaluator, self.verbose)
+            checkpoint = self.get_checkpoint("evolutionary_search", model_datas,
+                                             cluster_env, train_workload)
+            sol = evolutionary_search([sol], model_datas, cluster_env, evaluator,
+                                      200, self.verbose,
+                                      deadline=deadline, checkpoint=checkpoint)
         return sol, None
 
 
@@ -178,8 +189,12 @@ class SelectiveReplicationUniform(BasePlacementPolicy):
 
 class SelectiveReplicationSearch(BasePlacementPolicy):
 
-    def __init__(self, verbose: int = 0):
-        super().__init__(verbose=verbose)
+    def __init__(self,
+                 time_budget: Optional[float] = None,
+                 checkpoint_dir: Optional[str] = None,
+                 verbose: int = 0):
+        super().__init__(verbose=verbose, time_budget=time_budget,
+                         checkpoint_dir=checkpoint_dir)
 
         self.beam_size = 3
 
@@ -197,17 +212,24 @@ class SelectiveReplicationSearch(BasePlacementPolicy):
         num_groups = cluster_env.num_devices
         sol = ModelPlacement([ParallelConfig(1,1,1)] * num_groups, [[] for _ in range(num_groups)])
 
+        checkpoint = self.get_checkpoint("beam_search", model_datas,
+                                         cluster_env, train_workload)
         sol = replica_placement_beam_search(
             sol, model_datas, cluster_env, train_workload,
-            evaluator, self.beam_size, self.verbose)
+            evaluator, self.beam_size, self.verbose,
+            deadline=self.get_deadline(), checkpoint=checkpoint)
         return sol, None
 
 
 class SelectiveReplicationReplacement(BasePlacementPolicy):
 
     def __init__(self, replacement_interval: int,
-                 use_evo_search: bool = False, verbose: int = 0):
-        super().__init__(verbose=verbose)
+                 use_evo_search: bool = False,
+                 time_budget: Optional[float] = None,
+                 checkpoint_dir: Optional[str] = None,
+                 verbose: int = 0):
+        super().__init__(verbose=verbose, time_budget=time_budget,
+                         checkpoint_dir=checkpoint_dir)
 
         self.replacement_interval = replacement_interval
         self.use_evo_search = use_evo_search
@@ -221,6 +243,7 @@ class SelectiveReplicationReplacement(BasePlacementPolicy):
             train_workload = gen_train_workload(model_datas)
 
         ws = train_workload.split_time_interval(self.replacement_interval)
+        deadline = self.get_deadline()
 
         start_times = []
         placements = []
@@ -233,10 +256,14 @@ class SelectiveReplicationReplacement(BasePlacementPolicy):
 
             sol = replica_placement_fast_greedy(
                 sol, model_datas, cluster_env, ws[i],
-                evaluator, self.verbose)
+                evaluator, self.verbose, deadline=deadline)
 
             if self.use_evo_search:
-                sol = evolutionary_search([sol], model_datas, evaluator, self.verbose)
+                checkpoint = self.get_checkpoint("evolutionary_search", model_datas,
+                                                 cluster_env, ws[i])
+                sol = evolutionary_search([sol], model_datas, cluster_env, evaluator,
+                                          200, self.verbose,
+                                          deadline=deadline, checkpoint=checkpoint)
 
             start_times.append(ws[i].arrivals[0])
             placements.append(sol)
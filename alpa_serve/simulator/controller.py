@@ -11,19 +11,20 @@ import heapq
 from itertools import cycle
 import math
 import time
-from typing import Callable, List, Dict, Optional, Tuple
+from typing import Callable, List, Dict, Optional, Tuple, Union
 
 import numpy as np
 import numba
 
 from alpa_serve.controller import CreateInfo, ModelInfo, GroupInfo, build_logger
+from alpa_serve.dispatch_policy import DispatchPolicy, get_dispatch_policy
 from alpa_serve.profiling import ProfilingResult
 from alpa_serve.simulator.cluster import VirtualMesh
 from alpa_serve.simulator.event_loop import (timed_coroutine, clock,
     main_loop, sleep, run_event_loop)
 from alpa_serve.simulator.util import install_remote_methods, async_to_sync
 from alpa_serve.simulator.workload import (Workload, StatsResult,
-    PerDeviceStatsResult, PerModelStatsResult, DEFAULT_WARMUP)
+    PerDeviceStatsResult, PerModelStatsResult, StreamingStats, DEFAULT_WARMUP)
 from alpa_serve.util import ServingCase, inf, eps, to_str_round, batchsize_config
 
 
@@ -70,6 +71,8 @@ class GroupManager:
         else:
             self.latency_dict[name] = defaultdict(lambda: [0])
 
+        return list(self.latency_dict[name][1])
+
     @timed_coroutine
     async def handle_request(self, name: str, request):
         request.time_stamp["b"] = clock()
@@ -106,7 +109,7 @@ class Controller:
     This class copies most of the code from the real class.
     """
 
-    def __init__(self):
+    def __init__(self, dispatch_policy: Union[str, DispatchPolicy, None] = None):
         # Controller metadata
         self.manager_lock = defaultdict(asyncio.Lock)
 
@@ -114,6 +117,7 @@ class Controller:
         self.model_info = {}
         # Dict[int -> GroupInfo]
         self.group_info = {}
+        self.dispatch_policy = get_dispatch_policy(dispatch_policy)
 
         self.logger = build_logger("controller")
 
@@ -142,6 +146,7 @@ class Controller:
             num_gpus=num_gpus).remote(virtual_mesh_shape))
         self.group_info[group_id] = GroupInfo(
             manager=manager, queue_size=0, num_total_requests=0)
+        self.dispatch_policy.add_group(group_id)
 
     def register_model(self,
                        name: str,
@@ -153,6 +158,7 @@ class Controller:
             if override:
                 for group_id in self.model_info[name].group_ids:
                     self.group_info[group_id].manager.delete_replica.remote(name)
+                    self.dispatch_policy.remove_replica(name, group_id)
             else:
                 raise ValueError(f"Model {name} is already registered")
 
@@ -175,17 +181,11 @@ class Controller:
 
         self.logger.debug(f"Create replica of {name} on group {group_id}")
         model_info.group_ids.append(group_id)
-        manager.create_replica.remote(name, create_info)
-
-    def select_group_id(self, group_ids):
-        min_id = -1
-        min_size = math.inf
-        for group_id in group_ids:
-            if self.group_info[group_id].queue_size < min_size:
-                min_size = self.group_info[group_id].queue_size
-                min_id = group_id
-        assert min_id != -1
-        return min_id
+        stage_latency = manager.create_replica.remote(name, create_info)
+        self.dispatch_policy.add_replica(name, group_id, stage_latency)
+
+    def select_group_id(self, name, group_ids):
+        return self.dispatch_policy.select(name, group_ids, clock())
 
     @timed_coroutine
     async def handle_request(self, request):
@@ -200,14 +200,16 @@ class Controller:
             return None
 
         # Dispatch
-        group_id = self.select_group_id(model_info.group_ids)
+        group_id = self.select_group_id(name, model_info.group_ids)
         manager = self.group_info[group_id].manager
 
         self.group_info[group_id].queue_size += 1
+        self.dispatch_policy.on_dispatch(name, group_id, clock())
         response = await manager.handle_request.remote(name, request,
             delay=next(self.dispatch_overhead))
         self.group_info[group_id].queue_size -= 1
         self.group_info[group_id].num_total_requests += 1
+        self.dispatch_policy.on_complete(name, group_id, clock())
 
         return response
 
@@ -259,12 +261,19 @@ async def run_workload(client, workload, warmup):
     return client.compute_stats(workload, warmup=warmup)
 
 
-def simulate_one_case(case: ServingCase, warmup=DEFAULT_WARMUP, debug=False):
-    """Simulate a serving case."""
+def simulate_one_case(case: ServingCase, warmup=DEFAULT_WARMUP, debug=False,
+                      engine="asyncio", dispatch_policy=None):
+    """Simulate a serving case.
+
+    Args:
+        engine: The event loop engine. See `run_event_loop`.
+        dispatch_policy: The dispatch policy of the controller.
+          See `alpa_serve.dispatch_policy`.
+    """
     register_models, generate_workload, place_models = case
 
     # Launch the controller
-    controller = Controller()
+    controller = Controller(dispatch_policy)
     register_models(controller)
     placement = place_models(controller)
 
@@ -273,7 +282,7 @@ def simulate_one_case(case: ServingCase, warmup=DEFAULT_WARMUP, debug=False):
     workload = generate_workload()
 
     # Run workloads
-    stats = run_event_loop(run_workload(client, workload, warmup))
+    stats = run_event_loop(run_workload(client, workload, warmup), engine=engine)
     stats.group_num_requests = tuple(
         x.num_total_requests for x in controller.group_info.values())
     return stats, placement
@@ -311,7 +320,11 @@ def approximate_one_case(case: ServingCase,
                          debug: bool = False,
                          fast_stats: bool = False,
                          enable_batching: bool = False):
-    """A fast simulator that only simulates one stage for a pipeline."""
+    """A fast simulator that only simulates one stage for a pipeline.
+
+    `generate_workload` can also return an iterable of time-ordered workload
+    chunks (e.g., from `Trace.replay_chunks`), which are simulated one by one.
+    """
     from alpa_serve.placement_policy.base_policy import (
         ModelPlacement, ModelPlacementWithReplacement)
 
@@ -319,6 +332,9 @@ def approximate_one_case(case: ServingCase,
     register_models, generate_workload, place_models = case
 
     workload = generate_workload()
+    if not isinstance(workload, Workload):
+        return approximate_one_case_chunks(case, workload, warmup, fast_stats,
+                                           enable_batching)
 
     if workload.enable_simulator_cache and workload.cached_data:
         model_ids, slos, model_names, prof_ress = workload.cached_data
@@ -332,8 +348,11 @@ def approximate_one_case(case: ServingCase,
         model_names, prof_ress = zip(*controller.name2profiling.items())
 
         name2model_id = {m: i for i, m in enumerate(model_names)}
-        model_ids = np.array([name2model_id.get(r.model_name, -1) for r in workload.requests], dtype=np.int32)
-        slos = np.array([r.slo for r in workload.requests], dtype=np.float32)
+        model_ids, slos, workload_model_names = workload.get_columns()
+        model_ids = np.array([name2model_id.get(m, -1) for m in workload_model_names],
+                             dtype=np.int32)[model_ids]
+        # The simulator kernels use float32 SLOs
+        slos = slos.astype(np.float32)
 
         if workload.enable_simulator_cache:
             workload.cached_data = (model_ids, slos, model_names, prof_ress)
@@ -407,7 +426,124 @@ def approximate_one_case(case: ServingCase,
     return stats, placement
 
 
-def approximate_one_case_one_placement(placement, model_names, prof_ress, model_ids, slos, arrivals, mixed = True, enable_batching = False):
+def approximate_one_case_chunks(case: ServingCase,
+                                chunks,
+                                warmup: int = DEFAULT_WARMUP,
+                                fast_stats: bool = False,
+                                enable_batching: bool = False):
+    """Run the fast simulator on an iterable of time-ordered workload chunks.
+
+    The device clocks and the statistics are carried across chunks, so the
+    memory is bounded by the chunk size instead of the workload length.
+    The first and last `warmup` seconds are skipped by time, and the latency
+    percentiles are estimated with histograms (see `StreamingStats`).
+    Requests of unregistered models are not included in the statistics.
+    """
+    from alpa_serve.placement_policy.base_policy import ModelPlacement
+
+    register_models, _, place_models = case
+    controller = DummyController()
+    register_models(controller)
+    placement = place_models(controller)
+    model_names, prof_ress = zip(*controller.name2profiling.items())
+    name2model_id = {m: i for i, m in enumerate(model_names)}
+
+    if isinstance(placement, ModelPlacement):
+        placements, change_times = [placement], [inf]
+    else:
+        placements, change_times = placement.placements, placement.start_times[1:] + [inf]
+
+    acc = StreamingStats(model_names)
+    model_num_requests = model_num_good_requests = 0
+    group_num_requests = group_num_good_requests = 0
+    num_requests = num_good = 0
+    latency_sum = 0.0
+    first_start = last_start = None
+    pending = []  # The results in the last `warmup` seconds
+
+    def add_results(model_ids, start, finish, good):
+        nonlocal pending
+        valid = model_ids >= 0
+        pending.append((model_ids[valid], start[valid], finish[valid], good[valid]))
+        model_ids, start, finish, good = [np.concatenate(x) for x in zip(*pending)]
+        # Skip the first `warmup` seconds, and hold back the last ones
+        lo = np.searchsorted(start, first_start + warmup, side="left")
+        hi = max(np.searchsorted(start, start[-1] - warmup, side="right"), lo)
+        acc.update(model_ids[lo:hi], start[lo:hi], finish[lo:hi], good[lo:hi])
+        pending = [(model_ids[hi:], start[hi:], finish[hi:], good[hi:])]
+
+    # Follow the same placement switching rule as `approximate_one_case`:
+    # switch to placement pt+1 at the first request after change_times[pt].
+    pt, state = 0, {}
+    num_seen, next_split_min = 0, 0
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        arrivals = np.asarray(chunk.arrivals, dtype=np.float64)
+        model_ids, slos, chunk_model_names = chunk.get_columns()
+        model_ids = np.array([name2model_id.get(m, -1) for m in chunk_model_names],
+                             dtype=np.int32)[model_ids]
+        slos = slos.astype(np.float32)
+
+        lo = 0
+        while lo < len(arrivals):
+            split = max(np.searchsorted(arrivals, change_times[pt], side="right") + num_seen,
+                        next_split_min)
+            hi = min(split - num_seen, len(arrivals))
+            if hi > lo:
+                (start, finish, good, m_num_requests, m_num_good_requests,
+                 g_num_requests, g_num_good_requests) = approximate_one_case_one_placement(
+                     placements[pt], model_names, prof_ress, model_ids[lo:hi],
+                     slos[lo:hi], arrivals[lo:hi], enable_batching=enable_batching,
+                     state=state)
+                model_num_requests = model_num_requests + m_num_requests
+                model_num_good_requests = model_num_good_requests + m_num_good_requests
+                group_num_requests = group_num_requests + g_num_requests
+                group_num_good_requests = group_num_good_requests + g_num_good_requests
+
+                num_requests += len(start)
+                num_good += int(np.sum(good))
+                latency_sum += float(np.sum(finish - start))
+                if first_start is None:
+                    first_start = start[0]
+                last_start = start[-1]
+                if not fast_stats:
+                    add_results(model_ids[lo:hi], start, finish, good)
+            if hi < len(arrivals):
+                # Switch to the next placement
+                pt += 1
+                state = {}
+                next_split_min = split + 1
+            lo = hi
+        num_seen += len(arrivals)
+
+    if fast_stats:
+        # Note: no warmup
+        interval = last_start - first_start
+        per_model_stats = [PerModelStatsResult(
+            model_names[i], model_num_requests[i],
+            model_num_good_requests[i] / (model_num_requests[i] + eps),
+            model_num_requests[i] / interval,
+            0, 0, 0, 0, [], [], []) for i in range(len(model_names))]
+        stats = StatsResult(per_model_stats, tuple(group_num_requests),
+                            num_good / num_requests, latency_sum / num_requests,
+                            num_requests, num_requests / interval)
+    else:
+        stats = acc.result()
+        stats.group_num_requests = tuple(group_num_requests)
+    return stats, placement
+
+
+def approximate_one_case_one_placement(placement, model_names, prof_ress, model_ids, slos, arrivals, mixed = True, enable_batching = False,
+                                       state = None):
+    """Simulate the requests on one placement.
+
+    If `state` (a dict) is given, the device clocks are kept in it and carried
+    over to the next call, so a workload can be simulated chunk by chunk.
+    """
+    if state is not None and enable_batching:
+        raise NotImplementedError("Chunked simulation does not support batching.")
+
     # Load constants
     group_configs, group_models = placement.group_configs, placement.group_models
 
@@ -480,6 +616,7 @@ def approximate_one_case_one_placement(placement, model_names, prof_ress, model_
     finish = np.empty(num_requests, dtype=np.float64)
     good = np.empty(num_requests, dtype=bool)
     tstamps = arrivals
+    state = {} if state is None else state
 
     if mixed:
         if enable_batching:
@@ -488,28 +625,33 @@ def approximate_one_case_one_placement(placement, model_names, prof_ress, model_
                 finish, good, tstamps, model_ids, slos, m_id2g_id, g_id2m_id,
                 num_stages, stage_latency, num_requests)
         else:
+            device_clocks = state.setdefault(
+                "device_clocks", np.zeros((num_groups, max_num_stages), dtype=np.float64))
             (model_num_requests, model_num_good_requests,
             group_num_requests, group_num_good_requests) = simulate_requests_mixed(
                 finish, good, tstamps, model_ids, slos, m_id2g_id,
-                num_stages, stage_latency, num_requests)
+                num_stages, stage_latency, num_requests, device_clocks)
     else:
+        group_clocks = state.setdefault(
+            "group_clocks", np.zeros(num_groups, dtype=np.float64))
         (model_num_requests, model_num_good_requests,
          group_num_requests, group_num_good_requests) = simulate_requests(
             finish, good, tstamps, model_ids, slos, m_id2g_id,
-            group_max_latency, group_sum_latency, num_requests)
+            group_max_latency, group_sum_latency, num_requests, group_clocks)
 
     return (start, finish, good,
             model_num_requests, model_num_good_requests,
             group_num_requests, group_num_good_requests)
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def simulate_requests(finish, good, tstamps, model_ids, slos, m_id2g_id,
-                      group_max_latency, group_sum_latency, num_requests):
+                      group_max_latency, group_sum_latency, num_requests,
+                      group_clocks):
+    # group_clocks: num_groups, updated in place
     num_models = len(group_max_latency)
     num_groups = len(group_max_latency[0])
 
-    group_clocks = np.zeros(num_groups, dtype=np.float64)
     group_num_requests = np.zeros(num_groups, dtype=np.int32)
     group_num_good_requests = np.zeros(num_groups, dtype=np.int32)
     model_num_requests = np.zeros(num_models, dtype=np.int32)
@@ -558,16 +700,16 @@ def simulate_requests(finish, good, tstamps, model_ids, slos, m_id2g_id,
             group_num_requests, group_num_good_requests)
 
 
-@numba.jit(nopython=True)
+@numba.jit(nopython=True, cache=True)
 def simulate_requests_mixed(finish, good, tstamps, model_ids, slos, m_id2g_id,
-                            num_stages, stage_latency, num_requests):
+                            num_stages, stage_latency, num_requests, device_clocks):
     # num_stages: num_groups
     # stage_latency: num_models * num_groups * max_num_stages
+    # device_clocks: num_groups * max_num_stages, updated in place
     num_models = len(stage_latency)
     num_groups = len(stage_latency[0])
     max_num_stages = len(stage_latency[0][0])
 
-    device_clocks = np.zeros((num_groups, max_num_stages), dtype=np.float64)
     group_num_requests = np.zeros(num_groups, dtype=np.int32)
     group_num_good_requests = np.zeros(num_groups, dtype=np.int32)
     model_num_requests = np.zeros(num_models, dtype=np.int32)
@@ -627,7 +769,272 @@ def simulate_requests_mixed(finish, good, tstamps, model_ids, slos, m_id2g_id,
     return (model_num_requests, model_num_good_requests,
             group_num_requests, group_num_good_requests)
 
-# @numba.jit(nopython=True)
+def pack_placements(placements, prof_ress):
+    """Pack a list of placements into padded arrays for
+    simulate_requests_mixed_multi.
+
+    The stage latency of each distinct group config is computed only once
+    and shared by all placements.
+    """
+    max_bs = 1
+    num_placements = len(placements)
+    num_models = len(prof_ress)
+    max_num_groups = max(len(p.group_configs) for p in placements)
+
+    config2id = {}
+    # m_id2g_id: (num_placements, num_models, max_num_groups)
+    m_id2g_id = np.full((num_placements, num_models, max_num_groups), -1, dtype=np.int32)
+    # group_config_ids: (num_placements, max_num_groups)
+    group_config_ids = np.zeros((num_placements, max_num_groups), dtype=np.int32)
+    num_groups = np.empty(num_placements, dtype=np.int32)
+    for p_id, placement in enumerate(placements):
+        num_replicas = [0] * num_models
+        num_groups[p_id] = len(placement.group_configs)
+        for g_id, (c, m_ids) in enumerate(zip(placement.group_configs,
+                                              placement.group_models)):
+            if c not in config2id:
+                config2id[c] = len(config2id)
+            group_config_ids[p_id][g_id] = config2id[c]
+            for m_id in m_ids:
+                m_id2g_id[p_id][m_id][num_replicas[m_id]] = g_id
+                num_replicas[m_id] += 1
+
+    # config_num_stages: (num_configs,)
+    configs = list(config2id.keys())
+    config_num_stages = np.array([c.pp for c in configs], dtype=np.int32)
+    max_num_stages = np.max(config_num_stages)
+    # config_stage_latency: (num_configs, num_models, max_num_stages)
+    config_stage_latency = np.empty((len(configs), num_models, max_num_stages), dtype=np.float32)
+    for c_id, c in enumerate(configs):
+        for m_id in range(num_models):
+            value = prof_ress[m_id].para_dict.get(c, None)
+            if value:
+                penalty = 0.009 * len(value.latency[max_bs])
+                for k in range(config_num_stages[c_id]):
+                    config_stage_latency[c_id][m_id][k] = value.latency[max_bs][k] * (1 + penalty)
+            else:
+                config_stage_latency[c_id][m_id][:] = np.inf
+
+    return m_id2g_id, group_config_ids, num_groups, config_num_stages, config_stage_latency
+
+
+@numba.jit(nopython=True, parallel=True, cache=True)
+def simulate_requests_mixed_multi(tstamps, model_ids, slos, m_id2g_id, group_config_ids,
+                                  config_num_stages, config_stage_latency, num_requests):
+    """Run simulate_requests_mixed for many placements over the same requests.
+    Placements are simulated in parallel. Only the aggregated statistics are
+    returned."""
+    # m_id2g_id: num_placements * num_models * max_num_groups
+    # group_config_ids: num_placements * max_num_groups
+    # config_num_stages: num_configs
+    # config_stage_latency: num_configs * num_models * max_num_stages
+    num_placements = m_id2g_id.shape[0]
+    num_models = m_id2g_id.shape[1]
+    max_num_groups = m_id2g_id.shape[2]
+    max_num_stages = config_stage_latency.shape[2]
+
+    num_good_requests = np.zeros(num_placements, dtype=np.int64)
+    latency_sum = np.zeros(num_placements, dtype=np.float64)
+    group_num_requests = np.zeros((num_placements, max_num_groups), dtype=np.int32)
+    group_num_good_requests = np.zeros((num_placements, max_num_groups), dtype=np.int32)
+    model_num_requests = np.zeros((num_placements, num_models), dtype=np.int32)
+    model_num_good_requests = np.zeros((num_placements, num_models), dtype=np.int32)
+    fixed_overhead = 0.011
+
+    for p in numba.prange(num_placements):
+        device_clocks = np.zeros((max_num_groups, max_num_stages), dtype=np.float64)
+        tmp_time = np.zeros(max_num_stages, dtype=np.float64)
+        config_ids = group_config_ids[p]
+
+        for i in range(num_requests):
+            tstamp, m_id, slo = tstamps[i], model_ids[i], slos[i]
+
+            if m_id < 0:
+                continue
+
+            model_num_requests[p][m_id] += 1
+
+            # Select group id
+            g_id = -1
+            min_device_clock = inf
+            for j in m_id2g_id[p][m_id]:
+                if j < 0:
+                    break
+                tmp = device_clocks[j][config_num_stages[config_ids[j]] - 1]
+                if tmp < min_device_clock:
+                    min_device_clock = tmp
+                    g_id = j
+
+            if g_id < 0:
+                continue
+
+            c_id = config_ids[g_id]
+            t = tstamp
+            for k in range(config_num_stages[c_id]):
+                t = max(t, device_clocks[g_id][k]) + config_stage_latency[c_id][m_id][k]
+                tmp_time[k] = t
+
+            finish_time = t + fixed_overhead
+            group_num_requests[p][g_id] += 1
+
+            if finish_time - tstamp <= slo:
+                latency_sum[p] += finish_time - tstamp
+                num_good_requests[p] += 1
+                for k in range(config_num_stages[c_id]):
+                    device_clocks[g_id][k] = tmp_time[k]
+                group_num_good_requests[p][g_id] += 1
+                model_num_good_requests[p][m_id] += 1
+
+    return (num_good_requests, latency_sum,
+            model_num_requests, model_num_good_requests,
+            group_num_requests, group_num_good_requests)
+
+
+batchsize_config_np = np.array(batchsize_config, dtype=np.int32)
+
+
+@numba.jit(nopython=True, cache=True)
+def heap_less(heap_t, heap_g, i, j):
+    # Order by (idle_tstamp, group_id), the same as python tuples
+    return heap_t[i] < heap_t[j] or (heap_t[i] == heap_t[j] and heap_g[i] < heap_g[j])
+
+
+@numba.jit(nopython=True, cache=True)
+def heap_swap(heap_t, heap_g, i, j):
+    heap_t[i], heap_t[j] = heap_t[j], heap_t[i]
+    heap_g[i], heap_g[j] = heap_g[j], heap_g[i]
+
+
+@numba.jit(nopython=True, cache=True)
+def heap_push(heap_t, heap_g, size, t, g):
+    heap_t[size] = t
+    heap_g[size] = g
+    i = size
+    while i > 0:
+        parent = (i - 1) // 2
+        if heap_less(heap_t, heap_g, i, parent):
+            heap_swap(heap_t, heap_g, i, parent)
+            i = parent
+        else:
+            break
+    return size + 1
+
+
+@numba.jit(nopython=True, cache=True)
+def heap_pop(heap_t, heap_g, size):
+    t, g = heap_t[0], heap_g[0]
+    size -= 1
+    heap_t[0], heap_g[0] = heap_t[size], heap_g[size]
+    i = 0
+    while True:
+        left, right = 2 * i + 1, 2 * i + 2
+        smallest = i
+        if left < size and heap_less(heap_t, heap_g, left, smallest):
+            smallest = left
+        if right < size and heap_less(heap_t, heap_g, right, smallest):
+            smallest = right
+        if smallest == i:
+            break
+        heap_swap(heap_t, heap_g, i, smallest)
+        i = smallest
+    return t, g, size
+
+
+@numba.jit(nopython=True, cache=True)
+def batching_select_model(group_id, g_id2m_id, queue_head, queue_tail, queue_data, tstamps):
+    # select the model with the earliest request in the queue
+    min_arrival = inf
+    select_model_id = -1
+    for tmp_id in g_id2m_id[group_id]:
+        if tmp_id < 0:
+            break
+        if (queue_head[tmp_id] < queue_tail[tmp_id] and
+            tstamps[queue_data[queue_head[tmp_id]]] < min_arrival):
+            min_arrival = tstamps[queue_data[queue_head[tmp_id]]]
+            select_model_id = tmp_id
+    return select_model_id
+
+
+@numba.jit(nopython=True, cache=True)
+def batching_check_slo(tstamp, device_clocks, num_stages, stage_latency,
+                       model_id, group_id, bs_idx, deadline, fixed_overhead):
+    t = tstamp
+    for k in range(num_stages[group_id]):
+        t = max(device_clocks[group_id][k], t) + stage_latency[model_id][group_id][k][bs_idx]
+    return t + fixed_overhead <= deadline
+
+
+@numba.jit(nopython=True, cache=True)
+def batching_handle_requests(tstamp, model_id, group_id,
+                             finish, good, tstamps, slos, g_id2m_id,
+                             num_stages, stage_latency, device_clocks,
+                             group_idle_tstamp, tmp_time,
+                             queue_head, queue_tail, queue_data,
+                             heap_t, heap_g, heap_size,
+                             group_num_requests, group_num_good_requests,
+                             model_num_good_requests, fixed_overhead):
+    num_bs = len(stage_latency[0][0][0])
+
+    while model_id != -1:
+        # Drop requests which will exceed deadline even run alone immediately
+        req_id = -1
+        while queue_head[model_id] < queue_tail[model_id]:
+            tmp = queue_data[queue_head[model_id]]
+            queue_head[model_id] += 1
+            if batching_check_slo(tstamp, device_clocks, num_stages,
+                                  stage_latency, model_id, group_id, 0,
+                                  tstamps[tmp] + slos[tmp], fixed_overhead):
+                req_id = tmp
+                break
+            group_num_requests[group_id] += 1
+            finish[tmp] = tstamps[tmp]
+            good[tmp] = False
+
+        if req_id < 0:
+            # All requests in queue violate SLO, select another model
+            model_id = batching_select_model(group_id, g_id2m_id, queue_head,
+                                             queue_tail, queue_data, tstamps)
+            continue
+
+        # Batch as much as we can (no padding)
+        bs_idx = 0
+        for j in range(1, num_bs):
+            if batchsize_config_np[j] - 1 > queue_tail[model_id] - queue_head[model_id]:
+                break
+            if batching_check_slo(tstamp, device_clocks, num_stages,
+                                  stage_latency, model_id, group_id, j,
+                                  tstamps[req_id] + slos[req_id], fixed_overhead):
+                bs_idx = j
+            else:
+                break
+        bs = batchsize_config_np[bs_idx]
+
+        t = tstamp + fixed_overhead
+        for k in range(num_stages[group_id]):
+            t = max(t, device_clocks[group_id][k]) + stage_latency[model_id][group_id][k][bs_idx]
+            tmp_time[k] = t
+            device_clocks[group_id][k] = t
+
+        finish[req_id] = t
+        good[req_id] = True
+        for _ in range(bs - 1):
+            tmp = queue_data[queue_head[model_id]]
+            queue_head[model_id] += 1
+            finish[tmp] = t
+            good[tmp] = True
+
+        group_idle_tstamp[group_id] = tmp_time[0]
+        heap_size = heap_push(heap_t, heap_g, heap_size, tmp_time[0], group_id)
+
+        group_num_requests[group_id] += bs
+        group_num_good_requests[group_id] += bs
+        model_num_good_requests[model_id] += bs
+        break
+
+    return heap_size
+
+
+@numba.jit(nopython=True, cache=True)
 def simulate_requests_mixed_batching(finish, good, tstamps, model_ids, slos, m_id2g_id, g_id2m_id,
                                      num_stages, stage_latency, num_requests):
     # num_stages: num_groups
@@ -643,6 +1050,119 @@ def simulate_requests_mixed_batching(finish, good, tstamps, model_ids, slos, m_i
     model_num_good_requests = np.zeros(num_models, dtype=np.int32)
     fixed_overhead = 0.011
 
+    # simulator states
+    device_clocks = np.zeros((num_groups, max_num_stages), dtype=np.float64)
+    group_idle_tstamp = np.zeros(num_groups, dtype=np.float64) # the time when the first stage in the group is idle
+    tmp_time = np.zeros(max_num_stages, dtype=np.float64)
+
+    # Per-model request queues. Every request is enqueued at most once, so each
+    # model owns a contiguous segment of queue_data sized by its #requests and
+    # [queue_head, queue_tail) never wraps around.
+    queue_tail = np.zeros(num_models, dtype=np.int64)
+    for i in range(num_requests):
+        if model_ids[i] >= 0:
+            queue_tail[model_ids[i]] += 1
+    pt = 0
+    for m_id in range(num_models):
+        tmp = queue_tail[m_id]
+        queue_tail[m_id] = pt
+        pt += tmp
+    queue_head = queue_tail.copy()
+    queue_data = np.empty(max(pt, 1), dtype=np.int64)
+
+    # Min-heap of (idle_tstamp, group_id). Every push dispatches at least
+    # one request, so num_requests + 1 slots are enough.
+    heap_t = np.empty(num_requests + 1, dtype=np.float64)
+    heap_g = np.empty(num_requests + 1, dtype=np.int32)
+    heap_size = 0
+
+    for i in range(num_requests):
+        tstamp = tstamps[i]
+
+        while heap_size > 0 and heap_t[0] <= tstamp:
+            idle_tstamp, g_id, heap_size = heap_pop(heap_t, heap_g, heap_size)
+            select_model_id = batching_select_model(
+                g_id, g_id2m_id, queue_head, queue_tail, queue_data, tstamps)
+            if select_model_id == -1:
+                break
+            heap_size = batching_handle_requests(
+                idle_tstamp, select_model_id, g_id, finish, good, tstamps, slos,
+                g_id2m_id, num_stages, stage_latency, device_clocks,
+                group_idle_tstamp, tmp_time, queue_head, queue_tail, queue_data,
+                heap_t, heap_g, heap_size, group_num_requests,
+                group_num_good_requests, model_num_good_requests, fixed_overhead)
+
+        m_id = model_ids[i]
+
+        if m_id < 0:
+            finish[i] = tstamp
+            good[i] = False
+            continue
+
+        # no group is available
+        if m_id2g_id[m_id][0] < 0:
+            finish[i] = tstamp
+            good[i] = False
+            continue
+
+        # select group with minimum stage clock
+        g_id = -1
+        min_device_clock = inf
+        for j in m_id2g_id[m_id]:
+            if j < 0:
+                break
+            tmp = device_clocks[j][num_stages[j] - 1]
+            if tmp < min_device_clock:
+                min_device_clock = tmp
+                g_id = j
+
+        queue_data[queue_tail[m_id]] = i
+        queue_tail[m_id] += 1
+        model_num_requests[m_id] += 1
+
+        if tstamp >= group_idle_tstamp[g_id]:
+            # group is idle
+            heap_size = batching_handle_requests(
+                tstamp, m_id, g_id, finish, good, tstamps, slos,
+                g_id2m_id, num_stages, stage_latency, device_clocks,
+                group_idle_tstamp, tmp_time, queue_head, queue_tail, queue_data,
+                heap_t, heap_g, heap_size, group_num_requests,
+                group_num_good_requests, model_num_good_requests, fixed_overhead)
+
+    # handle remaining requests
+    while heap_size > 0:
+        idle_tstamp, g_id, heap_size = heap_pop(heap_t, heap_g, heap_size)
+        select_model_id = batching_select_model(
+            g_id, g_id2m_id, queue_head, queue_tail, queue_data, tstamps)
+        if select_model_id == -1:
+            continue
+        heap_size = batching_handle_requests(
+            idle_tstamp, select_model_id, g_id, finish, good, tstamps, slos,
+            g_id2m_id, num_stages, stage_latency, device_clocks,
+            group_idle_tstamp, tmp_time, queue_head, queue_tail, queue_data,
+            heap_t, heap_g, heap_size, group_num_requests,
+            group_num_good_requests, model_num_good_requests, fixed_overhead)
+
+    return (model_num_requests, model_num_good_requests,
+            group_num_requests, group_num_good_requests)
+
+
+def simulate_requests_mixed_batching_python(finish, good, tstamps, model_ids, slos, m_id2g_id, g_id2m_id,
+                                            num_stages, stage_latency, num_requests):
+    """The reference python implementation of simulate_requests_mixed_batching."""
+    # num_stages: num_groups
+    # stage_latency: num_models * num_groups * max_num_stages * #batchsize_config
+    num_models = len(stage_latency)
+    num_groups = len(stage_latency[0])
+    max_num_stages = len(stage_latency[0][0])
+
+    # statistics
+    group_num_requests = np.zeros(num_groups, dtype=np.int32)
+    group_num_good_requests = np.zeros(num_groups, dtype=np.int32)
+    model_num_requests = np.zeros(num_models, dtype=np.int32)
+    model_num_good_requests = np.zeros(num_models, dtype=np.int32)
+    fixed_overhead = 0.011
+
     # simulator states
     device_clocks = np.zeros((num_groups, max_num_stages), dtype=np.float64)
     req_queues = [[] for _ in range(num_models)]
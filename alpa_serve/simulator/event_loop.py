@@ -4,6 +4,7 @@ from collections import defaultdict
 from enum import Enum, auto
 from functools import partial
 import heapq
+from itertools import count
 import queue
 import time
 from typing import Callable, List, Dict, Union, Sequence
@@ -78,6 +79,7 @@ class EventLoop:
         self.pause_event = asyncio.Event()
 
         self.streams = defaultdict(Stream)
+        self.num_events = 0
 
         self.main_loop = asyncio.create_task(self.run())
 
@@ -85,6 +87,7 @@ class EventLoop:
         while self.queue:
             tc = self.queue.get()
             self.cur_tc = tc
+            self.num_events += 1
 
             self.clock_ = tc.wake_up_time
 
@@ -107,7 +110,8 @@ class EventLoop:
             else:
                 raise NotImplementedError()
 
-            done, pending = await asyncio.wait([atask, self.pause_event.wait()],
+            pause_task = asyncio.create_task(self.pause_event.wait())
+            done, pending = await asyncio.wait([atask, pause_task],
                 return_when=asyncio.FIRST_COMPLETED)
 
             if atask.done():
@@ -181,10 +185,161 @@ class EventLoop:
         return self.clock_
 
 
+class Yield:
+    """An awaitable that suspends the current coroutine and hands control
+    back to HeapEventLoop."""
+    __slots__ = ()
+
+    def __await__(self):
+        ret = yield self
+        return ret
+
+
+class Future:
+    """The result of a timed coroutine launched outside of any timed coroutine."""
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = False
+        self.result = None
+
+    def set_result(self, value):
+        self.done = True
+        self.result = value
+
+    def __await__(self):
+        if not self.done:
+            yield self
+        return self.result
+
+
+class HeapEventLoop:
+    """An event loop that drives timed coroutines straight off the heap.
+
+    Coroutines are resumed with `coroutine.send` instead of being scheduled
+    as asyncio tasks, so a wake-up costs one heap operation. The semantics
+    are the same as EventLoop: calling a timed coroutine inside another one
+    pauses the caller until the callee finishes, and sleep/wait_stream
+    reschedule the current coroutine. Ties are broken in FIFO order.
+    """
+    def __init__(self):
+        self.queue = []  # List[(wake_up_time, seq, TimedCoroutine)]
+        self.seq = count()
+        self.clock_ = 0
+        self.cur_tc = None  # The current TimedCoroutine
+        self.yield_ = Yield()
+
+        self.streams = defaultdict(Stream)
+        self.num_events = 0
+
+        # Awaiting this in the root coroutine runs the loop until it is empty
+        self.main_loop = Yield()
+
+    def push(self, tc: TimedCoroutine):
+        heapq.heappush(self.queue, (tc.wake_up_time, next(self.seq), tc))
+
+    def run(self, until: Future = None):
+        queue = self.queue
+        while queue and (until is None or not until.done):
+            _, _, tc = heapq.heappop(queue)
+            self.cur_tc = tc
+            self.clock_ = tc.wake_up_time
+            self.num_events += 1
+
+            if tc.status == CoroutineStatus.INIT:
+                tc.atask = tc.func()
+                tc.status = CoroutineStatus.PAUSE
+                value = None
+            else:
+                value = tc.resume_future_value
+                tc.resume_future_value = None
+
+            try:
+                awaited = tc.atask.send(value)
+            except StopIteration as e:
+                tc.status = CoroutineStatus.FINISH
+                tc.ret_value = e.value
+                tc.atask = None
+
+                if tc.afuture:
+                    tc.afuture.set_result(tc.ret_value)
+
+                if tc.waiter:
+                    w = tc.waiter
+                    w.wake_up_time = self.clock_
+                    w.resume_future_value = tc.ret_value
+                    self.push(w)
+                continue
+
+            if awaited is not self.yield_:
+                raise RuntimeError(f"{tc} awaits {awaited}, which is not "
+                                   f"supported by HeapEventLoop")
+        self.cur_tc = None
+
+    def run_until_complete(self, coroutine):
+        """Drive the root coroutine. It runs outside of any timed coroutine."""
+        value = None
+        while True:
+            try:
+                awaited = coroutine.send(value)
+            except StopIteration as e:
+                self.run()
+                return e.value
+
+            if awaited is self.main_loop:
+                self.run()
+                value = None
+            elif isinstance(awaited, Future):
+                self.run(until=awaited)
+                assert awaited.done, "Deadlock: the awaited coroutine never finishes"
+                value = awaited.result
+            else:
+                raise RuntimeError(f"Cannot await {awaited} in HeapEventLoop")
+
+    def put_coroutine(self, tstamp: float, func: Callable, args: List, kwargs: Dict):
+        new_tc = TimedCoroutine(tstamp, partial(func, *args, **kwargs))
+        self.push(new_tc)
+
+        if self.cur_tc:
+            new_tc.waiter = self.cur_tc
+            return self.yield_
+        else:
+            new_tc.afuture = Future()
+            return new_tc.afuture
+
+    def sleep(self, duration: float):
+        assert duration >= 0
+
+        tc = self.cur_tc
+        tc.wake_up_time = self.clock_ + duration
+        self.push(tc)
+        return self.yield_
+
+    wait_stream = EventLoop.wait_stream
+    wait_multi_stream = EventLoop.wait_multi_stream
+    clock = EventLoop.clock
+
+
 loop = None
 
-def run_event_loop(coroutine):
-    """Run and simulate an event loop"""
+def run_event_loop(coroutine, engine: str = "asyncio"):
+    """Run and simulate an event loop.
+
+    Args:
+        coroutine: The root coroutine.
+        engine: "asyncio" runs timed coroutines as asyncio tasks.
+            "heap" drives them directly with HeapEventLoop, which is much
+            faster but does not support awaiting asyncio primitives
+            inside timed coroutines.
+    """
+    global loop
+
+    if engine == "heap":
+        loop = HeapEventLoop()
+        return loop.run_until_complete(coroutine)
+    elif engine != "asyncio":
+        raise ValueError(f"Invalid engine: {engine}")
+
     async def main():
         global loop
         loop = EventLoop()
@@ -242,3 +397,4 @@ async def test_main():
 
 if __name__ == "__main__":
     run_event_loop(test_main())
+    run_event_loop(test_main(), engine="heap")
@@ -64,6 +64,10 @@ class MMPPSampler:
     def sample(self, num_requests, initial_state=0):
         """Generate samples using the Markov-modulated Poisson process.
 
+        The states are sampled in batches of segments. The number of requests
+        in a segment is drawn from a Poisson distribution, and the requests
+        are placed uniformly within the segment.
+
         Args:
             num_requests (int): Number of requests to generate.
             initial_state (int): Initial state of the Markov chain.
@@ -75,23 +79,54 @@ class MMPPSampler:
             ys: States of the individual requests.
         """
         assert 0 <= initial_state < self.m
-        ys = [initial_state]
-        x = [0]
-        y = [initial_state]
-        tau = [0]
-        while True:
-            state = y[-1]
-            y.append(np.random.choice(self.m, p=self.Pi[state]))
-            t = x[-1]
-            x.append(t + np.random.exponential(-1 / self.Q[state, state]))
-            while True:
-                t = t + np.random.exponential(1 / self.lambda_[state])
-                if t > x[-1]:
-                    break
-                tau.append(t)
-                ys.append(state)
-                if len(tau) == num_requests + 1:
-                    return tau, (x, y, ys)
+        cum_pi = np.cumsum(self.Pi, axis=1)
+        mean_durations = -1 / np.diag(self.Q)
+        # Expected #requests per segment, used to size the batches
+        mean_count = max(np.mean(self.lambda_ * mean_durations), 1e-3)
+
+        state = initial_state
+        x_list, y_list, tau_list, ys_list = [], [], [], []
+        seg_start = 0.0
+        total = 0
+        while total < num_requests:
+            num_segments = int(min(max((num_requests - total) / mean_count * 1.2, 16), 1 << 20))
+
+            # Walk the Markov chain. next_states[i][k] is the next state of
+            # step k if the current state is i.
+            u = np.random.random_sample(num_segments)
+            next_states = np.minimum(np.stack([
+                np.searchsorted(cum_pi[i], u, side="right") for i in range(self.m)]),
+                self.m - 1).tolist()
+            states = [state]
+            for k in range(num_segments):
+                states.append(next_states[states[-1]][k])
+            states = np.array(states)
+            seg_states, state = states[:-1], states[-1]
+
+            # Sample the segments and the requests in them
+            durations = np.random.exponential(mean_durations[seg_states])
+            ends = seg_start + np.cumsum(durations)
+            starts = ends - durations
+            counts = np.random.poisson(self.lambda_[seg_states] * durations)
+            seg_ids = np.repeat(np.arange(num_segments), counts)
+            offsets = np.random.random_sample(len(seg_ids))
+            tau = starts[seg_ids] + offsets * durations[seg_ids]
+            tau.sort()
+
+            x_list.append(ends)
+            y_list.append(states[1:])
+            tau_list.append(tau)
+            ys_list.append(seg_states[seg_ids])
+            seg_start = ends[-1]
+            total += len(tau)
+
+        # Cut at the segment of the last request
+        tau = np.concatenate([[0.0]] + tau_list)[:num_requests + 1]
+        ys = np.concatenate([[initial_state]] + ys_list)[:num_requests + 1]
+        x = np.concatenate([[0.0]] + x_list)
+        y = np.concatenate([[initial_state]] + y_list)
+        num_used = np.searchsorted(x, tau[-1], side="left") + 1
+        return tau, (x[:num_used], y[:num_used], ys)
 
     def expected_request_rate(self):
         """Compute the expected request rate."""
@@ -122,3 +157,65 @@ class MMPPSampler:
                     Q[i, j] = 1 / expected_state_durations[i] / (m - 1)
         lambda_ = np.array(expected_state_request_rates)
         return cls(Q, lambda_)
+
+
+# Statistics utils
+
+
+class LatencyHistogram:
+    """A histogram of latencies with log-spaced buckets (HDR histogram style).
+
+    The memory is constant in the number of samples. Percentiles have a
+    relative error of at most `precision`, while the count, mean and std are
+    exact.
+    """
+    def __init__(self, min_value: float = 1e-6, max_value: float = 1e5,
+                 precision: float = 0.01):
+        self.min_value = min_value
+        self.log_base = np.log1p(precision)
+        self.num_buckets = int(np.ceil(np.log(max_value / min_value) / self.log_base)) + 2
+        self.counts = np.zeros(self.num_buckets, dtype=np.int64)
+
+        self.count = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    def add(self, values: np.ndarray):
+        """Add a batch of samples."""
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return
+        # Bucket 0 holds the values <= min_value
+        buckets = np.ceil(np.log(np.maximum(values, self.min_value) / self.min_value)
+                          / self.log_base).astype(np.int64)
+        np.clip(buckets, 0, self.num_buckets - 1, out=buckets)
+        self.counts += np.bincount(buckets, minlength=self.num_buckets)
+
+        self.count += len(values)
+        self.sum += np.sum(values)
+        self.sum_sq += np.sum(values * values)
+
+    def merge(self, other: "LatencyHistogram"):
+        assert self.num_buckets == other.num_buckets
+        self.counts += other.counts
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+
+    def mean(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def std(self):
+        if not self.count:
+            return 0.0
+        mean = self.mean()
+        return np.sqrt(max(self.sum_sq / self.count - mean * mean, 0.0))
+
+    def percentile(self, q: float):
+        """Return the value of rank int(q * count) in the sorted samples."""
+        if not self.count:
+            return 0.0
+        rank = min(int(q * self.count), self.count - 1)
+        bucket = np.searchsorted(np.cumsum(self.counts), rank, side="right")
+        # The geometric middle of the bucket (upper bound for bucket 0)
+        return self.min_value * np.exp((bucket - 0.5 * (bucket > 0)) * self.log_base)
@@ -1,13 +1,15 @@
 """Workload definition"""
 from abc import ABC, abstractmethod
-from collections import defaultdict, namedtuple
+from collections import namedtuple
 import dataclasses
+import functools
+import itertools
 import random
-from typing import Any, List, Sequence, Dict, Optional
+from typing import Any, List, Sequence, Dict, Optional, Tuple
 
 import numpy as np
 
-from alpa_serve.simulator.util import MMPPSampler
+from alpa_serve.simulator.util import MMPPSampler, LatencyHistogram
 from alpa_serve.util import to_str_round, eps
 
 
@@ -101,14 +103,16 @@ class DeterministicProcess(ArrivalProcess):
     def cv(self):
         return 0
 
+    def generate_arrivals(self, start: float, duration: float, seed: int = 0):
+        n_requests = int(duration * self.rate_)
+        interval = 1 / self.rate_
+        return start + np.arange(n_requests) * interval
+
     def generate_workload(self, model_name: str, start: float,
                           duration: float, slo: Optional[float] = None,
                           seed: int = 0):
-        n_requests = int(duration * self.rate_)
-        interval = 1 / self.rate_
-        ticks = [start + i * interval for i in range(n_requests)]
-        return Workload(ticks, [
-            Request(model_name, None, slo, i, {}) for i in range(n_requests)])
+        ticks = self.generate_arrivals(start, duration, seed)
+        return Workload.from_arrivals(model_name, ticks, slo)
 
 
 class GammaProcess(ArrivalProcess):
@@ -136,30 +140,30 @@ class GammaProcess(ArrivalProcess):
         np.random.seed(seed)
 
         batch_size = max(int(self.rate_ * duration * 1.2), 1)
-        intervals = np.random.gamma(self.shape, self.scale, size=batch_size)
-        pt = 0
-
-        ticks = []
-        cur = start + intervals[0]
         end = start + duration
-        while cur < end:
-            ticks.append(cur)
 
-            pt += 1
-            if pt >= batch_size:
-                intervals = np.random.gamma(self.shape, self.scale, size=batch_size)
-                pt = 0
-
-            cur += intervals[pt]
-
-        return ticks
+        # Draw batches of intervals until the arrivals pass the end.
+        # The cumsum adds the intervals one by one, so the arrivals are the
+        # same as accumulating them in a loop.
+        batches = []
+        cur = start
+        while True:
+            intervals = np.random.gamma(self.shape, self.scale, size=batch_size)
+            intervals[0] += cur
+            ticks = np.cumsum(intervals)
+            n = np.searchsorted(ticks, end, side="left")
+            batches.append(ticks[:n])
+            if n < batch_size:
+                break
+            cur = ticks[-1]
+
+        return np.concatenate(batches)
 
     def generate_workload(self, model_name: str, start: float,
                           duration: float, slo: Optional[float] = None,
                           seed: int = 0):
         ticks = self.generate_arrivals(start, duration, seed)
-        return Workload(ticks, [
-            Request(model_name, None, slo, i, {}) for i in range(len(ticks))])
+        return Workload.from_arrivals(model_name, ticks, slo)
 
 
 class PoissonProcess(GammaProcess):
@@ -212,18 +216,20 @@ class UniformMMPP(ArrivalProcess):
     def cv(self):
         return None
 
-    def generate_workload(self, model_name: str, start: float,
-                          duration: float, slo: Optional[float] = None,
-                          seed: int = 0):
+    def generate_arrivals(self, start: float, duration: float, seed: int = 0):
         np.random.seed(seed)
         random.seed(seed)
         n_requests = int(duration * self.mean_arrival_rate)
         sampler = MMPPSampler.unifrom_mmpp(self.state_durations,
                                            self.state_request_rates)
         ticks, _ = sampler.sample(n_requests)
-        ticks = [start + t for t in ticks[1:]]
-        return Workload(ticks, [
-            Request(model_name, None, slo, i, {}) for i in range(n_requests)])
+        return start + np.array(ticks[1:])
+
+    def generate_workload(self, model_name: str, start: float,
+                          duration: float, slo: Optional[float] = None,
+                          seed: int = 0):
+        ticks = self.generate_arrivals(start, duration, seed)
+        return Workload.from_arrivals(model_name, ticks, slo)
 
 
 class ParetoProcess:
@@ -236,20 +242,35 @@ class ParetoProcess:
         from scipy.stats import pareto
 
         rs = np.random.RandomState(seed)
-        ticks = []
-        cur = start
+        batch_size = 1024
         end = start + duration
-        while cur < end:
-            cur += pareto.rvs(self.shape, loc = self.loc, scale = self.scale, random_state=rs) - 1.0
-            ticks.append(cur)
-        return ticks
+        if start >= end:
+            return np.array([])
+
+        # Draw growing batches of intervals. The arrivals keep the first
+        # tick that passes the end, like the original sampling loop.
+        batches = []
+        cur = start
+        while True:
+            intervals = pareto.rvs(self.shape, loc=self.loc, scale=self.scale,
+                                   size=batch_size, random_state=rs) - 1.0
+            intervals[0] += cur
+            ticks = np.cumsum(intervals)
+            passed = ticks >= end
+            if passed.any():
+                batches.append(ticks[:np.argmax(passed) + 1])
+                break
+            batches.append(ticks)
+            cur = ticks[-1]
+            batch_size *= 2
+
+        return np.concatenate(batches)
 
     def generate_workload(self, model_name: str, start: float,
                           duration: float, slo: Optional[float] = None,
                           seed: int = 0):
         ticks = self.generate_arrivals(start, duration, seed)
-        return Workload(ticks, [
-            Request(model_name, None, slo, i, {}) for i in range(len(ticks))])
+        return Workload.from_arrivals(model_name, ticks, slo)
 
     def rate(self):
         """TODO(Hao): this is wrong."""
@@ -263,25 +284,216 @@ class ParetoProcess:
         return self.rate(), self.cv()
 
 
+class StreamingStats:
+    """Accumulate the statistics of serving results chunk by chunk in
+    constant memory. The latency percentiles are estimated with histograms."""
+
+    def __init__(self, model_names: List[str]):
+        self.model_names = model_names
+        num_models = len(model_names)
+
+        self.num_requests = 0
+        self.num_good = 0
+        self.latency_sum = 0.0
+        self.first_start = self.last_start = None
+
+        self.model_num_requests = np.zeros(num_models, dtype=np.int64)
+        self.model_num_good = np.zeros(num_models, dtype=np.int64)
+        self.model_first_index = np.full(num_models, np.iinfo(np.int64).max)
+        self.model_first_good_start = np.full(num_models, np.inf)
+        self.model_last_good_start = np.full(num_models, -np.inf)
+        self.model_latency = [LatencyHistogram() for _ in range(num_models)]
+
+    def update(self, model_ids: np.ndarray, start: np.ndarray,
+               finish: np.ndarray, good: np.ndarray):
+        """Add a chunk of requests sorted by arrival time."""
+        if len(start) == 0:
+            return
+        num_models = len(self.model_names)
+        good = np.asarray(good, dtype=bool)
+
+        # Group the requests by model, keeping the arrival order in each group
+        counts = np.bincount(model_ids, minlength=num_models)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        order = np.argsort(model_ids, kind="stable")
+        present_ids = np.nonzero(counts)[0]
+        self.model_first_index[present_ids] = np.minimum(
+            self.model_first_index[present_ids],
+            order[offsets[present_ids]] + self.num_requests)
+
+        self.num_requests += len(start)
+        self.num_good += int(np.sum(good))
+        self.latency_sum += float(np.sum(finish - start))
+        if self.first_start is None:
+            self.first_start = start[0]
+        self.last_start = start[-1]
+        self.model_num_requests += counts
+        self.model_num_good += np.bincount(model_ids[good], minlength=num_models)
+
+        # Per-model latency of the good requests
+        for m_id in present_ids:
+            indices = order[offsets[m_id]:offsets[m_id + 1]]
+            tmp_good = good[indices]
+            if not np.any(tmp_good):
+                continue
+            tmp_start = start[indices][tmp_good]
+            self.model_latency[m_id].add(finish[indices][tmp_good] - tmp_start)
+            self.model_first_good_start[m_id] = min(
+                self.model_first_good_start[m_id], tmp_start[0])
+            self.model_last_good_start[m_id] = tmp_start[-1]
+
+    def result(self):
+        """Return the StatsResult of all requests added so far."""
+        present_ids = np.nonzero(self.model_num_requests)[0]
+        present_ids = present_ids[np.lexsort((self.model_first_index[present_ids],
+                                              self.model_num_requests[present_ids]))]
+
+        stats = []
+        for m_id in present_ids:
+            num_requests = self.model_num_requests[m_id]
+            num_good = self.model_num_good[m_id]
+            hist = self.model_latency[m_id]
+            if num_good > 0:
+                throughput = num_good / (self.model_last_good_start[m_id] -
+                                         self.model_first_good_start[m_id])
+            else:
+                throughput = 0
+            stats.append(PerModelStatsResult(
+                self.model_names[m_id], num_requests, num_good / num_requests,
+                throughput, hist.mean(), hist.std(),
+                hist.percentile(0.90), hist.percentile(0.99), [], [], []))
+
+        n = self.num_requests
+        return StatsResult(stats, None, self.num_good / n, self.latency_sum / n,
+                           n, n / (self.last_start - self.first_start))
+
+
+def generate_multi_model_workload(arrival_processes: Sequence[ArrivalProcess],
+                                  model_names: Sequence[str],
+                                  start: float,
+                                  duration: float,
+                                  slos: Optional[Sequence[Optional[float]]] = None,
+                                  seed: int = 0):
+    """Generate the workload of several models in one call.
+
+    The arrivals of the i-th model are the same as
+    `arrival_processes[i].generate_workload(..., seed=seed + i)`, but the
+    result is built directly as one columnar workload.
+    """
+    assert len(arrival_processes) == len(model_names)
+    if slos is None:
+        slos = [None] * len(model_names)
+
+    arrivals = [np.asarray(p.generate_arrivals(start, duration, seed + i), dtype=np.float64)
+                for i, p in enumerate(arrival_processes)]
+    counts = [len(x) for x in arrivals]
+    merged_arrivals = np.concatenate(arrivals) if arrivals else np.zeros(0)
+    model_ids = np.repeat(np.arange(len(model_names), dtype=np.int32), counts)
+    slos = np.repeat(np.array([np.nan if x is None else x for x in slos],
+                              dtype=np.float64), counts)
+
+    sorted_indices = merge_sorted_arrivals(merged_arrivals)
+    return Workload.from_columns(merged_arrivals[sorted_indices],
+                                 model_ids[sorted_indices], slos[sorted_indices],
+                                 model_names)
+
+
+def merge_sorted_arrivals(merged_arrivals: np.ndarray):
+    """Return the indices that sort the concatenated arrivals of several
+    workloads. Ties are broken by the order of the workloads."""
+    # The arrivals of each workload are already sorted. The stable sort of numpy
+    # is a timsort for floats, which detects these k runs and merges them
+    # in O(n log k).
+    return np.argsort(merged_arrivals, kind="stable")
+
+
 class Workload:
-    """A sorted list of requests."""
+    """A sorted list of requests.
 
-    def __init__(self, arrivals: List[float], requests: List[Request]):
-        assert len(arrivals) == len(requests)
+    A workload is stored either as a list of `Request` objects (row mode) or
+    as columns (columnar mode): `model_ids` (int32) indexing into the
+    `model_names` table and `slos` (float64, nan for no SLO). In columnar
+    mode, `requests` are materialized lazily when accessed and
+    merge/split/slicing only operate on the columns.
+    """
 
-        self.arrivals = np.array(arrivals)
-        self.requests = requests
+    def __init__(self, arrivals: List[float], requests: Optional[List[Request]],
+                 columns: Optional[Tuple[np.ndarray, np.ndarray, List[str]]] = None):
+        # Do not copy the arrivals, so slicing a workload is zero-copy
+        self.arrivals = np.asarray(arrivals, dtype=np.float64)
+        if requests is not None:
+            assert len(arrivals) == len(requests)
+        else:
+            assert len(arrivals) == len(columns[0]) == len(columns[1])
+        self.columnar = requests is None
+        self._requests = requests
+        self._columns = columns  # (model_ids, slos, model_names)
 
         self.enable_simulator_cache = False
         self.cached_data = None
 
+    @functools.cached_property
+    def rate(self):
         if len(self.arrivals) > 1:
-            intervals = self.arrivals[1:] - self.arrivals[:-1]
-            self.rate = 1 / (np.mean(intervals) + eps)
-            self.cv = np.std(intervals) * self.rate
-        else:
-            self.rate = 0
-            self.cv = 0
+            return 1 / (np.mean(np.diff(self.arrivals)) + eps)
+        return 0
+
+    @functools.cached_property
+    def cv(self):
+        if len(self.arrivals) > 1:
+            return np.std(np.diff(self.arrivals)) * self.rate
+        return 0
+
+    @classmethod
+    def from_columns(cls, arrivals: np.ndarray, model_ids: np.ndarray,
+                     slos: np.ndarray, model_names: List[str]):
+        """Create a workload in columnar mode."""
+        return cls(arrivals, None, (np.asarray(model_ids, dtype=np.int32),
+                                    np.asarray(slos, dtype=np.float64),
+                                    list(model_names)))
+
+    @classmethod
+    def from_arrivals(cls, model_name: str, arrivals: Sequence[float],
+                      slo: Optional[float] = None):
+        """Create a columnar workload of a single model."""
+        n = len(arrivals)
+        return cls.from_columns(arrivals, np.zeros(n, dtype=np.int32),
+                                np.full(n, np.nan if slo is None else slo,
+                                        dtype=np.float64),
+                                [model_name])
+
+    @property
+    def requests(self):
+        if self._requests is None:
+            # Materialize the requests, which is only needed by the full simulator
+            model_ids, slos, model_names = self._columns
+            self._requests = [
+                Request(model_names[m_id], None, None if slo != slo else slo, i, {})
+                for i, (m_id, slo) in enumerate(zip(model_ids.tolist(), slos.tolist()))]
+        return self._requests
+
+    def get_columns(self):
+        """Return (model_ids, slos, model_names) of the requests."""
+        if self._columns is None:
+            name2id = {}
+            model_ids = np.array([name2id.setdefault(r.model_name, len(name2id))
+                                  for r in self._requests], dtype=np.int32)
+            slos = np.array([np.nan if r.slo is None else r.slo
+                             for r in self._requests], dtype=np.float64)
+            self._columns = (model_ids, slos, list(name2id))
+        return self._columns
+
+    @property
+    def model_ids(self):
+        return self.get_columns()[0]
+
+    @property
+    def slos(self):
+        return self.get_columns()[1]
+
+    @property
+    def model_names(self):
+        return self.get_columns()[2]
 
     def split_round_robin(self, number: int):
         rets = []
@@ -295,19 +507,25 @@ class Workload:
 
         ws = []
         start_i = 0
-        start_time = self.arrivals[start_i]
-        for i in range(len(self.arrivals)):
-            if self.arrivals[i] > start_time + interval:
-                ws.append(self[start_i:i])
-                start_i = i
-                start_time = self.arrivals[i]
-
-        ws.append(self[start_i:])
+        while start_i < len(self.arrivals):
+            # The first request later than start_time + interval
+            end_i = np.searchsorted(self.arrivals,
+                                    self.arrivals[start_i] + interval, side="right")
+            ws.append(self[start_i:end_i])
+            start_i = end_i
         return ws
 
     def compute_stats(self, start: Sequence[float], finish: Sequence[float],
-                      good: Sequence[bool], warmup: float):
-        """Compute the statistics of serving results."""
+                      good: Sequence[bool], warmup: float, streaming: bool = False):
+        """Compute the statistics of serving results.
+
+        If `streaming` is true, the latency percentiles are estimated with
+        histograms and the per-request arrays are not kept in the results.
+        """
+        model_ids, _, model_names = self.get_columns()
+        start, finish = np.asarray(start), np.asarray(finish)
+        good = np.asarray(good, dtype=bool)
+
         # Skip the first and last `warmup` seconds
         if len(self.arrivals) > 1:
             skip = int(warmup / (self.arrivals[-1] - self.arrivals[0]) * len(self.arrivals))
@@ -315,40 +533,48 @@ class Workload:
                 start = start[skip:-skip]
                 finish = finish[skip:-skip]
                 good = good[skip:-skip]
-                requests = self.requests[skip:-skip]
+                model_ids = model_ids[skip:-skip]
+
+        if streaming:
+            acc = StreamingStats(model_names)
+            acc.update(model_ids, start, finish, good)
+            return acc.result()
 
-        # Compute stats per model
-        model_indices = defaultdict(list)
-        for i in range(len(requests)):
-            model_indices[requests[i].model_name].append(i)
+        # Group the requests by model, keeping the arrival order in each group
+        num_models = len(model_names)
+        counts = np.bincount(model_ids, minlength=num_models)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        order = np.argsort(model_ids, kind="stable")
+        good_counts = np.bincount(model_ids, weights=good, minlength=num_models)
 
-        names = list(model_indices.keys())
-        names.sort(key=lambda name: len(model_indices[name]))
+        # Sort models by #requests, breaking ties by the first appearance
+        present_ids = np.nonzero(counts)[0]
+        first_indices = order[offsets[present_ids]]
+        present_ids = present_ids[np.lexsort((first_indices, counts[present_ids]))]
 
         stats = []
-        for name in names:
-            indices = np.asarray(model_indices[name], dtype=np.int32)
-            tmp_good = np.asarray(good[indices], dtype=bool)
+        for m_id in present_ids:
+            indices = order[offsets[m_id]:offsets[m_id + 1]]
+            tmp_good = good[indices]
             tmp_start = start[indices][tmp_good]
             tmp_finish = finish[indices][tmp_good]
 
             # Compute stats
-            goodput = np.mean(tmp_good)
+            goodput = good_counts[m_id] / counts[m_id]
             if goodput > 0:
                 throughput = len(tmp_start) / (tmp_start[-1] - tmp_start[0])
                 latency = tmp_finish - tmp_start
             else:
                 throughput = 0
-                latency = [0]
+                latency = np.zeros(1)
 
-            sorted_latency = np.sort(latency)
-            latency_p90 = sorted_latency[int(0.90 * len(sorted_latency))]
-            latency_p99 = sorted_latency[int(0.99 * len(sorted_latency))]
+            k90, k99 = int(0.90 * len(latency)), int(0.99 * len(latency))
+            partitioned = np.partition(latency, (k90, k99))
 
             stats.append(PerModelStatsResult(
-                name, len(indices), goodput, throughput,
+                model_names[m_id], counts[m_id], goodput, throughput,
                 np.mean(latency), np.std(latency),
-                latency_p90, latency_p99, latency, tmp_start, tmp_finish))
+                partitioned[k90], partitioned[k99], latency, tmp_start, tmp_finish))
 
         return StatsResult(stats, None, np.mean(good), np.mean(finish - start),
                            len(start), len(start) / (start[-1] - start[0]))
@@ -380,29 +606,49 @@ class Workload:
 
     @classmethod
     def merge(cls, *args):
+        if len(args) == 0:
+            return cls.empty()
         if len(args) == 1:
             return args[0]
 
-        number = sum(len(x) for x in args)
+        if any(x.columnar for x in args):
+            return cls.merge_columns(*args)
 
         merged_arrivals = np.concatenate(tuple(x.arrivals for x in args))
-        merged_requests = sum((x.requests for x in args), [])
+        merged_requests = list(itertools.chain.from_iterable(x.requests for x in args))
+        sorted_indices = merge_sorted_arrivals(merged_arrivals)
 
-        sorted_indices = np.argsort(merged_arrivals)
+        requests = [merged_requests[j] for j in sorted_indices.tolist()]
+        for i, request in enumerate(requests):
+            request.idx = i
 
-        arrivals = [None] * number
-        requests = [None] * number
+        return cls(merged_arrivals[sorted_indices], requests)
 
-        for i, j in enumerate(sorted_indices):
-            arrivals[i] = merged_arrivals[j]
-            requests[i] = merged_requests[j]
-            requests[i].idx = i
+    @classmethod
+    def merge_columns(cls, *args):
+        # Unify the model name tables
+        model_names = list({name: None for x in args for name in x.model_names})
+        name2id = {name: i for i, name in enumerate(model_names)}
+        model_ids = [np.array([name2id[name] for name in x.model_names],
+                              dtype=np.int32)[x.model_ids]
+                     for x in args]
+
+        merged_arrivals = np.concatenate(tuple(x.arrivals for x in args))
+        sorted_indices = merge_sorted_arrivals(merged_arrivals)
 
-        return cls(arrivals, requests)
+        return cls.from_columns(
+            merged_arrivals[sorted_indices],
+            np.concatenate(model_ids)[sorted_indices],
+            np.concatenate(tuple(x.slos for x in args))[sorted_indices],
+            model_names)
 
     def __getitem__(self, key):
         if isinstance(key, slice):
             arrivals = self.arrivals.__getitem__(key)
+            if self.columnar:
+                model_ids, slos, model_names = self._columns
+                return Workload.from_columns(
+                    arrivals, model_ids[key], slos[key], model_names)
             requests = self.requests.__getitem__(key)
             return Workload(arrivals, requests)
         else:
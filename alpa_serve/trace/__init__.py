@@ -1,2 +1,2 @@
-from .trace import TraceReplay, Trace, load_trace, preprocess_azure_v1_trace, preprocess_azure_v2_trace, \
-    report_group_stats
+from .trace import TraceReplay, Trace, TraceStore, load_trace, save_trace_store, convert_trace, \
+    preprocess_azure_v1_trace, preprocess_azure_v2_trace, report_group_stats
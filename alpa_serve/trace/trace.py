@@ -1,85 +1,118 @@
 import math
 import os.path
 import csv
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import itertools
+import json
+import multiprocessing
 import pickle
 import time
 
 import copy
 import warnings
-from typing import List, Dict
+from typing import List, Dict, Iterator, Union
 from collections import OrderedDict
+from collections.abc import Mapping
 
 import matplotlib.pyplot as plt
+from scipy.special import digamma, polygamma
 from scipy.stats import expon, gamma, pareto
 import numpy as np
 
-from alpa_serve.simulator.workload import Workload, PoissonProcess, GammaProcess, \
-    Request, ParetoProcess
+from alpa_serve.simulator.workload import Workload, PoissonProcess, GammaProcess, ParetoProcess
 
 
 DEBUG = False
 
 
-def preprocess_azure_v1_trace(trace_dir, n_day=14):
+def preprocess_azure_v1_trace(trace_dir, n_day=14, columnar=False, chunk_size=4096):
+    """Load and process azure v1 trace.
+
+    The histograms are written into a preallocated [functions x minutes]
+    int32 matrix on disk, and the CSV rows are parsed in chunks, so the
+    preprocessing takes linear time and bounded memory.
+    """
     if not os.path.exists(trace_dir):
         raise RuntimeError(f"{trace_dir}")
-    tracelines = OrderedDict()
-    print(f"Reading azure v1 trace in 14 days; it might take a while...")
-    tic = time.time()
+    filenames = []
     for i in range(1, n_day + 1):
         day_str = str(i) if i >= 10 else "0" + str(i)
-        filename = os.path.join(trace_dir, f"invocations_per_function_md.anon.d{day_str}.csv")
+        filenames.append(os.path.join(trace_dir, f"invocations_per_function_md.anon.d{day_str}.csv"))
+
+    # 1. Collect the function names in the order of first appearance
+    print(f"Reading azure v1 trace in {n_day} days; it might take a while...")
+    tic = time.time()
+    function_ids = OrderedDict()
+    for filename in filenames:
+        with open(filename, newline="") as csvfile:
+            name_col, _ = read_azure_v1_header(csvfile)
+            for line in csvfile:
+                function_name = line.split(",", name_col + 1)[name_col]
+                function_ids.setdefault(function_name, len(function_ids))
+    function_names = list(function_ids.keys())
+
+    # 2. Fill the histogram matrix day by day
+    if columnar:
+        save_path = os.path.join(trace_dir, "azure_v1")
+        os.makedirs(save_path, exist_ok=True)
+        histogram_path = os.path.join(save_path, "histogram.npy")
+    else:
+        histogram_path = os.path.join(trace_dir, "azure_v1.histogram.tmp.npy")
+    histogram = np.lib.format.open_memmap(histogram_path, mode="w+", dtype=np.int32,
+                                          shape=(len(function_names), n_day * 1440))
+    for day, filename in enumerate(filenames):
         print(f"Read file: {filename}")
         with open(filename, newline="") as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                function_name = row["HashFunction"]
-                histogram_1min = np.array([int(row[str(j)]) for j in range(1, 1441)], dtype=np.int32)
-                if i == 1:
-                    assert function_name not in tracelines
-                    tracelines[function_name] = histogram_1min
-                else:
-                    expected_size = 1440 * (i - 1)
-                    if function_name in tracelines:
-                        cur_size = tracelines[function_name].size
-                        if cur_size != expected_size:
-                            diff = expected_size - cur_size
-                            assert diff % 1440 == 0
-                            tracelines[function_name] = np.concatenate((tracelines[function_name],
-                                                                       np.zeros((diff,), dtype=np.int32),
-                                                                       histogram_1min))
-                        else:
-                            tracelines[function_name] = np.concatenate((tracelines[function_name],
-                                                                       histogram_1min))
-                    else:
-                        tracelines[function_name] = np.concatenate((np.zeros((expected_size, ), dtype=np.int32),
-                                                                   histogram_1min))
-    for function_name, histogram_1min in tracelines.items():
-        if histogram_1min.size != n_day * 1440:
-            diff = n_day * 1440 - histogram_1min.size
-            assert diff % 1440 == 0
-            tracelines[function_name] = np.concatenate((tracelines[function_name], np.zeros((diff,), dtype=np.int32)))
+            name_col, first_minute_col = read_azure_v1_header(csvfile)
+            while True:
+                lines = list(itertools.islice(csvfile, chunk_size))
+                if not lines:
+                    break
+                rows, counts = [], []
+                for line in lines:
+                    fields = line.rstrip().split(",", first_minute_col)
+                    rows.append(function_ids[fields[name_col]])
+                    counts.append(fields[first_minute_col])
+                counts = np.fromstring(",".join(counts), dtype=np.int32, sep=",")
+                histogram[rows, day * 1440:(day + 1) * 1440] = counts.reshape(len(rows), 1440)
+    histogram.flush()
     print(f"Reading takes: {time.time() - tic}s.")
 
     # report the stats.
-    num_function_invocations = []
-    for function_name, histogram_1min in tracelines.items():
-        assert (histogram_1min.size == 1440 * n_day), f"length: {histogram_1min.size}"
-        num_function_invocations.append(np.sum(histogram_1min))
-    num_functions = len(tracelines.keys())
+    num_function_invocations = histogram.sum(axis=1)
+    num_functions = len(function_names)
     print(f"Azure trace v1, stats: #days: {n_day}, #functions: {num_functions}, "
           f"total invocations: {sum(num_function_invocations)}, "
           f"max: {max(num_function_invocations)}, min: {min(num_function_invocations)}, "
           f"avg: {np.mean(num_function_invocations):.2f}")
 
+    if columnar:
+        del histogram
+        write_trace_meta(save_path, "histogram", function_names)
+        print(f"Dump the data into the trace store {save_path}.")
+        return
+
     # pickle it to disk
+    tracelines = OrderedDict(zip(function_names, np.array(histogram)))
+    del histogram
+    os.remove(histogram_path)
     save_path = os.path.join(trace_dir, "azure_v1.pkl")
     with open(save_path, "wb") as handle:
         pickle.dump(tracelines, handle)
     print(f"Dump the data into {save_path}, file size: {os.path.getsize(save_path) // 1e6} MB.")
 
 
-def preprocess_azure_v2_trace(trace_dir):
+def read_azure_v1_header(csvfile):
+    """Return the columns of the function name and the first minute."""
+    header = csvfile.readline().rstrip().split(",")
+    name_col = header.index("HashFunction")
+    first_minute_col = header.index("1")
+    assert header[first_minute_col:] == [str(j) for j in range(1, 1441)]
+    return name_col, first_minute_col
+
+
+def preprocess_azure_v2_trace(trace_dir, columnar=False):
     """Load and process azure v2 trace."""
     if not os.path.exists(trace_dir):
         raise RuntimeError(f"{trace_dir}")
@@ -111,6 +144,12 @@ def preprocess_azure_v2_trace(trace_dir):
           f"max: {max(num_function_invocations)}, min: {min(num_function_invocations)}, "
           f"avg: {np.mean(num_function_invocations):.2f}")
 
+    if columnar:
+        save_path = os.path.join(trace_dir, "azure_v2")
+        save_trace_store(tracelines, save_path)
+        print(f"Dump the data into the trace store {save_path}.")
+        return
+
     # pickle it to disk
     save_path = os.path.join(trace_dir, "azure_v2.pkl")
     with open(save_path, "wb") as handle:
@@ -118,22 +157,143 @@ def preprocess_azure_v2_trace(trace_dir):
     print(f"Dump the data into {save_path}, file size: {os.path.getsize(save_path) // 1e6} MB.")
 
 
-def load_trace(path: str) -> OrderedDict:
-    assert path.endswith(".pkl")
-    tic = time.time()
-    with open(path, "rb") as handle:
+class TraceStore(Mapping):
+    """A read-only, memory-mapped columnar trace store.
+
+    A store is a directory with a `meta.json` and numpy arrays opened with
+    `mmap_mode="r"`, so opening it is nearly free and slicing only reads the
+    pages of the slice. Two layouts are supported:
+      - "histogram" (azure_v1): an int32 [functions x minutes] matrix.
+      - "arrivals" (azure_v2): one float64 array concatenating the sorted
+        arrivals of all functions, plus an int64 offset index where the
+        arrivals of function i are arrivals[offsets[i]:offsets[i+1]].
+
+    It behaves like the OrderedDict returned by loading a pickled trace.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.path = path
+        self.kind = meta["kind"]
+        self.function_names = meta["functions"]
+        self.function_ids = {name: i for i, name in enumerate(self.function_names)}
+
+        if self.kind == "histogram":
+            self.histogram = np.load(os.path.join(path, "histogram.npy"),
+                                     mmap_mode="r")
+        elif self.kind == "arrivals":
+            self.arrivals = np.load(os.path.join(path, "arrivals.npy"),
+                                    mmap_mode="r")
+            self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        else:
+            raise RuntimeError(f"Unknown trace store kind: {self.kind}")
+
+    def __getitem__(self, function_name):
+        i = self.function_ids[function_name]
+        if self.kind == "histogram":
+            return self.histogram[i]
+        return self.arrivals[self.offsets[i]:self.offsets[i + 1]]
+
+    def __iter__(self):
+        return iter(self.function_names)
+
+    def __len__(self):
+        return len(self.function_names)
+
+    def num_invocations(self):
+        if self.kind == "histogram":
+            return np.asarray(self.histogram.sum(axis=1))
+        return np.diff(self.offsets)
+
+    def slice_histogram(self, start_slot: int, end_slot: int) -> OrderedDict:
+        """Return the [start_slot, end_slot) minutes of all functions."""
+        assert self.kind == "histogram"
+        sliced = np.array(self.histogram[:, start_slot:end_slot])
+        return OrderedDict(zip(self.function_names, sliced))
+
+    def slice_arrival(self, start_seconds: float, end_seconds: float) -> OrderedDict:
+        """Return the arrivals in [start_seconds, end_seconds) of all functions."""
+        assert self.kind == "arrivals"
+        sliced_arrival = OrderedDict()
+        for i, function_name in enumerate(self.function_names):
+            trace = self.arrivals[self.offsets[i]:self.offsets[i + 1]]
+            lo, hi = np.searchsorted(trace, [start_seconds, end_seconds])
+            sliced_arrival[function_name] = np.array(trace[lo:hi])
+        return sliced_arrival
+
+
+def save_trace_store(tracelines: OrderedDict, path: str):
+    """Save per-function histograms or arrivals into a columnar trace store."""
+    function_names = list(tracelines.keys())
+    is_histogram = all(trace.dtype == np.int32 for trace in tracelines.values())
+    os.makedirs(path, exist_ok=True)
+
+    if is_histogram:
+        histogram = np.lib.format.open_memmap(
+            os.path.join(path, "histogram.npy"), mode="w+", dtype=np.int32,
+            shape=(len(function_names),
+                   max((trace.size for trace in tracelines.values()), default=0)))
+        for i, trace in enumerate(tracelines.values()):
+            histogram[i, :trace.size] = trace
+            histogram[i, trace.size:] = 0
+        histogram.flush()
+        del histogram
+    else:
+        offsets = np.zeros(len(function_names) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([trace.size for trace in tracelines.values()])
+        arrivals = np.lib.format.open_memmap(
+            os.path.join(path, "arrivals.npy"), mode="w+", dtype=np.float64,
+            shape=(int(offsets[-1]),))
+        for i, trace in enumerate(tracelines.values()):
+            arrivals[offsets[i]:offsets[i + 1]] = np.sort(trace)
+        arrivals.flush()
+        del arrivals
+        np.save(os.path.join(path, "offsets.npy"), offsets)
+
+    write_trace_meta(path, "histogram" if is_histogram else "arrivals", function_names)
+
+
+def write_trace_meta(path: str, kind: str, function_names: List[str]):
+    # Write the meta last, so a partially written store cannot be opened
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"kind": kind, "functions": function_names}, f)
+
+
+def convert_trace(pkl_path: str, store_path: str = None) -> str:
+    """Convert a pickled trace into a columnar trace store."""
+    assert pkl_path.endswith(".pkl")
+    store_path = store_path or pkl_path[:-4]
+    with open(pkl_path, "rb") as handle:
         tracelines = pickle.load(handle)
+    save_trace_store(tracelines, store_path)
+    print(f"Convert {pkl_path} into {store_path}.")
+    return store_path
+
+
+def load_trace(path: str) -> Union[OrderedDict, TraceStore]:
+    """Load a pickled trace, or open a columnar trace store directory."""
+    tic = time.time()
+    if os.path.isdir(path):
+        tracelines = TraceStore(path)
+    else:
+        assert path.endswith(".pkl")
+        with open(path, "rb") as handle:
+            tracelines = pickle.load(handle)
     print(f"Reading takes: {time.time() - tic}s.")
 
     # Do some check and report stats:
-    num_functions = len(tracelines.keys())
-    num_function_invocations = []
-    for function_name, trace in tracelines.items():
-        if trace.dtype == np.int32:
-            num_function_invocations.append(np.sum(trace))
-        else:
-            num_function_invocations.append(trace.size)
     if DEBUG:
+        num_functions = len(tracelines.keys())
+        if isinstance(tracelines, TraceStore):
+            num_function_invocations = list(tracelines.num_invocations())
+        else:
+            num_function_invocations = []
+            for function_name, trace in tracelines.items():
+                if trace.dtype == np.int32:
+                    num_function_invocations.append(np.sum(trace))
+                else:
+                    num_function_invocations.append(trace.size)
         print(f"Trace: {path[:-4]}, stats: #days: 14, #functions: {num_functions}, "
               f"total invocations: {sum(num_function_invocations)}, "
               f"max: {max(num_function_invocations)}, min: {min(num_function_invocations)}, "
@@ -183,8 +343,7 @@ class TraceReplay:
             self._cv = 0
 
     def to_workload(self, slo: float):
-        return Workload(self.arrivals, [Request(self.model, None, slo, i, {})
-                                        for i in range(len(self.arrivals))])
+        return Workload.from_arrivals(self.model, self.arrivals, slo)
 
     def report_stats(self):
         print(f"Trace for {self.model}, duration: {self.duration}, {self.duration_seconds} (s), #arrivals: {self.arrivals.size}, "
@@ -268,8 +427,92 @@ def report_group_stats(replays: List[TraceReplay]):
         f"Overall cluster rate: {rate:.2f}, cluster cv: {cv:.2f}.")
 
 
+def gamma_from_moments(mean, var, mean_log, fit_method="moments", newton_steps=5):
+    """Estimate the (arrival rate, cv) of gamma inter-arrivals from their
+    moments. Work on scalars or on arrays of intervals.
+
+    Both the moments and the MLE give rate = 1 / mean. For `moments_mle`, the
+    shape solves log(shape) - digamma(shape) = log(mean) - mean_log, starting
+    from its closed-form approximation.
+    """
+    mean, var, mean_log = np.asarray(mean), np.asarray(var), np.asarray(mean_log)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if fit_method == "moments":
+            shape = np.where(var > 0, mean * mean / var, np.nan)
+        else:
+            s = np.log(mean) - mean_log
+            s = np.where(s > 0, s, np.nan)
+            shape = (3 - s + np.sqrt((s - 3) ** 2 + 24 * s)) / (12 * s)
+            for _ in range(newton_steps):
+                shape = shape - ((np.log(shape) - digamma(shape) - s) /
+                                 (1 / shape - polygamma(1, shape)))
+        return 1.0 / mean, np.sqrt(1.0 / shape)
+
+
+def fit_arrival_intervals(model, arrivals, offsets, interval_seconds,
+                          arrival_distribution, fit_method="mle"):
+    """Fit the inter-arrivals of each interval of a model.
+
+    Returns a list of (empirical arrival rate, fitted parameters or None).
+    """
+    if arrival_distribution == "gamma" and fit_method != "mle":
+        return fit_gamma_intervals(arrivals, offsets, interval_seconds, fit_method)
+
+    fits = []
+    for i in range(offsets.size - 1):
+        arrival = arrivals[offsets[i]:offsets[i + 1]]
+        empirical_arrival_rate = arrival.size / interval_seconds
+        inter_arrival = np.diff(arrival) + 1e-6
+        if inter_arrival.size == 0 or (inter_arrival.size == 1 and arrival_distribution == "gamma"):
+            fits.append((empirical_arrival_rate, None))
+            continue
+        if DEBUG:
+            Trace.visualize_inter_arrival(inter_arrival, f"{model}-{i}", n_interval=2000)
+        if arrival_distribution == "exponential":
+            fit = Trace.estimate_exponential(inter_arrival, fit_method)
+        elif arrival_distribution == "gamma":
+            try:
+                fit = Trace.estimate_gamma(inter_arrival, fit_method)
+            except ValueError as ve:
+                warnings.warn("Failed to fit a gamma distribution.")
+                fit = None
+        else:
+            fit = Trace.estimate_pareto(inter_arrival + 1.0, fit_method)
+        fits.append((empirical_arrival_rate, fit))
+    return fits
+
+
+def fit_gamma_intervals(arrivals, offsets, interval_seconds, fit_method):
+    """Fit gamma distributions to all intervals at once from the prefix sums
+    of the inter-arrivals."""
+    counts = np.diff(offsets)
+    inter_arrival = np.diff(arrivals) + 1e-6
+    prefix = [np.concatenate(([0.0], np.cumsum(x)))
+              for x in [inter_arrival, inter_arrival ** 2, np.log(inter_arrival)]]
+
+    # Interval i has the inter-arrivals [offsets[i], offsets[i+1] - 1)
+    valid = counts > 2
+    lo, hi = offsets[:-1][valid], offsets[1:][valid] - 1
+    n = hi - lo
+    mean, mean_sq, mean_log = [(x[hi] - x[lo]) / n for x in prefix]
+    arrival_rates, cvs = gamma_from_moments(mean, np.maximum(mean_sq - mean * mean, 0),
+                                            mean_log, fit_method)
+
+    fits = [(count / interval_seconds, None) for count in counts]
+    for i, arrival_rate, cv in zip(np.nonzero(valid)[0], arrival_rates, cvs):
+        fits[i] = (fits[i][0], (float(arrival_rate), float(cv)))
+    return fits
+
+
 class Trace:
-    def __init__(self, trace_name, trace_dir):
+    def __init__(self, trace_name, trace_dir, cache_dir=None):
+        """A trace that can be sliced and replayed.
+
+        The fitted arrival distributions of `replay` are memoized. If
+        `cache_dir` (default: $ALPA_SERVE_TRACE_CACHE_DIR) is set, they are
+        also persisted to disk, keyed by the hash of the trace file and the
+        replay arguments, and reused across runs.
+        """
         self.trace_name: str = trace_name
         self.trace_dir: str = trace_dir
         self.have_timestamp: bool = False
@@ -277,6 +520,11 @@ class Trace:
         self.function_histogram = None
         self.n_day = 14
 
+        self.distribution_cache = {}
+        cache_dir = cache_dir or os.environ.get("ALPA_SERVE_TRACE_CACHE_DIR")
+        self.cache_dir = os.path.expanduser(cache_dir) if cache_dir else None
+        self._fingerprint = None
+
         if trace_name == "azure_v1":
             self.function_histogram = load_trace(trace_dir)
         elif trace_name == "azure_v2":
@@ -320,22 +568,35 @@ class Trace:
         assert self.function_histogram is not None
         start_slot = start_d * 24 * 60 + start_h * 60 + start_m
         end_slot = end_d * 24 * 60 + end_h * 60 + end_m
+        if isinstance(self.function_histogram, TraceStore):
+            return self.function_histogram.slice_histogram(start_slot, end_slot)
         sliced_histogram = OrderedDict()
         for function_name, histogram in self.function_histogram.items():
             sliced_histogram[function_name] = histogram[start_slot:end_slot]
         return sliced_histogram
 
     def slice_arrival(self, start_d, start_h, start_m, end_d, end_h, end_m):
-        assert self.function_arrivals is not None
         start_timestamp_seconds = start_d * 24 * 60 * 60 + start_h * 60 * 60 + start_m * 60
         end_timestamp_seconds = end_d * 24 * 60 * 60 + end_h * 60 * 60 + end_m * 60
+        return self.slice_arrival_seconds(start_timestamp_seconds, end_timestamp_seconds)
+
+    def slice_arrival_seconds(self, start_seconds, end_seconds):
+        assert self.function_arrivals is not None
+        if isinstance(self.function_arrivals, TraceStore):
+            return self.function_arrivals.slice_arrival(start_seconds, end_seconds)
         sliced_arrival = OrderedDict()
         for function_name, trace in self.function_arrivals.items():
-            tmp = trace[trace >= start_timestamp_seconds]
-            tmp = tmp[tmp < end_timestamp_seconds]
-            sliced_arrival[function_name] = tmp
+            # The arrivals of each function are sorted
+            lo, hi = np.searchsorted(trace, [start_seconds, end_seconds])
+            sliced_arrival[function_name] = trace[lo:hi]
         return sliced_arrival
 
+    def count_arrivals(self, start_seconds, end_seconds):
+        """Return the number of arrivals of each function in [start_seconds, end_seconds)."""
+        assert self.function_arrivals is not None
+        return [np.diff(np.searchsorted(trace, [start_seconds, end_seconds]))[0]
+                for trace in self.function_arrivals.values()]
+
     def replay(self,
                models: List[str],
                model_mapping_strategy: str = "stripe",
@@ -347,7 +608,9 @@ class Trace:
                cv_scale_factor: float = 1.0,
                time_scale_factor: float = 1.0,
                replication_factor: int = 1,
-               seed: int = 0) -> Dict[str, TraceReplay]:
+               seed: int = 0,
+               fit_method: str = "mle",
+               num_workers: int = 1) -> Dict[str, TraceReplay]:
         """Return a workload that replays a given slice of the trace.
 
         The method replays the trace by mapping functions in the trace to models provided by
@@ -366,10 +629,178 @@ class Trace:
                 a 1-hour trace will be used as if it were 30 mins.
             replication_factor (int): simply replicate each arrival given a factor.
             seed (int): random seed for the generation process.
+            fit_method (str): `mle` fits the distributions with scipy, `moments` uses
+                the method of moments, and `moments_mle` refines the moments with a few
+                Newton steps of the MLE. Only used for azure_v2.
+            num_workers (int): the number of processes to fit the distributions of models.
 
         Returns:
             replays (Dict[str, TraceReplay]): the TraceReplay for each model.
         """
+        self.check_replay_args(arrival_distribution, rate_scale_factor, cv_scale_factor,
+                               time_scale_factor, replication_factor)
+
+        replays = OrderedDict()
+        start_d, start_h, start_m = self.timestr_to_dhm(start_time)
+        end_d, end_h, end_m = self.timestr_to_dhm(end_time)
+        start_timestamp_seconds = start_d * 24 * 60 * 60 + start_h * 60 * 60 + start_m * 60
+        end_timestamp_seconds = end_d * 24 * 60 * 60 + end_h * 60 * 60 + end_m * 60
+
+        if self.trace_name == "azure_v2" and arrival_distribution == "vanilla":
+            model_arrivals = self.map_arrivals(models, model_mapping_strategy, start_time, end_time)
+            if replication_factor > 1:
+                for m in model_arrivals:
+                    model_arrivals[m] = np.repeat(model_arrivals[m], replication_factor)
+            for m in model_arrivals:
+                model_arrivals[m] = (model_arrivals[m] - start_timestamp_seconds) / time_scale_factor + start_timestamp_seconds
+                replays[m] = TraceReplay(m,
+                                    model_arrivals[m],
+                                    self.trace_name,
+                                    start_time,
+                                    end_time,
+                                    end_timestamp_seconds - start_timestamp_seconds,
+                                    arrival_distribution,
+                                    rate_scale_factor=rate_scale_factor,
+                                    cv_scale_factor=cv_scale_factor,
+                                    time_scale_factor=time_scale_factor,
+                                    replication_factor=replication_factor)
+            return replays
+
+        distributions = self.fit_distributions(models, model_mapping_strategy, start_time, end_time,
+                                               arrival_distribution, interval_seconds,
+                                               rate_scale_factor, cv_scale_factor,
+                                               fit_method, num_workers)
+        seeds = self.interval_seeds(distributions, seed)
+
+        # Sample from the distributions and generate the arrivals
+        for m in distributions:
+            arrivals = []
+            arrival_distribution_params = []
+            for i, distribution in enumerate(distributions[m]):
+                if distribution is None:
+                    arrival_distribution_params.append(None)
+                    continue
+                start = i * interval_seconds + start_timestamp_seconds
+                arrivals.append(np.asarray(distribution.generate_arrivals(
+                    start, interval_seconds, seeds[m][i]), dtype=np.float64))
+                # if DEBUG:
+                #     arrivals.extend(distribution.generate_arrivals(0, 1.0e9, seed))
+                #     self.visualize_inter_arrival(np.array(arrivals), "test")
+                arrival_distribution_params.append(distribution.params())
+            replays[m] = TraceReplay(m,
+                                     np.concatenate(arrivals) if arrivals else np.zeros(0),
+                                     self.trace_name,
+                                     start_time,
+                                     end_time,
+                                     interval_seconds,
+                                     arrival_distribution,
+                                     arrival_distribution_params=arrival_distribution_params,
+                                     rate_scale_factor=rate_scale_factor,
+                                     cv_scale_factor=cv_scale_factor,
+                                     time_scale_factor=time_scale_factor)
+
+        return replays
+
+        # sort models
+        # keys = list(replays.keys())
+        # num_models = len(models)
+        # indices = list(range(num_models))
+        # indices.sort(key=lambda i: -len(replays[keys[i]].arrivals))
+
+        # new_replay = OrderedDict()
+        # for i in range(num_models):
+        #     new_replay[models[i]] = replays[keys[indices[i]]]
+        #     new_replay[models[i]].model = models[i]
+
+        # return new_replay
+
+    def replay_chunks(self,
+                      models: List[str],
+                      slos: Union[float, List[float]],
+                      chunk_seconds: float = 3600,
+                      model_mapping_strategy: str = "stripe",
+                      start_time: str = "0.0.0",
+                      end_time: str = "13.23.60",
+                      arrival_distribution: str = "exponential",
+                      interval_seconds: int = 600,
+                      rate_scale_factor: float = 1.0,
+                      cv_scale_factor: float = 1.0,
+                      time_scale_factor: float = 1.0,
+                      replication_factor: int = 1,
+                      seed: int = 0,
+                      fit_method: str = "mle",
+                      num_workers: int = 1) -> Iterator[Workload]:
+        """Lazily replay a slice of the trace as time-ordered workload chunks.
+
+        Each chunk merges the arrivals of all models in about `chunk_seconds`
+        seconds, so the memory does not grow with the length of the slice.
+        The arrivals are the same as `replay`, except that fitted
+        distributions are chunked by whole intervals.
+
+        Args:
+            slos: the SLO of all models, or a list of SLOs, one per model.
+            chunk_seconds: the length of a chunk in seconds.
+            Others: see `replay`.
+        """
+        self.check_replay_args(arrival_distribution, rate_scale_factor, cv_scale_factor,
+                               time_scale_factor, replication_factor)
+        if not isinstance(slos, (list, tuple)):
+            slos = [slos] * len(models)
+        start_d, start_h, start_m = self.timestr_to_dhm(start_time)
+        end_d, end_h, end_m = self.timestr_to_dhm(end_time)
+        start_timestamp_seconds = start_d * 24 * 60 * 60 + start_h * 60 * 60 + start_m * 60
+        end_timestamp_seconds = end_d * 24 * 60 * 60 + end_h * 60 * 60 + end_m * 60
+
+        if self.trace_name == "azure_v2" and arrival_distribution == "vanilla":
+            # Only the number of arrivals of each function is needed for the mapping
+            function_names = [f for f, n in zip(self.function_arrivals.keys(), self.count_arrivals(
+                start_timestamp_seconds, end_timestamp_seconds)) if n > 0]
+            function_model_mapping = self.map_model(models, function_names, model_mapping_strategy)
+            trace_chunk_seconds = chunk_seconds * time_scale_factor
+            for t in np.arange(start_timestamp_seconds, end_timestamp_seconds, trace_chunk_seconds):
+                function_arrivals = self.slice_arrival_seconds(
+                    t, min(t + trace_chunk_seconds, end_timestamp_seconds))
+                model_function_arrivals = OrderedDict()
+                for f, m in function_model_mapping.items():
+                    model_function_arrivals.setdefault(m, []).append(function_arrivals[f])
+                ws = []
+                for m, slo in zip(models, slos):
+                    if m not in model_function_arrivals:
+                        continue
+                    arrivals = np.sort(np.concatenate(model_function_arrivals[m]))
+                    if replication_factor > 1:
+                        arrivals = np.repeat(arrivals, replication_factor)
+                    arrivals = (arrivals - start_timestamp_seconds) / time_scale_factor + start_timestamp_seconds
+                    ws.append(Workload.from_arrivals(m, arrivals, slo))
+                yield Workload.merge(*ws)
+            return
+
+        distributions = self.fit_distributions(models, model_mapping_strategy, start_time, end_time,
+                                               arrival_distribution, interval_seconds,
+                                               rate_scale_factor, cv_scale_factor,
+                                               fit_method, num_workers)
+        seeds = self.interval_seeds(distributions, seed)
+        num_intervals = max((len(x) for x in distributions.values()), default=0)
+        intervals_per_chunk = max(int(round(chunk_seconds / interval_seconds)), 1)
+        for i0 in range(0, num_intervals, intervals_per_chunk):
+            ws = []
+            for m, slo in zip(models, slos):
+                if m not in distributions:
+                    continue
+                arrivals = []
+                for i in range(i0, min(i0 + intervals_per_chunk, len(distributions[m]))):
+                    distribution = distributions[m][i]
+                    if distribution is None:
+                        continue
+                    start = i * interval_seconds + start_timestamp_seconds
+                    arrivals.append(np.asarray(distribution.generate_arrivals(
+                        start, interval_seconds, seeds[m][i]), dtype=np.float64))
+                if arrivals:
+                    ws.append(Workload.from_arrivals(m, np.concatenate(arrivals), slo))
+            yield Workload.merge(*ws)
+
+    def check_replay_args(self, arrival_distribution, rate_scale_factor, cv_scale_factor,
+                          time_scale_factor, replication_factor):
         # Do some checks
         if replication_factor < 1:
             warnings.warn("`replication factor` should not be less than 1. Reset it to 1.")
@@ -387,13 +818,65 @@ class Trace:
         if time_scale_factor != 1.0 and (rate_scale_factor != 1.0 or cv_scale_factor != 1.0):
             raise RuntimeError("Choose one: scale rate/cv, or scale time.")
 
-        replays = OrderedDict()
+    @staticmethod
+    def interval_seeds(distributions, seed):
+        """Return the seed of each interval of each model. The seed increases
+        by one for every interval that has a distribution."""
+        seeds = OrderedDict()
+        for m in distributions:
+            seeds[m] = []
+            for distribution in distributions[m]:
+                seeds[m].append(seed)
+                if distribution is not None:
+                    seed += 1
+        return seeds
+
+    def map_arrivals(self, models, model_mapping_strategy, start_time, end_time):
+        """Slice the azure_v2 trace and merge the arrivals of functions into models."""
+        # 1. Convert function trace to model trace
+        model_arrivals = OrderedDict()
+        model_function_arrivals = OrderedDict()
+        assert self.function_arrivals is not None
+        function_arrivals = self.slice(start_time, end_time)
+        functions_to_remove = [f for f in function_arrivals if function_arrivals[f].size == 0]
+        for f in functions_to_remove:
+            del function_arrivals[f]
+        # generate function model mapping.
+        function_model_mapping = self.map_model(models, function_arrivals.keys(), model_mapping_strategy)
+        for f, m in function_model_mapping.items():
+            model_function_arrivals.setdefault(m, []).append(function_arrivals[f])
+        for m, arrivals in model_function_arrivals.items():
+            model_arrivals[m] = np.sort(np.concatenate(arrivals))
+        return model_arrivals
+
+    def fit_distributions(self,
+                          models,
+                          model_mapping_strategy,
+                          start_time,
+                          end_time,
+                          arrival_distribution,
+                          interval_seconds,
+                          rate_scale_factor,
+                          cv_scale_factor,
+                          fit_method,
+                          num_workers):
+        """Estimate the arrival distribution of each interval of each model."""
         start_d, start_h, start_m = self.timestr_to_dhm(start_time)
         end_d, end_h, end_m = self.timestr_to_dhm(end_time)
         start_timestamp_seconds = start_d * 24 * 60 * 60 + start_h * 60 * 60 + start_m * 60
         end_timestamp_seconds = end_d * 24 * 60 * 60 + end_h * 60 * 60 + end_m * 60
 
-        if self.trace_name == "azure_v1":
+        distributions = None
+        if self.trace_name == "azure_v2":
+            cache_key = (tuple(models), model_mapping_strategy, start_time, end_time,
+                         arrival_distribution, interval_seconds, rate_scale_factor,
+                         cv_scale_factor, fit_method)
+            distributions = self.load_distributions(cache_key)
+
+        if distributions is not None:
+            # Reuse the fitted distributions
+            pass
+        elif self.trace_name == "azure_v1":
             # Trace are 1-min histograms
             # 1. Convert function trace to model trace
             model_histogram = OrderedDict()
@@ -415,14 +898,11 @@ class Trace:
             assert interval_seconds % 60 == 0, "Please set `interval_seconds` as a multiple of 60"
             n_min_per_interval = interval_seconds // 60
             for model, histogram in model_histogram.items():
-                n_total_min = histogram.size
-                n_interval = (n_total_min + n_min_per_interval - 1) // n_min_per_interval
-                accumulated = np.zeros((n_interval,), dtype=np.int32)
-                for i in range(accumulated.size):
-                    start = i * n_min_per_interval
-                    end = (i + 1) * n_min_per_interval if (i + 1) * n_min_per_interval <= n_total_min else n_total_min
-                    accumulated[i] = np.sum(histogram[start:end])
-                histogram_dataset[model] = accumulated
+                if histogram.size == 0:
+                    histogram_dataset[model] = np.zeros((0,), dtype=np.int32)
+                    continue
+                starts = np.arange(0, histogram.size, n_min_per_interval)
+                histogram_dataset[model] = np.add.reduceat(histogram, starts).astype(np.int32)
 
             # Estimate distribution parameters with histogram dataset
             distributions = self.estimate_parameters_with_histogram(histogram_dataset,
@@ -432,106 +912,30 @@ class Trace:
                                                                     cv_scale_factor)
         elif self.trace_name == "azure_v2":
             # Trace are exact arrivals
-            # 1. Convert function trace to model trace
-            model_arrivals = OrderedDict()
-            assert self.function_arrivals is not None
-            function_arrivals = self.slice(start_time, end_time)
-            functions_to_remove = [f for f in function_arrivals if function_arrivals[f].size == 0]
-            for f in functions_to_remove:
-                del function_arrivals[f]
-            # generate function model mapping.
-            function_model_mapping = self.map_model(models, function_arrivals.keys(), model_mapping_strategy)
-            for f, m in function_model_mapping.items():
-                if m not in model_arrivals:
-                    model_arrivals[m] = function_arrivals[f]
-                else:
-                    model_arrivals[m] = np.concatenate((model_arrivals[m], function_arrivals[f]))
-            for m in model_arrivals:
-                model_arrivals[m] = np.sort(model_arrivals[m])
-
-            if arrival_distribution == "vanilla":
-                if replication_factor > 1:
-                    for m in model_arrivals:
-                        model_arrivals[m] = np.repeat(model_arrivals[m], replication_factor)
-                for m in model_arrivals:
-                    model_arrivals[m] = (model_arrivals[m] - start_timestamp_seconds) / time_scale_factor + start_timestamp_seconds
-                    replays[m] = TraceReplay(m,
-                                        model_arrivals[m],
-                                        self.trace_name,
-                                        start_time,
-                                        end_time,
-                                        end_timestamp_seconds - start_timestamp_seconds,
-                                        arrival_distribution,
-                                        rate_scale_factor=rate_scale_factor,
-                                        cv_scale_factor=cv_scale_factor,
-                                        time_scale_factor=time_scale_factor,
-                                        replication_factor=replication_factor)
-                return replays
+            model_arrivals = self.map_arrivals(models, model_mapping_strategy, start_time, end_time)
 
             # 2. bucketing arrivals based on `interval_seconds` and start/end time.
+            # The arrivals of interval i are arrivals[offsets[i]:offsets[i+1]].
             arrival_dataset = OrderedDict()
             intervals = np.arange(start_timestamp_seconds, end_timestamp_seconds, interval_seconds)
             if intervals[-1] != end_timestamp_seconds:
                 intervals = np.append(intervals, end_timestamp_seconds)
-            for m in model_arrivals:
-                arrivals = model_arrivals[m]
-                interval_dataset = []
-                for i in range(intervals.size - 1):
-                    tmp = arrivals[arrivals >= intervals[i]]
-                    tmp = tmp[tmp < intervals[i+1]]
-                    interval_dataset.append(tmp)
-                arrival_dataset[m] = interval_dataset
+            for m, arrivals in model_arrivals.items():
+                offsets = np.searchsorted(arrivals, intervals, side="left")
+                arrival_dataset[m] = (arrivals, offsets)
 
             # 3. estimate distribution parameters based on arrivals
             distributions = self.estimate_parameters_with_arrivals(arrival_dataset,
                                                                    arrival_distribution,
                                                                    interval_seconds,
                                                                    rate_scale_factor,
-                                                                   cv_scale_factor)
+                                                                   cv_scale_factor,
+                                                                   fit_method,
+                                                                   num_workers)
+            self.save_distributions(cache_key, distributions)
         else:
             raise NotImplementedError("Other trace ")
-
-        # Sample from the distributions and generate the arrivals
-        for m in distributions:
-            arrivals = []
-            arrival_distribution_params = []
-            for i, distribution in enumerate(distributions[m]):
-                if distribution is None:
-                    arrival_distribution_params.append(None)
-                    continue
-                start = i * interval_seconds + start_timestamp_seconds
-                arrivals.extend(distribution.generate_arrivals(start, interval_seconds, seed))
-                # if DEBUG:
-                #     arrivals.extend(distribution.generate_arrivals(0, 1.0e9, seed))
-                #     self.visualize_inter_arrival(np.array(arrivals), "test")
-                arrival_distribution_params.append(distribution.params())
-                seed += 1
-            replays[m] = TraceReplay(m,
-                                     np.array(arrivals),
-                                     self.trace_name,
-                                     start_time,
-                                     end_time,
-                                     interval_seconds,
-                                     arrival_distribution,
-                                     arrival_distribution_params=arrival_distribution_params,
-                                     rate_scale_factor=rate_scale_factor,
-                                     cv_scale_factor=cv_scale_factor,
-                                     time_scale_factor=time_scale_factor)
-
-        return replays
-
-        # sort models
-        # keys = list(replays.keys())
-        # num_models = len(models)
-        # indices = list(range(num_models))
-        # indices.sort(key=lambda i: -len(replays[keys[i]].arrivals))
-
-        # new_replay = OrderedDict()
-        # for i in range(num_models):
-        #     new_replay[models[i]] = replays[keys[indices[i]]]
-        #     new_replay[models[i]].model = models[i]
-
-        # return new_replay
+        return distributions
 
     def replay_vanilla(self,
                        models: List[str],
@@ -590,63 +994,121 @@ class Trace:
                                           arrival_distribution="exponential",
                                           interval_seconds=600,
                                           rate_scale_factor=1.0,
-                                          cv_scale_factor=1.0):
+                                          cv_scale_factor=1.0,
+                                          fit_method="mle",
+                                          num_workers=1):
+        """Estimate the distribution of each interval.
+
+        `dataset` maps a model to (arrivals, offsets), where the arrivals in
+        interval i are arrivals[offsets[i]:offsets[i+1]].
+        """
         if arrival_distribution not in ["exponential", "gamma", "pareto"]:
             raise NotImplementedError(f"Only support exponential | gamma | pareto, "
                                       f" got {arrival_distribution}")
+        if fit_method not in ["mle", "moments", "moments_mle"]:
+            raise NotImplementedError(f"Only support mle | moments | moments_mle, "
+                                      f" got {fit_method}")
+
+        # Fit the intervals of each model
+        args_list = [(model, arrivals, offsets, interval_seconds, arrival_distribution, fit_method)
+                     for model, (arrivals, offsets) in dataset.items()]
+        if num_workers > 1 and len(args_list) > 1:
+            with ProcessPoolExecutor(
+                    min(num_workers, len(args_list)),
+                    mp_context=multiprocessing.get_context("spawn")) as pool:
+                fits = list(pool.map(fit_arrival_intervals, *zip(*args_list)))
+        else:
+            fits = [fit_arrival_intervals(*args) for args in args_list]
+
         distributions = OrderedDict()
-        model_index = 0
-        for model, arrivals in dataset.items():
+        for model_index, (model, model_fits) in enumerate(zip(dataset, fits)):
             distributions[model] = []
-            for i, arrival in enumerate(arrivals):
-                empirical_arrival_rate = arrival.size / interval_seconds
-                inter_arrival = np.diff(arrival) + 1e-6
-                if inter_arrival.size == 0 or (inter_arrival.size == 1 and arrival_distribution == "gamma"):
+            for empirical_arrival_rate, fit in model_fits:
+                if fit is None:
                     distributions[model].append(None)
+                elif arrival_distribution == "exponential":
+                    arrival_rate = fit
+                    if np.isnan(arrival_rate):
+                        distributions[model].append(None)
+                        continue
+                    if arrival_rate > 5 * empirical_arrival_rate:
+                        if DEBUG:
+                            warnings.warn(f"Estimation for model {model_index} is highly biased. "
+                                          f"Hard reset to empirical rate: {empirical_arrival_rate}.")
+                        arrival_rate = empirical_arrival_rate
+                    arrival_rate *= rate_scale_factor
+                    distributions[model].append(PoissonProcess(arrival_rate))
+                elif arrival_distribution == "gamma":
+                    arrival_rate, cv = fit
+                    if np.isnan(arrival_rate) or np.isnan(cv):
+                        distributions[model].append(None)
+                        continue
+                    if arrival_rate > 5 * empirical_arrival_rate:
+                        if DEBUG:
+                            warnings.warn(f"Estimation for model {model_index} is highly biased. "
+                                          f"Hard reset to empirical rate: {empirical_arrival_rate}.")
+                        arrival_rate = empirical_arrival_rate
+                    # scale them
+                    arrival_rate *= rate_scale_factor
+                    cv *= cv_scale_factor
+                    distributions[model].append(GammaProcess(arrival_rate, cv))
+                elif arrival_distribution == "pareto":
+                    shape, scale, loc = fit
+                    if np.isnan(shape) or np.isnan(scale) or np.isnan(loc):
+                        continue
+                    distributions[model].append(ParetoProcess(shape, scale, loc))
                 else:
-                    if DEBUG:
-                        self.visualize_inter_arrival(inter_arrival, f"{model}-{i}", n_interval=2000)
-                    if arrival_distribution == "exponential":
-                        arrival_rate = self.estimate_exponential(inter_arrival)
-                        if np.isnan(arrival_rate):
-                            distributions[model].append(None)
-                            continue
-                        if arrival_rate > 5 * empirical_arrival_rate:
-                            if DEBUG:
-                                warnings.warn(f"Estimation for model {model_index} is highly biased. "
-                                              f"Hard reset to empirical rate: {empirical_arrival_rate}.")
-                            arrival_rate = empirical_arrival_rate
-                        arrival_rate *= rate_scale_factor
-                        distributions[model].append(PoissonProcess(arrival_rate))
-                    elif arrival_distribution == "gamma":
-                        try:
-                            arrival_rate, cv = self.estimate_gamma(inter_arrival)
-                            if np.isnan(arrival_rate) or np.isnan(cv):
-                                distributions[model].append(None)
-                                continue
-                            if arrival_rate > 5 * empirical_arrival_rate:
-                                if DEBUG:
-                                    warnings.warn(f"Estimation for model {model_index} is highly biased. "
-                                                  f"Hard reset to empirical rate: {empirical_arrival_rate}.")
-                                arrival_rate = empirical_arrival_rate
-                            # scale them
-                            arrival_rate *= rate_scale_factor
-                            cv *= cv_scale_factor
-                            distributions[model].append(GammaProcess(arrival_rate, cv))
-                        except ValueError as ve:
-                            warnings.warn("Failed to fit a gamma distribution.")
-                            distributions[model].append(None)
-                    elif arrival_distribution == "pareto":
-                        inter_arrival += 1.0
-                        shape, scale, loc = self.estimate_pareto(inter_arrival)
-                        if np.isnan(shape) or np.isnan(scale) or np.isnan(loc):
-                            continue
-                        distributions[model].append(ParetoProcess(shape, scale, loc))
-                    else:
-                        raise RuntimeError(f"Unrecognized distribution: {arrival_distribution}")
-            model_index += 1
+                    raise RuntimeError(f"Unrecognized distribution: {arrival_distribution}")
+        return distributions
+
+    def load_distributions(self, cache_key):
+        """Return the cached distributions of a replay, or None on a miss."""
+        if cache_key in self.distribution_cache:
+            return self.distribution_cache[cache_key]
+        if self.cache_dir is None:
+            return None
+        cache_path = self.distribution_cache_path(cache_key)
+        if not os.path.exists(cache_path):
+            return None
+        with open(cache_path, "rb") as f:
+            distributions = pickle.load(f)
+        self.distribution_cache[cache_key] = distributions
         return distributions
 
+    def save_distributions(self, cache_key, distributions):
+        self.distribution_cache[cache_key] = distributions
+        if self.cache_dir is None:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_path = self.distribution_cache_path(cache_key)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(distributions, f)
+        os.replace(tmp_path, cache_path)
+
+    def distribution_cache_path(self, cache_key):
+        h = hashlib.sha1()
+        h.update(self.fingerprint.encode())
+        h.update(repr(cache_key).encode())
+        return os.path.join(self.cache_dir, f"{self.trace_name}-{h.hexdigest()}.pkl")
+
+    @property
+    def fingerprint(self):
+        """The hash of the trace file (or of all files of a trace store)."""
+        if self._fingerprint is None:
+            if os.path.isdir(self.trace_dir):
+                paths = [os.path.join(self.trace_dir, x)
+                         for x in sorted(os.listdir(self.trace_dir))]
+            else:
+                paths = [self.trace_dir]
+            h = hashlib.sha1()
+            for path in paths:
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 24), b""):
+                        h.update(chunk)
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
     @staticmethod
     def visualize_inter_arrival(inter_arrival, name, n_interval=300):
         count, bins, _ = plt.hist(inter_arrival, bins=np.linspace(0, 300, n_interval))
@@ -660,20 +1122,32 @@ class Trace:
         plt.close()
 
     @staticmethod
-    def estimate_exponential(inter_arrivals):
+    def estimate_exponential(inter_arrivals, fit_method="mle"):
         """Take inter-arrivals and return the rate parameters."""
+        if fit_method != "mle":
+            # The MLE with loc = 0 is the mean
+            return 1.0 / np.mean(inter_arrivals)
         _, scale = expon.fit(inter_arrivals, floc=0)
         return 1.0 / scale
 
     @staticmethod
-    def estimate_gamma(inter_arrivals):
+    def estimate_gamma(inter_arrivals, fit_method="mle"):
+        if fit_method != "mle":
+            arrival_rate, cv = gamma_from_moments(
+                np.mean(inter_arrivals), np.var(inter_arrivals),
+                np.mean(np.log(inter_arrivals)), fit_method)
+            return float(arrival_rate), float(cv)
+
         shape, _, scale = gamma.fit(inter_arrivals, floc=0)
         cv = math.sqrt(1.0 / shape)
         arrival_rate = 1.0 / (shape * scale)
         return arrival_rate, cv
 
     @staticmethod
-    def estimate_pareto(inter_arrivals):
+    def estimate_pareto(inter_arrivals, fit_method="mle"):
+        if fit_method != "mle":
+            # The MLE with loc = 0 and scale = 1 has a closed form
+            return inter_arrivals.size / np.sum(np.log(inter_arrivals)), 1.0, 0.0
         shape, loc, scale = pareto.fit(inter_arrivals, floc=0.0, fscale=1.0)
         return shape, scale, loc
 
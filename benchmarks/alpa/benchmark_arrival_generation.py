@@ -0,0 +1,72 @@
+"""Benchmark the vectorized arrival generation against the per-request loop."""
+import argparse
+import time
+
+import numpy as np
+
+from alpa_serve.simulator.workload import (GammaProcess, Workload,
+    generate_multi_model_workload)
+
+
+def generate_arrivals_loop(process: GammaProcess, start: float, duration: float,
+                           seed: int = 0):
+    """The reference implementation that appends one arrival at a time."""
+    np.random.seed(seed)
+
+    batch_size = max(int(process.rate_ * duration * 1.2), 1)
+    intervals = np.random.gamma(process.shape, process.scale, size=batch_size)
+    pt = 0
+
+    ticks = []
+    cur = start + intervals[0]
+    end = start + duration
+    while cur < end:
+        ticks.append(cur)
+
+        pt += 1
+        if pt >= batch_size:
+            intervals = np.random.gamma(process.shape, process.scale, size=batch_size)
+            pt = 0
+
+        cur += intervals[pt]
+
+    return ticks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rate", type=float, default=1000,
+                        help="The total rate of all models.")
+    parser.add_argument("--cv", type=float, default=4)
+    parser.add_argument("--duration", type=float, default=86400)
+    parser.add_argument("--num-models", type=int, default=10)
+    parser.add_argument("--skip-loop", action="store_true")
+    args = parser.parse_args()
+
+    model_names = [f"m{i}" for i in range(args.num_models)]
+    processes = [GammaProcess(args.rate / args.num_models, args.cv)
+                 for _ in range(args.num_models)]
+
+    tic = time.time()
+    workload = generate_multi_model_workload(
+        processes, model_names, 0, args.duration, slos=[0.5] * args.num_models)
+    bulk_cost = time.time() - tic
+    print(f"#req: {len(workload)}, bulk: {bulk_cost:.2f} s")
+    del workload
+
+    tic = time.time()
+    ws = [p.generate_workload(name, 0, args.duration, slo=0.5, seed=i)
+          for i, (p, name) in enumerate(zip(processes, model_names))]
+    vectorized_cost = time.time() - tic
+    print(f"vectorized per model: {vectorized_cost:.2f} s")
+    del ws
+
+    if not args.skip_loop:
+        tic = time.time()
+        ws = []
+        for i, (p, name) in enumerate(zip(processes, model_names)):
+            ticks = generate_arrivals_loop(p, 0, args.duration, seed=i)
+            ws.append(Workload.from_arrivals(name, ticks, 0.5))
+        workload = Workload.merge(*ws)
+        loop_cost = time.time() - tic
+        print(f"loop: {loop_cost:.2f} s, speedup: {loop_cost / bulk_cost:.1f}x")
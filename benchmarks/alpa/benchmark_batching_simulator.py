@@ -0,0 +1,81 @@
+"""Benchmark the numba batching kernel of the fast simulator against the
+reference python implementation."""
+import argparse
+import time
+
+import numpy as np
+
+from alpa_serve.profiling import ParallelConfig, ProfilingResult, LatencyMemData
+from alpa_serve.placement_policy.base_policy import ModelPlacement
+from alpa_serve.simulator.controller import (
+    approximate_one_case_one_placement, simulate_requests_mixed_batching,
+    simulate_requests_mixed_batching_python)
+from alpa_serve.simulator.workload import Workload, GammaProcess
+from alpa_serve.util import GB, batchsize_config
+
+
+def batched_prof_result(name, single_latency, pp):
+    # Assume the latency grows sub-linearly with the batch size
+    latency = {bs: [single_latency / pp * bs ** 0.7] * pp
+               for bs in batchsize_config}
+    return ProfilingResult(name, {
+        ParallelConfig(1, 1, pp): LatencyMemData(
+            latency=latency,
+            act_mem={bs: [0] * pp for bs in batchsize_config},
+            weight_mem=[2 * GB / pp] * pp),
+    }, 0, 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-models", type=int, default=8)
+    parser.add_argument("--num-groups", type=int, default=4)
+    parser.add_argument("--pp", type=int, default=2)
+    parser.add_argument("--rate", type=float, default=30)
+    parser.add_argument("--cv", type=float, default=4)
+    parser.add_argument("--duration", type=float, default=1000)
+    parser.add_argument("--slo", type=float, default=0.5)
+    args = parser.parse_args()
+
+    model_names = [f"m{i}" for i in range(args.num_models)]
+    prof_ress = [batched_prof_result(name, 0.1, args.pp) for name in model_names]
+    placement = ModelPlacement(
+        [ParallelConfig(1, 1, args.pp)] * args.num_groups,
+        [list(range(args.num_models))] * args.num_groups)
+
+    workload = Workload.merge(*[
+        GammaProcess(args.rate, args.cv).generate_workload(
+            name, 0, args.duration, slo=args.slo, seed=i)
+        for i, name in enumerate(model_names)])
+    model_ids, slos, workload_model_names = workload.get_columns()
+    slos = slos.astype(np.float32)
+    model_ids = np.array([int(name[1:]) for name in workload_model_names],
+                         dtype=np.int32)[model_ids]
+
+    # Warm up the jit compilation
+    approximate_one_case_one_placement(
+        placement, model_names, prof_ress, model_ids[:100], slos[:100],
+        workload.arrivals[:100], enable_batching=True)
+
+    tic = time.time()
+    res = approximate_one_case_one_placement(
+        placement, model_names, prof_ress, model_ids, slos,
+        workload.arrivals, enable_batching=True)
+    numba_cost = time.time() - tic
+
+    # Swap in the python kernel
+    import alpa_serve.simulator.controller as controller_module
+    controller_module.simulate_requests_mixed_batching = (
+        simulate_requests_mixed_batching_python)
+    tic = time.time()
+    ref = approximate_one_case_one_placement(
+        placement, model_names, prof_ress, model_ids, slos,
+        workload.arrivals, enable_batching=True)
+    python_cost = time.time() - tic
+    controller_module.simulate_requests_mixed_batching = (
+        simulate_requests_mixed_batching)
+
+    assert all(np.array_equal(x, y) for x, y in zip(res, ref))
+    print(f"#req: {len(workload)}, goodput: {np.mean(res[2])*100:.2f} %")
+    print(f"python: {python_cost:.3f} s, numba: {numba_cost:.3f} s, "
+          f"speedup: {python_cost / numba_cost:.1f}x")
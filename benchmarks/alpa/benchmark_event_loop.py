@@ -0,0 +1,63 @@
+"""Benchmark the events/sec of the simulator event loop engines."""
+import argparse
+from functools import partial
+import time
+
+import numpy as np
+
+from alpa_serve.profiling import ParallelConfig, load_test_prof_result
+from alpa_serve.simulator import event_loop
+from alpa_serve.simulator.controller import simulate_one_case
+from alpa_serve.simulator.executable import Executable
+from alpa_serve.simulator.workload import Workload, PoissonProcess
+from alpa_serve.util import ServingCase
+
+
+def benchmark_case(num_models, num_groups, per_model_rate, duration):
+    model_names = [f"m{i}" for i in range(num_models)]
+    prof_result = load_test_prof_result("test-2GB-100ms")
+
+    def register_models(controller):
+        for name in model_names:
+            controller.register_model.remote(
+                name, partial(Executable, prof_result))
+
+    def generate_workload(start=0):
+        ws = [PoissonProcess(per_model_rate).generate_workload(
+                  name, start, duration, slo=0.5, seed=i)
+              for i, name in enumerate(model_names)]
+        return Workload.merge(*ws)
+
+    def place_models(controller):
+        for group_id in range(num_groups):
+            controller.create_mesh_group_manager.remote(group_id, [1, 2])
+            for name in model_names:
+                controller.create_replica.remote(
+                    name, group_id, [ParallelConfig(1, 1, 2)])
+
+    return ServingCase(register_models, generate_workload, place_models)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-models", type=int, default=4)
+    parser.add_argument("--num-groups", type=int, default=4)
+    parser.add_argument("--rate", type=float, default=8)
+    parser.add_argument("--duration", type=float, default=200)
+    parser.add_argument("--engines", type=str, default="asyncio,heap")
+    args = parser.parse_args()
+
+    case = benchmark_case(args.num_models, args.num_groups,
+                          args.rate, args.duration)
+
+    for engine in args.engines.split(","):
+        np.random.seed(0)
+        tic = time.time()
+        stats, _ = simulate_one_case(case, engine=engine)
+        cost = time.time() - tic
+        num_events = event_loop.loop.num_events
+
+        print(f"engine: {engine}, #req: {stats.num_requests}, "
+              f"#events: {num_events}, time: {cost:.2f} s, "
+              f"events/sec: {num_events / cost:.0f}, "
+              f"goodput: {stats.goodput*100:.2f} %")
@@ -0,0 +1,64 @@
+"""Benchmark the scaling of the process pool backend of PlacementEvaluator."""
+import argparse
+import time
+
+import numpy as np
+
+from alpa_serve.placement_policy import ModelData, ClusterEnv
+from alpa_serve.placement_policy.base_policy import (ModelPlacement,
+    PlacementEvaluator, gen_train_workload)
+from alpa_serve.profiling import ParallelConfig, load_test_prof_result
+from alpa_serve.util import GB
+
+
+def random_placements(num_sols, num_models, num_devices, seed=0):
+    rs = np.random.RandomState(seed)
+    sols = []
+    for _ in range(num_sols):
+        pp = int(rs.choice([1, 2, 4]))
+        num_groups = num_devices // pp
+        group_models = [sorted(rs.choice(num_models, rs.randint(1, 5), replace=False).tolist())
+                        for _ in range(num_groups)]
+        sols.append(ModelPlacement([ParallelConfig(1, 1, pp)] * num_groups, group_models))
+    return sols
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-sols", type=int, default=1024)
+    parser.add_argument("--num-models", type=int, default=16)
+    parser.add_argument("--num-devices", type=int, default=16)
+    parser.add_argument("--num-workers", type=str, default="1,2,4,8")
+    args = parser.parse_args()
+
+    cluster_env = ClusterEnv(num_devices=args.num_devices, mem_budget=13 * GB)
+    model_datas = [
+        ModelData(f"m{i}", 0.5, 2, 4, load_test_prof_result("alpa/bert-1.3b"))
+        for i in range(args.num_models)
+    ]
+    workload = gen_train_workload(model_datas)
+    sols = random_placements(args.num_sols, args.num_models, args.num_devices)
+
+    evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                   "fast_simulator", False, cache_size=0)
+    evaluator.get_scores(sols[:2])  # Warm up the jit compilation
+    tic = time.time()
+    ref_scores = evaluator.get_scores(sols)
+    serial_cost = time.time() - tic
+    print(f"serial: {serial_cost:.2f} s")
+
+    for num_workers in map(int, args.num_workers.split(",")):
+        evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+            "fast_simulator", True, cache_size=0, backend="process",
+            num_workers=num_workers)
+        # Start the workers and warm up the jit compilation
+        evaluator.get_scores(sols[:num_workers * 2])
+
+        tic = time.time()
+        scores = evaluator.get_scores(sols)
+        cost = time.time() - tic
+        evaluator.close()
+
+        assert np.allclose(scores, ref_scores)
+        print(f"#workers: {num_workers}, time: {cost:.2f} s, "
+              f"speedup: {serial_cost / cost:.2f}x")
@@ -0,0 +1,104 @@
+"""Benchmark the per-request CPU overhead of forwarding an HTTP request from the
+controller to a group manager: the Starlette path vs. the compact fast path.
+
+Ray serializes the arguments of a remote call with pickle, so pickle.dumps and
+pickle.loads stand in for the transport here.
+"""
+import argparse
+import asyncio
+import json
+import pickle
+import time
+
+from alpa_serve.controller import CompactRequestView
+from alpa_serve.http_util import (HTTPRequestWrapper, CompactRequest,
+                                  build_starlette_request)
+
+
+def make_scope(query_string=b""):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "server": ("127.0.0.1", 20001),
+        "client": ("127.0.0.1", 53210),
+        "scheme": "http",
+        "method": "POST",
+        "root_path": "",
+        "path": "/",
+        "raw_path": b"/",
+        "query_string": query_string,
+        "headers": [(b"host", b"localhost:20001"),
+                    (b"user-agent", b"python-requests/2.31.0"),
+                    (b"accept-encoding", b"gzip, deflate"),
+                    (b"accept", b"*/*"),
+                    (b"connection", b"keep-alive"),
+                    (b"content-type", b"application/json")],
+        "ts": [("a", time.time())],
+    }
+
+
+async def starlette_path(body):
+    # Controller
+    scope = make_scope()
+    request_wrapper = HTTPRequestWrapper(scope, body)
+    request_wrapper_bytes = pickle.dumps(request_wrapper)
+    name = (await build_starlette_request(request_wrapper).json())["model"]
+    message = pickle.dumps((name, request_wrapper_bytes))
+
+    # Group manager
+    name, request_wrapper_bytes = pickle.loads(message)
+    request = build_starlette_request(pickle.loads(request_wrapper_bytes))
+    obj = await request.json()
+    return obj["submit_time"], obj["slo"], request
+
+
+async def fast_path(body):
+    # Controller
+    scope = make_scope()
+    obj = json.loads(body)
+    message = pickle.dumps((obj["model"], CompactRequest(
+        obj["model"], obj.get("submit_time"), obj.get("slo"), obj.get("idx"),
+        body, scope["ts"])))
+
+    # Group manager
+    name, request_wrapper = pickle.loads(message)
+    request = CompactRequestView(request_wrapper)
+    return request_wrapper.submit_time, request_wrapper.slo, request
+
+
+async def benchmark(path, body, n_iter):
+    for _ in range(100):
+        await (await path(body))[2].json()
+
+    tic = time.perf_counter()
+    for _ in range(n_iter):
+        _, _, request = await path(body)
+        # The replica reads the input
+        obj = await request.json()
+    cost = (time.perf_counter() - tic) / n_iter
+
+    assert obj == json.loads(body)
+    return cost
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n-iter", type=int, default=20000)
+    parser.add_argument("--input-len", type=int, default=128)
+    args = parser.parse_args()
+
+    body = json.dumps({
+        "model": "bert-1.3b-0",
+        "submit_time": time.time(),
+        "slo": 0.5,
+        "idx": 42,
+        "input": "Paris is the capital city of " * (args.input_len // 30 + 1),
+    }).encode()
+
+    starlette_cost = asyncio.run(benchmark(starlette_path, body, args.n_iter))
+    fast_cost = asyncio.run(benchmark(fast_path, body, args.n_iter))
+    print(f"body: {len(body)} bytes")
+    print(f"starlette: {starlette_cost * 1e6:.2f} us/req, "
+          f"fast path: {fast_cost * 1e6:.2f} us/req, "
+          f"speedup: {starlette_cost / fast_cost:.1f}x")
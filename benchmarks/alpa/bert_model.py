@@ -37,9 +37,14 @@ bert_specs = {
 
 
 class BertModel:
-    def __init__(self, model_config, profiling_result, parallel_config):
+    def __init__(self, model_config, profiling_result, parallel_config,
+                 max_batch_size=1):
         self.latency_mem = profiling_result.para_dict[parallel_config]
         self.metadata = profiling_result.para_dict[parallel_config].metadata
+        # Compile an executable for each profiled batch size up to
+        # max_batch_size, so that handle_batch can run batched requests
+        self.batch_sizes = sorted(set(
+            [1] + [b for b in self.latency_mem.latency if b <= max_batch_size]))
 
         self.logger = logging.getLogger("bert_model")
         self.logger.setLevel(logging.INFO)
@@ -113,17 +118,19 @@ class BertModel:
         # Create model
         seq_len, hidden_size, num_layers, num_heads, vocab_size = model_config
         dp, op, pp = parallel_config
-        batch_size = 1
         dtype = params_dtype = jnp.float16
         add_manual_layer_marker = True
         num_manual_pipeline_stages = pp
 
-        batch = {
-            "input_ids": np.ones((batch_size, seq_len), np.int32),
-            "attention_mask": np.ones((batch_size, seq_len), np.int32),
-            "token_type_ids": np.ones((batch_size, seq_len), np.int32),
-            "position_ids": np.ones((batch_size, seq_len), np.int32),
+        batches = {
+            batch_size: {
+                "input_ids": np.ones((batch_size, seq_len), np.int32),
+                "attention_mask": np.ones((batch_size, seq_len), np.int32),
+                "token_type_ids": np.ones((batch_size, seq_len), np.int32),
+                "position_ids": np.ones((batch_size, seq_len), np.int32),
+            } for batch_size in self.batch_sizes
         }
+        batch = batches[1]
 
         bert_config = BertConfig(
             num_labels=5,
@@ -202,24 +209,37 @@ class BertModel:
             params = tree_map(lambda x: jax.asarray(x, dtype=params_dtype),
                 params)
 
-        executable = forward_func.get_executable(params, batch)
+        executables = {
+            batch_size: forward_func.get_executable(params, batches[batch_size])
+            for batch_size in self.batch_sizes
+        }
+        executable = executables[1]
         executable.dump_debug_info("tmp")
         self.executable = executable
 
-        # Preshard params
+        # Preshard params. The executables of different batch sizes share
+        # the sharded params when their placement specs are the same.
         if use_dummy_weights:
             global_config.use_dummy_value_for_benchmarking = True
 
-        params_ps = executable.get_input_placement_specs()[0]
         flat_params, in_tree = tree_flatten(params)
-        flat_ps = tree_leaves(params_ps)
-        params = tree_unflatten(
-            in_tree,
-            executable.mesh_group.shard_args_to_arrays(flat_ps, flat_params))
+        sharded_params = []  # List[(flat_ps, params)]
+        params_dict = {}
+        for batch_size, executable in executables.items():
+            flat_ps = tree_leaves(executable.get_input_placement_specs()[0])
+            for ps, sharded in sharded_params:
+                if ps == flat_ps:
+                    break
+            else:
+                sharded = tree_unflatten(
+                    in_tree,
+                    executable.mesh_group.shard_args_to_arrays(flat_ps, flat_params))
+                sharded_params.append((flat_ps, sharded))
+            params_dict[batch_size] = sharded
         global_config.use_dummy_value_for_benchmarking = False
 
         # Final inference function
-        def infer_func(src, request):
+        def infer_func(srcs, requests):
             #inputs = tokenizer(src,
             #                   max_length=seq_len,
             #                   padding="max_length",
@@ -232,8 +252,11 @@ class BertModel:
             #    "position_ids": np.broadcast_to(np.arange(
             #        np.atleast_2d(input_ids).shape[-1]), input_ids.shape),
             #}
-            outputs = executable(params, batch)
-            request.scope["ts"].append(("d", time.time()))
+            batch_size = len(srcs)
+            outputs = executables[batch_size](params_dict[batch_size],
+                                              batches[batch_size])
+            for request in requests:
+                request.scope["ts"].append(("d", time.time()))
             logits = outputs.logits
             logits.prefetch()
             return logits.to_np_async()
@@ -244,7 +267,7 @@ class BertModel:
         obj = await request.json()
 
         request.scope["ts"].append(("c", time.time()))
-        res = await self.infer_func(obj["input"], request)
+        res = await self.infer_func([obj["input"]], [request])
         request.scope["ts"].append(("e", time.time()))
 
         return {
@@ -252,9 +275,25 @@ class BertModel:
             "logits": res.tolist(),
             "ts": request.scope["ts"],
         }
-    
+
+    async def handle_batch(self, requests):
+        objs = [await request.json() for request in requests]
+
+        for request in requests:
+            request.scope["ts"].append(("c", time.time()))
+        res = await self.infer_func([obj["input"] for obj in objs], requests)
+        for request in requests:
+            request.scope["ts"].append(("e", time.time()))
+
+        return [{
+            "rejected": False,
+            "logits": res[i:i + 1].tolist(),
+            "ts": request.scope["ts"],
+        } for i, request in enumerate(requests)]
+
     def get_latency_dict(self):
-        return self.latency_mem.latency
+        # Only the batch sizes with a compiled executable
+        return {b: self.latency_mem.latency[b] for b in self.batch_sizes}
 
 
 
@@ -17,7 +17,7 @@ from alpa_serve.placement_policy import (ClusterEnv, ModelData,
     ModelParallelismEqual)
 from alpa_serve.profiling import ProfilingDatabase
 from alpa_serve.trace import Trace, report_group_stats
-from alpa_serve.util import GB, write_tsv, ServingCase
+from alpa_serve.util import GB, write_tsv, ServingCase, batchsize_config
 
 from benchmarks.alpa.util import get_model_def
 from benchmarks.alpa.run_one_case import run_one_case
@@ -30,7 +30,7 @@ EqualModelCase = namedtuple("EqualModelCase", [
     "slo_scale", "duration", "policy_name", "train_start", "train_end",
     "test_start", "test_end"])
 
-def get_equal_model_serving_case(case, prof_database=None):
+def get_equal_model_serving_case(case, prof_database=None, max_batch_size=1):
     if prof_database is None:
         prof_database = ProfilingDatabase("profiling_result.pkl")
 
@@ -183,7 +183,7 @@ def get_equal_model_serving_case(case, prof_database=None):
         for model_name, model_type in zip(model_names, model_types):
             controller.register_model.remote(
                 model_name, get_model_def(model_type, is_simulator,
-                                          prof_database))
+                                          prof_database, max_batch_size))
 
     def generate_workload(start=0):
         base_seed = 0
@@ -254,12 +254,15 @@ def run_one_equal_model_case(case, mode,
                              debug=False,
                              enable_batching=False,
                              return_stats_and_placement=False):
-    serving_case = get_equal_model_serving_case(case, prof_database)
+    max_batch_size = max(batchsize_config) if enable_batching else 1
+    serving_case = get_equal_model_serving_case(case, prof_database,
+                                                max_batch_size)
     if mode == "simulate":
         stats, placement = approximate_one_case(serving_case, debug=debug, enable_batching=enable_batching)
     else:
         stats, placement = run_one_case(serving_case, relax_slo=relax_slo,
-                                        protocol=protocol, debug=debug)
+                                        protocol=protocol, debug=debug,
+                                        enable_batching=enable_batching)
 
     if return_stats_and_placement:
         return stats, placement
@@ -276,14 +279,27 @@ def run_one_equal_model_case(case, mode,
     return values
 
 
+def get_runtime_env():
+    runtime_env = {"working_dir": os.getcwd(), "excludes": ["backup"]}
+    # Share the score cache of the placement evaluator and the fitted
+    # distributions of the trace replays with the workers
+    env_vars = {}
+    for name in ["ALPA_SERVE_EVALUATOR_CACHE_DIR", "ALPA_SERVE_TRACE_CACHE_DIR"]:
+        cache_dir = os.environ.get(name)
+        if cache_dir:
+            env_vars[name] = os.path.abspath(os.path.expanduser(cache_dir))
+    if env_vars:
+        runtime_env["env_vars"] = env_vars
+    return runtime_env
+
+
 def run_equal_model_cases(cases, output_file=None,
                           mode="simulate", relax_slo=False, protocol="http",
                           debug_tstamp=False, parallel=False, enable_batching=False,
                           prof_database=None, return_stats_and_placement=False):
     if parallel and not ray.is_initialized():
         ray.init(address="auto", namespace="alpa_serve",
-                 runtime_env={"working_dir": os.getcwd(),
-                 "excludes": ["backup"]})
+                 runtime_env=get_runtime_env())
 
     if parallel:
         run_one_case_ = ray.remote(num_cpus=2)(run_one_equal_model_case).remote
@@ -14,9 +14,10 @@ from alpa_serve.placement_policy import (ClusterEnv, ModelData,
     ModelParallelismSearch)
 from alpa_serve.profiling import ProfilingDatabase
 from alpa_serve.trace import Trace, report_group_stats
-from alpa_serve.util import GB, write_tsv, ServingCase
+from alpa_serve.util import GB, write_tsv, ServingCase, batchsize_config
 
 from benchmarks.alpa.util import get_model_def
+from benchmarks.alpa.equal_model_case import get_runtime_env
 from benchmarks.alpa.run_one_case import run_one_case
 
 
@@ -26,7 +27,7 @@ GeneralModelCase = namedtuple("GeneralModelCase", [
     "slo_scale", "duration", "policy_name"])
 
 
-def get_general_model_serving_case(case, prof_database=None):
+def get_general_model_serving_case(case, prof_database=None, max_batch_size=1):
     assert isinstance(case, GeneralModelCase), "not GeneralModelCase"
     if prof_database is None:
         prof_database = ProfilingDatabase("profiling_result.pkl")
@@ -140,17 +141,17 @@ def get_general_model_serving_case(case, prof_database=None):
         for model_name, model_type in zip(model_names, model_types):
             controller.register_model.remote(
                 model_name, get_model_def(model_type, is_simulator,
-                                          prof_database))
+                                          prof_database, max_batch_size))
 
     def generate_workload(start=0):
-        w = Workload.empty()
+        ws = []
         for i in range(num_models):
             if "azure" in arrival_process:
-                w += arrival_processes[i].to_workload(slos[i])
+                ws.append(arrival_processes[i].to_workload(slos[i]))
             else:
-                w += arrival_processes[i].generate_workload(model_names[i], start,
-                                                            duration, slo=slos[i], seed=i)
-        return w
+                ws.append(arrival_processes[i].generate_workload(model_names[i], start,
+                                                                 duration, slo=slos[i], seed=i))
+        return Workload.merge(*ws)
 
     def place_models(controller):
         num_models = len(model_names)
@@ -205,13 +206,17 @@ _DATA_HEADS = ("exp_name", "num_models",
 
 def run_one_general_model_case(case, mode,
                                output_file=None, prof_database=None,
-                               debug=False):
-    serving_case = get_general_model_serving_case(case, prof_database)
+                               debug=False, enable_batching=False):
+    max_batch_size = max(batchsize_config) if enable_batching else 1
+    serving_case = get_general_model_serving_case(case, prof_database,
+                                                  max_batch_size)
 
     if mode == "simulate":
-        stats, placement = approximate_one_case(serving_case, debug=debug)
+        stats, placement = approximate_one_case(serving_case, debug=debug,
+                                                enable_batching=enable_batching)
     else:
-        stats, placement = run_one_case(serving_case, debug=debug)
+        stats, placement = run_one_case(serving_case, debug=debug,
+                                        enable_batching=enable_batching)
 
     #Workload.print_stats(stats)
     print(f"group #req: {stats.group_num_requests}")
@@ -234,9 +239,10 @@ def run_one_general_model_case(case, mode,
 
 
 def run_general_model_cases(cases, output_file=None,
-                            mode="simulate", debug_tstamp=False, parallel=False):
+                            mode="simulate", debug_tstamp=False, parallel=False,
+                            enable_batching=False):
     if not ray.is_initialized():
-        ray.init(address="auto", runtime_env={"working_dir": os.getcwd(), "excludes": ["backup"]})
+        ray.init(address="auto", runtime_env=get_runtime_env())
 
     if parallel:
         run_one_case_ = ray.remote(num_cpus=2)(run_one_general_model_case).remote
@@ -246,7 +252,8 @@ def run_general_model_cases(cases, output_file=None,
     results = []
     for case in cases:
         results.append(run_one_case_(case, mode,
-            output_file=output_file, debug=debug_tstamp))
+            output_file=output_file, debug=debug_tstamp,
+            enable_batching=enable_batching))
 
     if parallel:
         results = ray.get(results)
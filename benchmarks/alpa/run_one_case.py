@@ -2,9 +2,11 @@ import argparse
 import asyncio
 import concurrent.futures
 from concurrent.futures import wait
+import json
 from multiprocessing import get_context, Process
 import threading
 import time
+from urllib.parse import urlparse
 
 import requests
 import ray
@@ -200,15 +202,257 @@ class ParallelThreadClient:
         self.res_dict = None
 
 
+class HTTPConnectionPool:
+    """A pool of keep-alive HTTP/1.1 connections for posting JSON requests.
+
+    A request never waits for a connection: a new one is opened when no idle
+    connection is left. At most `max_idle` connections are kept alive after
+    their responses.
+    """
+
+    def __init__(self, url, max_idle=64):
+        url = urlparse(url)
+        self.host = url.hostname
+        self.port = url.port or 80
+        self.header = (f"POST {url.path or '/'} HTTP/1.1\r\n"
+                       f"Host: {url.netloc}\r\n"
+                       "Content-Type: application/json\r\n"
+                       "Content-Length: ").encode()
+        self.max_idle = max_idle
+        self.idle = []
+
+    async def post(self, body: bytes, on_send=None):
+        """Post a JSON body and return (status_code, response_object)."""
+        request = self.header + str(len(body)).encode() + b"\r\n\r\n" + body
+        while True:
+            reused = bool(self.idle)
+            if reused:
+                reader, writer = self.idle.pop()
+            else:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            if on_send:
+                on_send()
+            try:
+                writer.write(request)
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionResetError()
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                # Retry if the server closed an idle keep-alive connection
+                if not reused:
+                    raise
+
+        status_code = int(status_line.split()[1])
+        length, chunked, keep_alive = 0, False, True
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            key, value = line.split(b":", 1)
+            key, value = key.strip().lower(), value.strip().lower()
+            if key == b"content-length":
+                length = int(value)
+            elif key == b"transfer-encoding":
+                chunked = value == b"chunked"
+            elif key == b"connection":
+                keep_alive = value != b"close"
+
+        if chunked:
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                chunks.append(await reader.readexactly(size + 2))
+                if size == 0:
+                    break
+            content = b"".join(x[:-2] for x in chunks)
+        else:
+            content = await reader.readexactly(length)
+
+        if keep_alive and len(self.idle) < self.max_idle:
+            self.idle.append((reader, writer))
+        else:
+            writer.close()
+        return status_code, json.loads(content)
+
+    def close(self):
+        for _, writer in self.idle:
+            writer.close()
+        self.idle = []
+
+
+class AsyncioClient:
+    """An open-loop client that schedules all arrivals on one event loop.
+
+    Requests are sent at their arrival times over a pool of keep-alive
+    connections, so the client needs neither busy-waiting workers nor a
+    thread per request. A request never waits for an earlier one to finish:
+    a new connection is opened when all of them are busy. Two delays of each
+    request are recorded: the timer lateness (the dispatch time minus the
+    scheduled arrival time) and the send delay (the time to get a
+    connection). With `num_shards > 1`, the workload is split round-robin
+    across processes, each running its own event loop, to generate more than
+    10k QPS.
+    """
+
+    def __init__(self, url, relax_slo=False, debug=False, max_idle_connections=256,
+                 num_shards=1):
+        self.url = url
+        self.relax_slo = relax_slo
+        self.debug = debug
+        self.max_idle_connections = max_idle_connections
+        self.num_shards = num_shards
+        self.res_dict = dict()
+        self.lateness_dict = dict()
+
+        if num_shards > 1:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=num_shards, mp_context=get_context("spawn"),
+                initializer=worker_initializer, initargs=(url,))
+
+            # warmup
+            asyncio.run(self.submit_workload(Workload.empty()))
+        else:
+            self.executor = None
+            if url is None:
+                global global_controller
+                global_controller = ray.get_actor(CONTROLLER_NAME)
+
+    async def submit_one(self, pool, i, model_name, slo, start, finish, send, good):
+        slo = None if slo != slo else slo
+        obj = {
+            "model": model_name,
+            "submit_time": start[i],
+            "slo": slo,
+            "idx": i,
+            "input": f"I like this movie {i}",
+        }
+
+        def on_send():
+            send[i] = time.time()
+
+        if pool is None:
+            on_send()
+            res = await global_controller.handle_request.remote(obj)
+            status_code = 200
+        else:
+            status_code, res = await pool.post(json.dumps(obj).encode(), on_send)
+
+        assert status_code == 200, f"{res}"
+        finish[i] = time.time()
+        e2e_latency = finish[i] - start[i]
+        rejected = res["rejected"]
+        good[i] = ((slo is None or e2e_latency <= slo or self.relax_slo)
+                   and not rejected)
+
+        if self.debug:
+            tstamps = to_str_round({x: (y - start[i]) * 1e3 for x, y in res["ts"]}, 2)
+            print(f"idx: {i} ts: {tstamps} e2e latency: {e2e_latency*1e3:.2f} ms")
+
+    async def submit_workload_one_loop(self, workload: Workload):
+        num_requests = len(workload)
+        start = np.asarray(workload.arrivals, dtype=np.float64).copy()
+        finish = np.zeros(num_requests, dtype=np.float64)
+        send = np.zeros(num_requests, dtype=np.float64)
+        good = np.zeros(num_requests, dtype=bool)
+        model_ids, slos, model_names = workload.get_columns()
+        slos = slos.tolist()
+        dispatch = np.zeros(num_requests, dtype=np.float64)
+        pool = (HTTPConnectionPool(self.url, self.max_idle_connections)
+                if self.url is not None else None)
+
+        tasks, errors = set(), []
+
+        def on_done(task):
+            tasks.discard(task)
+            if task.exception() is not None:
+                errors.append(task.exception())
+
+        i = 0
+        while i < num_requests:
+            delay = start[i] - time.time()
+            if delay > 0:
+                # Sleep until the arrival. The timer error shows up in the
+                # recorded lateness.
+                await asyncio.sleep(delay)
+                continue
+
+            # Dispatch all the requests that have arrived
+            now = time.time()
+            while i < num_requests and start[i] <= now:
+                dispatch[i] = now
+                task = asyncio.create_task(self.submit_one(
+                    pool, i, model_names[model_ids[i]], slos[i], start, finish, send,
+                    good))
+                tasks.add(task)
+                task.add_done_callback(on_done)
+                i += 1
+
+        if tasks:
+            await asyncio.wait(tasks)
+        if pool is not None:
+            pool.close()
+        if errors:
+            raise errors[0]
+        return start, finish, good, dispatch - start, send - dispatch
+
+    @staticmethod
+    def shard_worker(arg):
+        url, relax_slo, debug, max_idle_connections, workload = arg
+        client = AsyncioClient(url, relax_slo, debug, max_idle_connections)
+        return asyncio.run(client.submit_workload_one_loop(workload))
+
+    async def submit_workload(self, workload: Workload):
+        if self.executor is None:
+            res = await self.submit_workload_one_loop(workload)
+        else:
+            ws = workload.split_round_robin(self.num_shards)
+            args = [(self.url, self.relax_slo, self.debug,
+                     self.max_idle_connections // self.num_shards, w) for w in ws]
+            results = list(self.executor.map(AsyncioClient.shard_worker, args))
+            res = [np.zeros(len(workload), dtype=x.dtype) for x in results[0]]
+            for i, shard_res in enumerate(results):
+                for x, y in zip(res, shard_res):
+                    x[i::self.num_shards] = y
+
+        start, finish, good, lateness, send_delay = res
+        self.res_dict[workload] = (start, finish, good)
+        self.lateness_dict[workload] = (lateness, send_delay)
+
+    def compute_stats(self, workload: Workload, warmup: float):
+        start, finish, good = self.res_dict[workload]
+        return workload.compute_stats(start, finish, good, warmup)
+
+    def print_lateness(self, workload: Workload):
+        lateness, send_delay = self.lateness_dict[workload]
+        if len(lateness):
+            print(f"client timer lateness: mean {np.mean(lateness)*1e3:.3f} ms, "
+                  f"p99 {np.percentile(lateness, 99)*1e3:.3f} ms, "
+                  f"max {np.max(lateness)*1e3:.3f} ms")
+            print(f"client send delay: mean {np.mean(send_delay)*1e3:.3f} ms, "
+                  f"p99 {np.percentile(send_delay, 99)*1e3:.3f} ms, "
+                  f"max {np.max(send_delay)*1e3:.3f} ms")
+
+    def __del__(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.executor = self.res_dict = self.lateness_dict = None
+
+
 def run_one_case(case: ServingCase, warmup=DEFAULT_WARMUP,
                  relax_slo=False, debug=False,
-                 protocol="http", port=20001):
+                 protocol="http", port=20001,
+                 client_type="asyncio", num_shards=1,
+                 enable_batching=False, max_batch_wait=0.01):
     register_models, generate_workload, place_models = case
 
     # Launch the controller
     if not ray.is_initialized():
         ray.init(address="auto", namespace="alpa_serve")
-    controller = run_controller("localhost", port=port)
+    controller = run_controller("localhost", port=port,
+                                enable_batching=enable_batching,
+                                max_batch_wait=max_batch_wait)
     register_models(controller)
     placement = place_models(controller)
     controller.warmup.remote()
@@ -217,14 +461,19 @@ def run_one_case(case: ServingCase, warmup=DEFAULT_WARMUP,
     # Launch the client
     workload = generate_workload(start=time.time() + 5)
     url = f"http://localhost:{port}" if protocol == "http" else None
-    slo = np.mean([r.slo for r in workload.requests[0:10]])
-    if slo < 0.4:
-        client = ProcessPoolClient(url, relax_slo, debug)
+    if client_type == "asyncio":
+        client = AsyncioClient(url, relax_slo, debug, num_shards=num_shards)
     else:
-        client = ThreadClient(url, relax_slo, debug)
+        slo = np.mean([r.slo for r in workload.requests[0:10]])
+        if slo < 0.4:
+            client = ProcessPoolClient(url, relax_slo, debug)
+        else:
+            client = ThreadClient(url, relax_slo, debug)
 
     # Run workloads
     stats = asyncio.run(run_workload(client, workload, warmup))
+    if client_type == "asyncio":
+        client.print_lateness(workload)
     ray.get(controller.shutdown.remote())
     del controller, client
     return stats, placement
@@ -238,9 +487,16 @@ if __name__ == "__main__":
     parser.add_argument("--relax-slo", action="store_true")
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--protocol", choices=["http", "ray"], default="http")
+    parser.add_argument("--client", choices=["asyncio", "legacy"], default="asyncio")
+    parser.add_argument("--num-client-shards", type=int, default=1)
+    parser.add_argument("--enable-batching", action="store_true")
+    parser.add_argument("--max-batch-wait", type=float, default=0.01)
     args = parser.parse_args()
 
     stats, placement = run_one_case(
         suite_debug[args.case], relax_slo=args.relax_slo, debug=args.debug,
-        protocol=args.protocol)
+        protocol=args.protocol, client_type=args.client,
+        num_shards=args.num_client_shards,
+        enable_batching=args.enable_batching,
+        max_batch_wait=args.max_batch_wait)
     Workload.print_stats(stats)
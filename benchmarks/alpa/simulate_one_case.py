@@ -12,11 +12,13 @@ if __name__ == "__main__":
     parser.add_argument("--case", type=str, default="debug_replicate")
     parser.add_argument("--debug", action="store_true")
     parser.add_argument("--bench-speed", action="store_true")
+    parser.add_argument("--engine", choices=["asyncio", "heap"], default="asyncio")
     args = parser.parse_args()
 
     print("simulate_one_case")
     tic = time.time()
-    stats, placement = simulate_one_case(suite_debug[args.case], debug=args.debug)
+    stats, placement = simulate_one_case(suite_debug[args.case], debug=args.debug,
+                                         engine=args.engine)
     print(f"time: {time.time() - tic:.4f}")
     Workload.print_stats(stats)
     print("")
@@ -13,7 +13,7 @@ def build_logger():
     return logger
 
 
-def get_model_def(name, is_simulator, prof_database):
+def get_model_def(name, is_simulator, prof_database, max_batch_size=1):
     result = prof_database.get(name)
     if result is None:
         raise ValueError(f"Invalid model name: {name}")
@@ -22,12 +22,13 @@ def get_model_def(name, is_simulator, prof_database):
         return partial(Executable, result)
     else:
         if name == "bert-1.3b":
-            return partial(BertModel, bert_specs["1.3B"], result)
+            spec = bert_specs["1.3B"]
         elif name == "bert-2.6b":
-            return partial(BertModel, bert_specs["2.6B"], result)
+            spec = bert_specs["2.6B"]
         elif name == "bert-6.7b":
-            return partial(BertModel, bert_specs["6.7B"], result)
+            spec = bert_specs["6.7B"]
         elif name == "bert-103.5b":
-            return partial(BertModel, bert_specs["103.5B"], result)
+            spec = bert_specs["103.5B"]
         else:
             raise ValueError(f"Invalid model name: {name}")
+        return partial(BertModel, spec, result, max_batch_size=max_batch_size)
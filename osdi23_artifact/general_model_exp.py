@@ -34,8 +34,19 @@ if __name__ == "__main__":
     parser.add_argument("--ablation", action="store_true")
     parser.add_argument("--large-models", action="store_true")
 
+    parser.add_argument("--evaluator-cache-dir", type=str,
+                        help="Persist the scores of simulated placements to reuse "
+                             "them across runs.")
+    parser.add_argument("--trace-cache-dir", type=str,
+                        help="Persist the fitted arrival distributions of the trace "
+                             "replays to reuse them across runs.")
     args = parser.parse_args()
 
+    if args.evaluator_cache_dir:
+        os.environ["ALPA_SERVE_EVALUATOR_CACHE_DIR"] = args.evaluator_cache_dir
+    if args.trace_cache_dir:
+        os.environ["ALPA_SERVE_TRACE_CACHE_DIR"] = args.trace_cache_dir
+
     # choices: {"sr-greedy", "sr-ilp", "mp-ilp",
     #           "mp-round-robin", "mp-greedy-2", "mp-greedy-8", "mp-search", "mp-search-sep"}
     if args.policy:
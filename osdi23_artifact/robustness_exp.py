@@ -28,8 +28,19 @@ if __name__ == "__main__":
                         choices=["synthetic", "azure_v1", "azure_v2"])
     parser.add_argument('--duration', type=float, default=200)
 
+    parser.add_argument("--evaluator-cache-dir", type=str,
+                        help="Persist the scores of simulated placements to reuse "
+                             "them across runs.")
+    parser.add_argument("--trace-cache-dir", type=str,
+                        help="Persist the fitted arrival distributions of the trace "
+                             "replays to reuse them across runs.")
     args = parser.parse_args()
 
+    if args.evaluator_cache_dir:
+        os.environ["ALPA_SERVE_EVALUATOR_CACHE_DIR"] = args.evaluator_cache_dir
+    if args.trace_cache_dir:
+        os.environ["ALPA_SERVE_TRACE_CACHE_DIR"] = args.trace_cache_dir
+
     model_type = args.model_type
     mem_budget = args.mem_budget * GB
 
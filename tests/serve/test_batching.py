@@ -0,0 +1,166 @@
+"""Test the dynamic batcher of the group manager with stub models."""
+import asyncio
+import time
+import unittest
+
+from alpa_serve.controller import DummyRequest, DynamicBatcher
+from alpa_serve.http_util import RelayException
+from alpa_serve.util import batchsize_config
+
+
+class StubModel:
+    """A model that sleeps for its profiled latency instead of using a GPU."""
+
+    def __init__(self, single_latency=0.02, pp=1, slowdown=1.0):
+        self.latency_dict = {bs: [single_latency / pp * bs ** 0.5] * pp
+                             for bs in batchsize_config}
+        self.slowdown = slowdown
+        self.batch_sizes = []
+
+    async def handle_batch(self, requests):
+        self.batch_sizes.append(len(requests))
+        await asyncio.sleep(sum(self.latency_dict[len(requests)]) * self.slowdown)
+        return [(await request.json())["idx"] for request in requests]
+
+    def get_latency_dict(self):
+        return self.latency_dict
+
+
+def make_batcher(model, max_wait=0.01, pp=1, adjust_latency_prediction=None):
+    return DynamicBatcher("stub", model, model.get_latency_dict(),
+                          [0.0] * pp, {}, max_wait=max_wait,
+                          adjust_latency_prediction=adjust_latency_prediction)
+
+
+async def submit_burst(batcher, num_requests, slo):
+    submit_time = time.time()
+    return await asyncio.gather(*[
+        batcher.submit(DummyRequest({"idx": i}), submit_time, slo)
+        for i in range(num_requests)])
+
+
+class DynamicBatchingTest(unittest.TestCase):
+
+    def test_burst(self):
+        model = StubModel()
+        batcher = make_batcher(model)
+        rets = asyncio.run(submit_burst(batcher, 40, None))
+
+        # Every request gets its own result from one of a few batches
+        assert rets == list(range(40))
+        assert all(bs in batchsize_config for bs in model.batch_sizes)
+        assert len(model.batch_sizes) < 40
+        assert max(model.batch_sizes) == batchsize_config[-1]
+        stats = batcher.get_stats()
+        assert stats["num_rejected"] == 0
+        assert stats["mean_batch_size"] > 1
+
+    def test_slo(self):
+        model = StubModel(pp=2)
+        latency_dict = model.get_latency_dict()
+
+        # Only batches of size <= 4 meet the deadline
+        slo = sum(latency_dict[4]) + 0.02
+        assert sum(latency_dict[8]) + 0.005 > slo
+        batcher = make_batcher(model, pp=2)
+        rets = asyncio.run(submit_burst(batcher, 16, slo))
+        assert max(model.batch_sizes) <= 4
+        served = [ret for ret in rets if not isinstance(ret, dict)]
+        rejected = [ret for ret in rets if isinstance(ret, dict)]
+        assert served and served == sorted(served)
+        assert all(ret["rejected"] for ret in rejected)
+        assert batcher.get_stats()["num_rejected"] == len(rejected)
+
+        # A deadline that even a single request misses is rejected
+        model = StubModel()
+        batcher = make_batcher(model)
+        rets = asyncio.run(submit_burst(batcher, 4, 0.001))
+        assert all(ret["rejected"] for ret in rets)
+        assert not model.batch_sizes
+
+    def test_idle_dispatch(self):
+        model = StubModel()
+        batcher = make_batcher(model, max_wait=0.05)
+
+        async def run():
+            rets = []
+            for i in range(4):
+                tic = time.time()
+                rets.append(await batcher.submit(DummyRequest({"idx": i}), tic, 1.0))
+                # A lone request does not wait longer than max_wait
+                assert time.time() - tic < 0.05 + sum(model.latency_dict[1]) + 0.05
+            return rets
+
+        assert asyncio.run(run()) == list(range(4))
+        assert model.batch_sizes == [1] * 4
+
+    def test_latency_feedback(self):
+        calls = []
+
+        def adjust_latency_prediction(*args):
+            calls.append((time.time(),) + args)
+
+        # The model runs 3x slower than profiled, so the batch misses its
+        # deadline and the prediction is corrected
+        model = StubModel(pp=2, slowdown=3)
+        batcher = make_batcher(model, pp=2,
+                               adjust_latency_prediction=adjust_latency_prediction)
+        slo = sum(model.latency_dict[1]) * 2
+        assert asyncio.run(submit_burst(batcher, 1, slo)) == [0]
+        assert len(calls) == 1
+        now, start_time, ret_time, deadline, num_stages = calls[0]
+        assert start_time < ret_time <= deadline < now
+        assert num_stages == 2
+
+        # Requests without a deadline do not correct the prediction
+        batcher = make_batcher(model, pp=2,
+                               adjust_latency_prediction=adjust_latency_prediction)
+        assert asyncio.run(submit_burst(batcher, 4, None)) == list(range(4))
+        assert len(calls) == 1
+
+    def test_failures(self):
+        # A replica that returns fewer results than requests fails the batch
+        class ShortModel(StubModel):
+            async def handle_batch(self, requests):
+                return (await super().handle_batch(requests))[:-1]
+
+        batcher = make_batcher(ShortModel())
+        rets = asyncio.run(submit_burst(batcher, 4, None))
+        assert all(isinstance(ret, RelayException) for ret in rets)
+
+        # If the batching loop dies, the queued requests fail instead of
+        # hanging and the next request starts a new loop
+        model = StubModel()
+        batcher = make_batcher(model)
+
+        def broken_dispatch():
+            raise RuntimeError("broken dispatch")
+
+        async def run():
+            batcher.dispatch = broken_dispatch
+            try:
+                await asyncio.wait_for(submit_burst(batcher, 4, None), 5)
+                assert False, "The requests should fail"
+            except RuntimeError as e:
+                assert "broken dispatch" in str(e)
+            assert batcher.task is None
+
+            del batcher.dispatch
+            return await asyncio.wait_for(submit_burst(batcher, 4, None), 5)
+
+        assert asyncio.run(run()) == list(range(4))
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(DynamicBatchingTest("test_burst"))
+    suite.addTest(DynamicBatchingTest("test_slo"))
+    suite.addTest(DynamicBatchingTest("test_idle_dispatch"))
+    suite.addTest(DynamicBatchingTest("test_latency_feedback"))
+    suite.addTest(DynamicBatchingTest("test_failures"))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
@@ -0,0 +1,220 @@
+"""Test the ingress proxies on localhost with stub group managers."""
+import asyncio
+import json
+import multiprocessing
+import os
+import pickle
+import time
+import unittest
+
+import requests
+
+from alpa_serve.controller import IngressProxy, ModelInfo, CompactRequestView
+from alpa_serve.http_util import (CompactRequest, build_starlette_request,
+                                  new_port)
+from alpa_serve.simulator.util import install_remote_methods
+
+
+ROUTES = {"a": [0, 1, 2], "b": [1], "s": [2]}
+# The models registered with starlette_request=True
+STARLETTE_MODELS = {"s"}
+
+
+class StubGroupManager:
+    """A group manager that echoes the requests without any model."""
+
+    def __init__(self, group_id):
+        self.group_id = group_id
+        install_remote_methods(self)
+
+    async def handle_request(self, name, request):
+        if name == "f":
+            raise RuntimeError("The group manager failed")
+        if isinstance(request, bytes):
+            request = build_starlette_request(pickle.loads(request))
+            kind = "starlette"
+            body = await request.body()
+            try:
+                obj = json.loads(body)
+            except ValueError:
+                obj = {"body": body.decode()}
+        else:
+            assert isinstance(request, CompactRequest)
+            request = CompactRequestView(request)
+            kind = "compact"
+            obj = await request.json()
+        await asyncio.sleep(0.001)
+        return {"model": name, "idx": obj.get("idx"), "body": obj.get("body"),
+                "kind": kind, "group_id": self.group_id, "pid": os.getpid(),
+                "ts": request.scope["ts"]}
+
+
+def run_stub_proxy(proxy_id, port, ready_queue, stop_event, stats_queue):
+    async def main():
+        proxy = IngressProxy(proxy_id, "127.0.0.1", port, "/",
+                             dispatch_policy="indexed_heap")
+        group_managers = {g: StubGroupManager(g) for g in range(3)}
+        model_info = {name: ModelInfo(None, group_ids, 0,
+                                      name in STARLETTE_MODELS)
+                      for name, group_ids in ROUTES.items()}
+        stage_latency = {(name, g): [0.01] for name, group_ids in ROUTES.items()
+                         for g in group_ids}
+        proxy.update_routes(1, group_managers, model_info, stage_latency)
+        # A stale routing table is ignored
+        proxy.update_routes(0, {}, {}, {})
+        await proxy.ready()
+        ready_queue.put(proxy_id)
+
+        while not stop_event.is_set():
+            await asyncio.sleep(0.05)
+        stats_queue.put(proxy.get_stats())
+        await proxy.shutdown()
+
+    asyncio.run(main())
+
+
+def start_stub_proxies(num_proxies, port):
+    ctx = multiprocessing.get_context("spawn")
+    ready_queue, stats_queue = ctx.Queue(), ctx.Queue()
+    stop_event = ctx.Event()
+    procs = [ctx.Process(target=run_stub_proxy,
+                         args=(i, port, ready_queue, stop_event, stats_queue))
+             for i in range(num_proxies)]
+    for p in procs:
+        p.start()
+    for _ in range(num_proxies):
+        ready_queue.get(timeout=60)
+    return procs, stop_event, stats_queue
+
+
+def stop_stub_proxies(procs, stop_event, stats_queue):
+    stop_event.set()
+    stats = [stats_queue.get(timeout=60) for _ in procs]
+    for p in procs:
+        p.join(timeout=60)
+    return stats
+
+
+class IngressTest(unittest.TestCase):
+
+    def test_reuse_port_proxies(self):
+        num_proxies, num_requests = 3, 120
+        port = new_port()
+        procs, stop_event, stats_queue = start_stub_proxies(num_proxies, port)
+        try:
+            pids = set()
+            for i in range(num_requests):
+                name = "ab"[i % 2]
+                # A new connection for each request lets the kernel balance them
+                ret = requests.post(f"http://127.0.0.1:{port}/",
+                                    json={"model": name, "idx": i},
+                                    headers={"Connection": "close"}).json()
+                assert ret["model"] == name and ret["idx"] == i
+                assert ret["kind"] == "compact"
+                assert ret["group_id"] in ROUTES[name]
+                pids.add(ret["pid"])
+
+            ret = requests.post(f"http://127.0.0.1:{port}/",
+                                json={"model": "c", "idx": 0})
+            assert ret.status_code == 400
+        finally:
+            stats = stop_stub_proxies(procs, stop_event, stats_queue)
+
+        # The proxies share the port and each reports its own QPS
+        assert len(pids) > 1
+        assert sorted(x["proxy_id"] for x in stats) == list(range(num_proxies))
+        assert sum(x["num_requests"] for x in stats) == num_requests + 1
+        assert all(x["routes_version"] == 1 for x in stats)
+        assert all(x["qps"] >= 0 for x in stats)
+
+    def test_starlette_request(self):
+        port = new_port()
+        url = f"http://127.0.0.1:{port}/"
+        procs, stop_event, stats_queue = start_stub_proxies(1, port)
+        try:
+            # A model registered with starlette_request=True receives the
+            # pickled HTTPRequestWrapper
+            ret = requests.post(url, json={"model": "s", "idx": 7}).json()
+            assert ret["kind"] == "starlette"
+            assert ret["model"] == "s" and ret["idx"] == 7
+            assert ret["group_id"] == 2
+
+            # A non-JSON body takes the Starlette path even for other models
+            ret = requests.post(url, params={"model": "a"},
+                                data=b"raw input").json()
+            assert ret["kind"] == "starlette"
+            assert ret["model"] == "a" and ret["body"] == "raw input"
+
+            # Without the model name in the query, a non-JSON body is invalid
+            ret = requests.post(url, data=b"raw input")
+            assert ret.status_code == 400
+
+            # JSON bodies of other models take the compact path
+            ret = requests.post(url, json={"model": "a", "idx": 8}).json()
+            assert ret["kind"] == "compact" and ret["idx"] == 8
+        finally:
+            stop_stub_proxies(procs, stop_event, stats_queue)
+
+    def test_failed_group_manager(self):
+        async def run():
+            proxy = IngressProxy(0, "127.0.0.1", new_port(), "/",
+                                 dispatch_policy="indexed_heap")
+            manager = StubGroupManager(0)
+            proxy.update_routes(1, {0: manager}, {"f": ModelInfo(None, [0], 0)},
+                                {("f", 0): [0.01]})
+            await proxy.ready()
+
+            body = json.dumps({"model": "f", "idx": 0}).encode()
+            scope = {"type": "http", "query_string": b"", "headers": []}
+            messages = []
+
+            async def receive():
+                return {"type": "http.request", "body": body, "more_body": False}
+
+            async def send(message):
+                messages.append(message)
+
+            await proxy.handle_asgi(scope, receive, send)
+            await proxy.shutdown()
+            return proxy, messages
+
+        proxy, messages = asyncio.run(run())
+        assert messages[0]["status"] == 400
+        # The group is released although the group manager failed
+        assert proxy.group_info[0].queue_size == 0
+        assert proxy.dispatch_policy.queue_size[0] == 0
+        assert proxy.dispatch_policy.free_time[0] <= time.time()
+
+    def test_compact_request(self):
+        manager = StubGroupManager(0)
+        submit_time = time.time()
+        messages = []
+        for i in range(8):
+            body = json.dumps({"model": "a", "submit_time": submit_time,
+                               "slo": 1.0, "idx": i, "input": "Test"}).encode()
+            # The messages are pickled on the way to the group manager
+            messages.append(pickle.loads(pickle.dumps(CompactRequest(
+                "a", submit_time, 1.0, i, body, [("a", submit_time)]))))
+
+        async def run():
+            return await asyncio.gather(*[
+                manager.handle_request.remote("a", m) for m in messages])
+
+        rets = asyncio.run(run())
+        assert [ret["idx"] for ret in rets] == list(range(8))
+        assert all(ret["kind"] == "compact" for ret in rets)
+        assert all(ret["ts"] == [("a", submit_time)] for ret in rets)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(IngressTest("test_reuse_port_proxies"))
+    suite.addTest(IngressTest("test_starlette_request"))
+    suite.addTest(IngressTest("test_failed_group_manager"))
+    suite.addTest(IngressTest("test_compact_request"))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())
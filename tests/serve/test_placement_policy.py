@@ -1,5 +1,9 @@
 """Test placement policy"""
+import os
+import tempfile
+import time
 import unittest
+from unittest import mock
 
 import numpy as np
 
@@ -7,8 +11,12 @@ from alpa_serve.simulator.controller import Controller
 from alpa_serve.placement_policy import (ModelData, ClusterEnv,
     SelectiveReplicationGreedy, SelectiveReplicationSearch,
     ModelParallelismGreedy, ModelParallelismSearch)
+from alpa_serve.placement_policy.base_policy import (ModelPlacement,
+    PlacementEvaluator, EvaluatorPool, MultiFidelityEvaluator, gen_train_workload,
+    SearchCheckpoint, SurrogateModel, replica_placement_fast_greedy,
+    replica_placement_beam_search, evolutionary_search)
 from alpa_serve.profiling import ParallelConfig, load_test_prof_result
-from alpa.util import GB
+from alpa_serve.util import GB
 
 
 class EchoModel:
@@ -68,7 +76,11 @@ class PlacementPolicyTest(unittest.TestCase):
             ModelData("m3", 0.4, 4, 8, load_test_prof_result("test-2GB-100ms")),
         ]
 
-        for policy in [ModelParallelismSearch(verbose=2)]:
+        for policy in [ModelParallelismSearch(verbose=2),
+                       ModelParallelismSearch(parallel_evaluator=True,
+                                              parallel_initial_placement=True,
+                                              parallel_backend="process",
+                                              num_workers=2)]:
             placement, _ = policy.solve_placement(
                 model_datas, cluster_env)
 
@@ -93,6 +105,344 @@ class PlacementPolicyTest(unittest.TestCase):
             ]
             policy.place_models(controller, cluster_env, model_datas)
 
+    def test_batched_evaluator(self):
+        cluster_env = ClusterEnv(num_devices=8, mem_budget=6*GB)
+        model_datas = [
+            ModelData(f"m{i}", 0.5, 3 + i, 4, load_test_prof_result("alpa/bert-1.3b"))
+            for i in range(8)
+        ]
+        workload = gen_train_workload(model_datas)
+
+        rs = np.random.RandomState(0)
+        sols = []
+        for _ in range(64):
+            pp = int(rs.choice([1, 2, 4]))
+            num_groups = 8 // pp
+            group_models = [list(rs.choice(8, rs.randint(0, 5), replace=False))
+                            for _ in range(num_groups)]
+            sols.append(ModelPlacement([ParallelConfig(1, 1, pp)] * num_groups,
+                                       group_models))
+
+        evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                       "fast_simulator", False, cache_size=0)
+        assert evaluator.batched
+        scores = evaluator.get_scores(sols)
+        stats = evaluator.get_stats(sols)
+
+        evaluator.batched = False
+        ref_scores = evaluator.get_scores(sols)
+        ref_stats = evaluator.get_stats(sols)
+
+        np.testing.assert_allclose(scores, ref_scores, rtol=0, atol=1e-12)
+        for x, y in zip(stats, ref_stats):
+            assert abs(x[0] - y[0]) < 1e-12
+            np.testing.assert_allclose(x[1], y[1])
+            assert x[2] == y[2]
+
+    def test_incremental_evaluator(self):
+        cluster_env = ClusterEnv(num_devices=8, mem_budget=6*GB)
+        model_datas = [
+            ModelData(f"m{i}", 0.5, 3 + i, 4, load_test_prof_result("alpa/bert-1.3b"))
+            for i in range(8)
+        ]
+        workload = gen_train_workload(model_datas)
+
+        rs = np.random.RandomState(0)
+        sols = []
+        for _ in range(32):
+            pp = int(rs.choice([1, 2, 4]))
+            num_groups = 8 // pp
+            group_models = [list(rs.choice(8, rs.randint(0, 4), replace=False))
+                            for _ in range(num_groups)]
+            sols.append(ModelPlacement([ParallelConfig(1, 1, pp)] * num_groups,
+                                       group_models))
+
+        evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                       "fast_simulator", False, cache_size=0)
+        stats = evaluator.get_stats_incremental(sols)
+        ref_stats = evaluator.get_stats(sols)
+        for x, y in zip(stats, ref_stats):
+            assert x[0] == y[0]
+            assert x[1] == y[1]
+            assert x[2] == y[2]
+            assert abs(x[3].latency_mean - y[3].latency_mean) < 1e-9
+
+        # The greedy placement is the same with and without the delta evaluation
+        init_sol = ModelPlacement([ParallelConfig(1, 1, 1)] * 8, [[] for _ in range(8)])
+        evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                       "fast_simulator", False, cache_size=0)
+        sol = replica_placement_fast_greedy(init_sol, model_datas, cluster_env,
+                                            workload, evaluator, 0)
+        ref_sol = replica_placement_fast_greedy(init_sol, model_datas, cluster_env,
+                                                workload, evaluator, 0, incremental=False)
+        assert sol == ref_sol
+        info = evaluator.delta_info()
+        assert info["component_hits"] > 0
+        assert info["saved_simulations"] > 0
+
+    def test_multi_fidelity_evaluator(self):
+        cluster_env = ClusterEnv(num_devices=8, mem_budget=6*GB)
+        model_datas = [
+            ModelData(f"m{i}", 0.5, 3 + i, 4, load_test_prof_result("alpa/bert-1.3b"))
+            for i in range(8)
+        ]
+        workload = gen_train_workload(model_datas)
+
+        rs = np.random.RandomState(0)
+        sols = []
+        for _ in range(64):
+            group_models = [list(rs.choice(8, rs.randint(0, 4), replace=False))
+                            for _ in range(4)]
+            sols.append(ModelPlacement([ParallelConfig(1, 1, 2)] * 4, group_models))
+
+        evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                       "fast_simulator", False, cache_size=0)
+        mf_evaluator = MultiFidelityEvaluator(model_datas, cluster_env, workload,
+            evaluator, fidelities=(0.1, 0.3), promote_ratio=0.5, min_promoted=4)
+        scores = mf_evaluator.get_scores(sols)
+        ref_scores = evaluator.get_scores(sols)
+        info = mf_evaluator.fidelity_info()
+        assert info["num_evaluated"] == [64, 32, 16]
+        assert all(x is not None and -1 <= x <= 1 for x in info["rank_correlation"])
+
+        # The promoted candidates have the full-fidelity scores and rank first
+        top = np.argsort(scores)[::-1][:16]
+        np.testing.assert_allclose(np.array(scores)[top], np.array(ref_scores)[top])
+        goodputs = [x[0] for x in mf_evaluator.get_stats(sols)]
+        ref_goodputs = [x[0] for x in evaluator.get_stats(sols)]
+        top = np.argsort(goodputs)[::-1][:16]
+        np.testing.assert_allclose(np.array(goodputs)[top], np.array(ref_goodputs)[top])
+        assert mf_evaluator.fidelity_info()["num_evaluated"] == [128, 64, 32]
+
+        # Search with the multi-fidelity evaluator
+        init_sol = ModelPlacement([ParallelConfig(1, 1, 2)] * 4, [[] for _ in range(4)])
+        sol = replica_placement_beam_search(init_sol, model_datas, cluster_env,
+                                            workload, mf_evaluator, 2, 0)
+        sol.verify(model_datas, cluster_env)
+        mf_evaluator.close()
+
+    def test_bound_pruning(self):
+        cluster_env = ClusterEnv(num_devices=8, mem_budget=6*GB)
+        model_datas = [
+            ModelData(f"m{i}", 0.5, 1 + i, 4, load_test_prof_result("alpa/bert-1.3b"))
+            for i in range(8)
+        ]
+        workload = gen_train_workload(model_datas)
+
+        rs = np.random.RandomState(0)
+        sols = [ModelPlacement([ParallelConfig(1, 1, 1)] * 8,
+                               [list(rs.choice(8, rs.randint(0, 3), replace=False))
+                                for _ in range(8)])
+                for _ in range(64)]
+        evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                       "fast_simulator", False, cache_size=0)
+        scores = evaluator.get_scores(sols)
+        bounds = evaluator.get_score_upper_bounds(sols)
+        assert all(x >= y for x, y in zip(bounds, scores))
+
+        # The bounds of simulated components are exact
+        evaluator.get_stats_incremental(sols)
+        np.testing.assert_allclose(evaluator.get_score_upper_bounds(sols), scores,
+                                   rtol=0, atol=1e-12)
+
+        # Pruning does not change the result of the beam search
+        init_sol = ModelPlacement([ParallelConfig(1, 1, 1)] * 8, [[] for _ in range(8)])
+        sols = []
+        for prune in [False, True]:
+            evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                           "fast_simulator", False, cache_size=0)
+            sols.append(replica_placement_beam_search(init_sol, model_datas, cluster_env,
+                workload, evaluator, 3, 0, prune=prune))
+        assert sols[0].normalize() == sols[1].normalize()
+        info = evaluator.prune_info()
+        assert info["pruned"] > 0 and info["simulated"] > 0
+
+    def test_surrogate_model(self):
+        cluster_env = ClusterEnv(num_devices=8, mem_budget=6*GB)
+        model_datas = [
+            ModelData(f"m{i}", 0.5, 1 + i, 4, load_test_prof_result("alpa/bert-1.3b"))
+            for i in range(8)
+        ]
+        workload = gen_train_workload(model_datas)
+        evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                       "fast_simulator", False, cache_size=0)
+
+        rs = np.random.RandomState(0)
+        sols = [ModelPlacement([ParallelConfig(1, 1, 1)] * 8,
+                               [list(rs.choice(8, rs.randint(0, 3), replace=False))
+                                for _ in range(8)])
+                for _ in range(512)]
+        scores = [x[0] for x in evaluator.get_stats(sols)]
+
+        surrogate = SurrogateModel(model_datas, cluster_env, min_samples=256)
+        assert surrogate.select(sols) == sols
+        surrogate.update(sols[:256], scores[:256])
+        surrogate.update(sols[256:], scores[256:])
+        info = surrogate.error_info()
+        assert info["num_samples"] == 512 and info["num_predictions"] == 256
+        assert info["rank_correlation"] > 0.5
+        assert len(surrogate.select(sols)) == 128
+
+        # Only the top predicted children are simulated
+        init_sol = ModelPlacement([ParallelConfig(1, 1, 1)] * 8, [[i] for i in range(8)])
+        surrogate = SurrogateModel(model_datas, cluster_env)
+        np.random.seed(0)
+        sol = evolutionary_search([init_sol], model_datas, cluster_env, evaluator,
+                                  3, 0, surrogate=surrogate)
+        sol.verify(model_datas, cluster_env)
+        assert surrogate.error_info()["num_samples"] == 1 + 1025 + 257
+
+        # The trained surrogate is saved in the checkpoint
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "evo.pkl")
+            surrogate = SurrogateModel(model_datas, cluster_env)
+            np.random.seed(0)
+            evolutionary_search([init_sol], model_datas, cluster_env, evaluator,
+                                2, 0, checkpoint=SearchCheckpoint(path, "key"),
+                                surrogate=surrogate)
+            resumed = SurrogateModel(model_datas, cluster_env)
+            with mock.patch.object(evaluator, "get_stats", side_effect=AssertionError):
+                evolutionary_search([init_sol], model_datas, cluster_env, evaluator,
+                                    2, 0, checkpoint=SearchCheckpoint(path, "key"),
+                                    surrogate=resumed)
+            assert resumed.is_ready()
+            np.testing.assert_array_equal(resumed.weights, surrogate.weights)
+            assert resumed.error_info() == surrogate.error_info()
+
+    def test_search_budget_and_checkpoint(self):
+        cluster_env = ClusterEnv(num_devices=4, mem_budget=4.5*GB)
+        model_datas = [
+            ModelData(f"m{i}", 1, 5, 1, load_test_prof_result("test-2GB-100ms"))
+            for i in range(4)
+        ]
+        workload = gen_train_workload(model_datas)
+
+        # A zero budget still returns a valid placement
+        tic = time.time()
+        policy = ModelParallelismGreedy(use_evo_search=True, time_budget=0)
+        sol, _ = policy.solve_placement(model_datas, cluster_env, workload)
+        sol.verify(model_datas, cluster_env)
+        assert time.time() - tic < 30
+
+        init_sol = ModelPlacement([ParallelConfig(1, 1, 1)] * 4, [[0], [1], [2], [3]])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "evo.pkl")
+            evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                                           "fast_simulator", False)
+            np.random.seed(0)
+            sol = evolutionary_search([init_sol], model_datas, cluster_env, evaluator,
+                                      2, 0, checkpoint=SearchCheckpoint(path, "key"))
+
+            # Resuming a finished search does not evaluate anything
+            with mock.patch.object(evaluator, "get_stats", side_effect=AssertionError):
+                res = evolutionary_search([init_sol], model_datas, cluster_env,
+                                          evaluator, 2, 0,
+                                          checkpoint=SearchCheckpoint(path, "key"))
+            assert res == sol
+
+            # A checkpoint with a different key is ignored
+            assert SearchCheckpoint(path, "other").load() is None
+            assert SearchCheckpoint(path, "key").load()["it"] == 2
+
+            # Resume the beam search
+            path = os.path.join(tmp_dir, "beam.pkl")
+            init_sol = ModelPlacement([ParallelConfig(1, 1, 1)] * 4, [[] for _ in range(4)])
+            sol = replica_placement_beam_search(init_sol, model_datas, cluster_env, workload,
+                evaluator, 2, 0, checkpoint=SearchCheckpoint(path, "key"))
+            with mock.patch.object(evaluator, "get_scores", side_effect=AssertionError):
+                res = replica_placement_beam_search(init_sol, model_datas, cluster_env,
+                    workload, evaluator, 2, 0, checkpoint=SearchCheckpoint(path, "key"))
+            assert res == sol
+
+    def test_evaluator_cache(self):
+        cluster_env = ClusterEnv(num_devices=4, mem_budget=4*GB)
+        model_datas = [
+            ModelData(f"m{i}", 0.5, 4, 4, load_test_prof_result("alpa/bert-1.3b"))
+            for i in range(4)
+        ]
+        workload = gen_train_workload(model_datas)
+        sols = [
+            ModelPlacement([ParallelConfig(1, 1, 2)] * 2, [[0, 1], [2]]),
+            ModelPlacement([ParallelConfig(1, 1, 2)] * 2, [[2], [1, 0]]),
+            ModelPlacement([ParallelConfig(1, 1, 1)] * 4, [[0], [1], [2], [3]]),
+        ]
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                "fast_simulator", False, cache_dir=cache_dir)
+            scores = evaluator.get_scores(sols)
+            assert scores[0] == scores[1]
+            assert evaluator.cache_info()["misses"] == 2
+            assert evaluator.cache_info()["hits"] == 1
+
+            # Per-group stats follow the group order of the inputs
+            stats = evaluator.get_stats(sols[:2])
+            assert stats[0][2] == stats[1][2][::-1]
+            assert stats[1][3].group_num_requests == stats[1][2]
+            assert evaluator.get_scores(sols) == scores
+            assert evaluator.cache_info()["hits"] == 5
+            evaluator.save_cache()
+
+            # Load the persisted cache
+            evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                "fast_simulator", False, cache_dir=cache_dir)
+            assert evaluator.get_scores(sols) == scores
+            assert evaluator.cache_info()["misses"] == 0
+
+            # A different workload does not hit the cache
+            workload = gen_train_workload(model_datas, seed=1)
+            evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+                "fast_simulator", False, cache_dir=cache_dir)
+            evaluator.get_scores(sols)
+            assert evaluator.cache_info()["hits"] == 1
+
+    def test_process_evaluator(self):
+        cluster_env = ClusterEnv(num_devices=4, mem_budget=4*GB)
+        model_datas = [
+            ModelData(f"m{i}", 0.5, 4, 4, load_test_prof_result("alpa/bert-1.3b"))
+            for i in range(4)
+        ]
+        workload = gen_train_workload(model_datas)
+        sols = [
+            ModelPlacement([ParallelConfig(1, 1, 2)] * 2, [[0, 1], [2, 3]]),
+            ModelPlacement([ParallelConfig(1, 1, 4)], [[0, 1, 2, 3]]),
+            ModelPlacement([ParallelConfig(1, 1, 1)] * 4, [[0], [1], [2], [3]]),
+        ]
+
+        evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+            "fast_simulator", False, cache_size=0)
+        pool_evaluator = PlacementEvaluator(model_datas, cluster_env, workload,
+            "fast_simulator", True, cache_size=0, backend="process", num_workers=2)
+        try:
+            assert pool_evaluator.get_scores(sols) == evaluator.get_scores(sols)
+            for x, y in zip(pool_evaluator.get_stats(sols), evaluator.get_stats(sols)):
+                assert x[:3] == y[:3]
+        finally:
+            pool_evaluator.close()
+
+        # The evaluators of several problems on the same workload share a pool
+        sub_cluster_env = ClusterEnv(num_devices=2, mem_budget=4*GB)
+        sub_sols = [
+            ModelPlacement([ParallelConfig(1, 1, 2)], [[0, 1]]),
+            ModelPlacement([ParallelConfig(1, 1, 1)] * 2, [[0], [1]]),
+        ]
+        pool = EvaluatorPool(workload, num_workers=2)
+        try:
+            for datas, env, xs in [(model_datas, cluster_env, sols),
+                                   (model_datas[:2], sub_cluster_env, sub_sols),
+                                   (model_datas[2:], sub_cluster_env, sub_sols)]:
+                serial_evaluator = PlacementEvaluator(datas, env, workload,
+                    "fast_simulator", False, cache_size=0)
+                shared_evaluator = PlacementEvaluator(datas, env, workload,
+                    "fast_simulator", True, cache_size=0, backend="process",
+                    pool=pool)
+                assert shared_evaluator.get_scores(xs) == serial_evaluator.get_scores(xs)
+                # Closing an evaluator does not shut down a shared pool
+                shared_evaluator.close()
+                assert pool.pool is not None
+        finally:
+            pool.close()
+
 
 def suite():
     suite = unittest.TestSuite()
@@ -100,6 +450,14 @@ def suite():
     suite.addTest(PlacementPolicyTest("test_model_parallelism"))
     suite.addTest(PlacementPolicyTest("test_model_parallelism_search"))
     suite.addTest(PlacementPolicyTest("test_placement_api"))
+    suite.addTest(PlacementPolicyTest("test_batched_evaluator"))
+    suite.addTest(PlacementPolicyTest("test_incremental_evaluator"))
+    suite.addTest(PlacementPolicyTest("test_multi_fidelity_evaluator"))
+    suite.addTest(PlacementPolicyTest("test_search_budget_and_checkpoint"))
+    suite.addTest(PlacementPolicyTest("test_bound_pruning"))
+    suite.addTest(PlacementPolicyTest("test_surrogate_model"))
+    suite.addTest(PlacementPolicyTest("test_evaluator_cache"))
+    suite.addTest(PlacementPolicyTest("test_process_evaluator"))
     return suite
 
 
@@ -3,14 +3,21 @@ import asyncio
 from functools import partial
 import unittest
 
+import numpy as np
 import ray
 
 from alpa_serve.profiling import ParallelConfig, load_test_prof_result
 from alpa_serve.controller import run_controller
-from alpa_serve.simulator.controller import Controller, Client
+from alpa_serve.dispatch_policy import IndexedHeapPolicy, LeastQueuePolicy
+from alpa_serve.simulator.controller import (Controller, Client,
+    simulate_one_case, approximate_one_case, simulate_requests_mixed_batching,
+    simulate_requests_mixed_batching_python)
 from alpa_serve.simulator.event_loop import run_event_loop
 from alpa_serve.simulator.executable import Executable
-from alpa_serve.simulator.workload import Workload, Request, PoissonProcess
+from alpa_serve.simulator.workload import (Workload, Request, PoissonProcess,
+    GammaProcess, DeterministicProcess, UniformMMPP, ParetoProcess, StreamingStats,
+    generate_multi_model_workload)
+from alpa_serve.util import ServingCase
 
 
 class EchoModel:
@@ -67,11 +74,314 @@ class SimulatorTest(unittest.TestCase):
         stats = client.compute_stats(w, warmup=10)
         Workload.print_stats(stats)
 
+    def test_heap_engine(self):
+        def register_models(controller):
+            for name in ["a", "b"]:
+                controller.register_model.remote(
+                    name, partial(Executable, load_test_prof_result("test-2GB-100ms")))
+
+        def generate_workload(start=0):
+            w1 = PoissonProcess(8).generate_workload("a", start, 60, slo=0.3, seed=1)
+            w2 = PoissonProcess(8).generate_workload("b", start, 60, slo=0.3, seed=2)
+            return w1 + w2
+
+        def place_models(controller):
+            for group_id in range(2):
+                controller.create_mesh_group_manager.remote(group_id, [1, 2])
+                controller.create_replica.remote("a", group_id,
+                                                 [ParallelConfig(1, 1, 2)])
+                controller.create_replica.remote("b", group_id,
+                                                 [ParallelConfig(1, 1, 2)])
+
+        case = ServingCase(register_models, generate_workload, place_models)
+        results = []
+        for engine in ["asyncio", "heap"]:
+            np.random.seed(0)
+            stats, _ = simulate_one_case(case, engine=engine)
+            results.append(stats)
+
+        assert results[0].num_requests == results[1].num_requests
+        assert results[0].group_num_requests == results[1].group_num_requests
+        assert abs(results[0].goodput - results[1].goodput) < 1e-9
+        assert abs(results[0].latency_mean - results[1].latency_mean) < 1e-9
+
+    def test_dispatch_policy(self):
+        # The indexed heap matches a linear scan over the predicted completion time
+        rs = np.random.RandomState(0)
+        heap, scan = IndexedHeapPolicy(), LeastQueuePolicy()
+        groups = {"a": list(range(8)), "b": [0, 2, 4], "c": [5]}
+        for policy in [heap, scan]:
+            for group_id in range(8):
+                policy.add_group(group_id)
+            for name, group_ids in groups.items():
+                for group_id in group_ids:
+                    policy.add_replica(name, group_id, [0.05, 0.05 + 0.01 * group_id])
+        heap.remove_replica("b", 2)
+        scan.remove_replica("b", 2)
+
+        now, in_flight = 0.0, []
+        for _ in range(2000):
+            now += rs.exponential(0.01)
+            if in_flight and rs.rand() < 0.5:
+                name, group_id = in_flight.pop(rs.randint(len(in_flight)))
+                heap.on_complete(name, group_id, now)
+                scan.on_complete(name, group_id, now)
+                continue
+            name = ["a", "b", "c"][rs.randint(3)]
+            group_id = heap.select(name, scan.model_groups[name], now)
+            assert group_id == min(scan.model_groups[name],
+                                   key=lambda g: heap.heap_key(name, g))
+            heap.on_dispatch(name, group_id, now)
+            scan.on_dispatch(name, group_id, now)
+            in_flight.append((name, group_id))
+        assert heap.free_time == scan.free_time
+        assert heap.queue_size == scan.queue_size
+
+        # Only the offered groups are selected
+        for _ in range(20):
+            group_id = heap.select("a", [1, 3], now)
+            assert group_id == min([1, 3], key=lambda g: heap.heap_key("a", g))
+            heap.on_dispatch("a", group_id, now)
+        assert heap.select("d", [6, 7], now) in [6, 7]
+
+        # Evaluate the policies offline with the simulator
+        def register_models(controller):
+            for name in ["a", "b"]:
+                controller.register_model.remote(
+                    name, partial(Executable, load_test_prof_result("test-2GB-100ms")))
+
+        def generate_workload(start=0):
+            w1 = GammaProcess(30, 3).generate_workload("a", start, 60, slo=0.5, seed=1)
+            w2 = PoissonProcess(8).generate_workload("b", start, 60, slo=0.5, seed=2)
+            return w1 + w2
+
+        def place_models(controller):
+            for group_id in range(4):
+                controller.create_mesh_group_manager.remote(group_id, [1, 2])
+                controller.create_replica.remote("a", group_id,
+                                                 [ParallelConfig(1, 1, 2)])
+            for group_id in range(2):
+                controller.create_replica.remote("b", group_id,
+                                                 [ParallelConfig(1, 1, 2)])
+
+        case = ServingCase(register_models, generate_workload, place_models)
+        results = {}
+        for policy in ["least_queue", "indexed_heap", "power_of_two"]:
+            np.random.seed(0)
+            stats, _ = simulate_one_case(case, dispatch_policy=policy)
+            results[policy] = stats
+            assert all(x > 0 for x in stats.group_num_requests)
+        assert results["indexed_heap"].goodput >= results["least_queue"].goodput - 0.02
+
+    def test_batching_kernel(self):
+        rs = np.random.RandomState(0)
+        num_models, num_groups, num_requests = 6, 4, 5000
+
+        for rate in [40, 400]:
+            tstamps = np.sort(rs.uniform(0, num_requests / rate, num_requests))
+            model_ids = rs.randint(-1, num_models, num_requests).astype(np.int32)
+            slos = rs.uniform(0.1, 1.0, num_requests).astype(np.float32)
+            num_stages = rs.choice([1, 2, 4], num_groups).astype(np.int32)
+            stage_latency = (rs.uniform(0.02, 0.1, (num_models, num_groups, 4, 1)) *
+                             np.array([1, 1.6, 2.5, 4.5, 8.0])).astype(np.float32)
+
+            m_id2g_id = np.full((num_models, num_groups), -1, dtype=np.int32)
+            g_id2m_id = np.full((num_groups, num_models), -1, dtype=np.int32)
+            num_replicas, num_instances = [0] * num_models, [0] * num_groups
+            for m_id in range(num_models):
+                for g_id in range(num_groups):
+                    if rs.rand() < 0.5:
+                        m_id2g_id[m_id][num_replicas[m_id]] = g_id
+                        num_replicas[m_id] += 1
+                        g_id2m_id[g_id][num_instances[g_id]] = m_id
+                        num_instances[g_id] += 1
+
+            args = (tstamps, model_ids, slos, m_id2g_id, g_id2m_id,
+                    num_stages, stage_latency, num_requests)
+            finish, good = np.zeros(num_requests), np.zeros(num_requests, dtype=bool)
+            res = simulate_requests_mixed_batching(finish, good, *args)
+            ref_finish, ref_good = np.zeros(num_requests), np.zeros(num_requests, dtype=bool)
+            ref = simulate_requests_mixed_batching_python(ref_finish, ref_good, *args)
+
+            np.testing.assert_array_equal(finish, ref_finish)
+            np.testing.assert_array_equal(good, ref_good)
+            for x, y in zip(res, ref):
+                np.testing.assert_array_equal(x, y)
+
+    def test_columnar_workload(self):
+        ws = [PoissonProcess(10).generate_workload("a", 0, 100, slo=0.5, seed=0),
+              GammaProcess(5, 4).generate_workload("b", 0, 100, slo=0.2, seed=1),
+              PoissonProcess(2).generate_workload("a", 50, 100, seed=2)]
+        row_ws = [Workload(w.arrivals, [Request(r.model_name, None, r.slo, r.idx, {})
+                                        for r in w.requests]) for w in ws]
+        assert all(w.columnar for w in ws)
+        assert not any(w.columnar for w in row_ws)
+
+        merged = Workload.merge(*ws)
+        row_merged = Workload.merge(*row_ws)
+        assert merged.columnar and not row_merged.columnar
+        assert merged.model_names == ["a", "b"]
+
+        def check(w, ref):
+            np.testing.assert_array_equal(w.arrivals, ref.arrivals)
+            assert ([r.model_name for r in w.requests] ==
+                    [r.model_name for r in ref.requests])
+            # The SLOs of the materialized requests are exact
+            assert [r.slo for r in w.requests] == [r.slo for r in ref.requests]
+
+        check(merged, row_merged)
+        check(merged[10:-10:3], row_merged[10:-10:3])
+        for w, ref in zip(merged.split_time_interval(20),
+                          row_merged.split_time_interval(20)):
+            assert w.columnar
+            check(w, ref)
+
+        # Each piece starts at its first arrival and spans at most 20 seconds
+        pieces = merged.split_time_interval(20)
+        assert sum(len(w) for w in pieces) == len(merged)
+        for w, next_w in zip(pieces, pieces[1:]):
+            assert w.arrivals[-1] <= w.arrivals[0] + 20 < next_w.arrivals[0]
+
+        # Slicing does not copy
+        assert np.shares_memory(merged[5:100].arrivals, merged.arrivals)
+
+    def test_compute_stats(self):
+        w = Workload.merge(*[
+            GammaProcess(10 * (i + 1), 3).generate_workload(f"m{i}", 0, 200, slo=0.3, seed=i)
+            for i in range(4)])
+        rs = np.random.RandomState(0)
+        start = w.arrivals + rs.uniform(0, 0.003, len(w))
+        latency = rs.gamma(2, 0.05, len(w))
+        finish = start + latency
+        good = latency < 0.3
+
+        stats = w.compute_stats(start, finish, good, warmup=10)
+        streaming_stats = w.compute_stats(start, finish, good, warmup=10, streaming=True)
+
+        skip = int(10 / (w.arrivals[-1] - w.arrivals[0]) * len(w))
+        names = [r.model_name for r in w.requests][skip:-skip]
+        assert [x.name for x in stats.per_model_stats] == ["m0", "m1", "m2", "m3"]
+        for x, y in zip(stats.per_model_stats, streaming_stats.per_model_stats):
+            mask = np.array([name == x.name for name in names])
+            tmp_good = good[skip:-skip][mask]
+            ref_latency = np.sort((finish - start)[skip:-skip][mask][tmp_good])
+            assert x.num_requests == y.num_requests == np.sum(mask)
+            assert x.goodput == y.goodput == np.mean(tmp_good)
+            assert x.latency_p90 == ref_latency[int(0.9 * len(ref_latency))]
+            assert x.latency_p99 == ref_latency[int(0.99 * len(ref_latency))]
+            assert abs(x.latency_mean - y.latency_mean) < 1e-9
+            assert abs(x.throughput - y.throughput) < 1e-9
+            assert abs(y.latency_p90 / x.latency_p90 - 1) < 0.01
+            assert abs(y.latency_p99 / x.latency_p99 - 1) < 0.01
+
+        # Accumulating chunks gives the same results
+        acc = StreamingStats(w.model_names)
+        for i in range(skip, len(w) - skip, 1000):
+            j = min(i + 1000, len(w) - skip)
+            acc.update(w.model_ids[i:j], start[i:j], finish[i:j], good[i:j])
+        chunked_stats = acc.result()
+        for x, y in zip(chunked_stats.per_model_stats, streaming_stats.per_model_stats):
+            assert x[:3] == y[:3] and x.latency_p90 == y.latency_p90
+            assert abs(x.latency_mean - y.latency_mean) < 1e-9
+        assert abs(chunked_stats.latency_mean - stats.latency_mean) < 1e-9
+        assert chunked_stats.request_rate == stats.request_rate
+
+    def test_arrival_generation(self):
+        processes = [GammaProcess(20, 4), PoissonProcess(5), DeterministicProcess(2)]
+        model_names = ["a", "b", "c"]
+        slos = [0.1, None, 0.3]
+
+        arrivals = processes[0].generate_arrivals(10, 100, seed=1)
+        assert isinstance(arrivals, np.ndarray)
+        assert np.all(np.diff(arrivals) >= 0)
+        assert 10 <= arrivals[0] and arrivals[-1] < 110
+
+        w = generate_multi_model_workload(processes, model_names, 0, 100, slos, seed=3)
+        ref = Workload.merge(*[
+            p.generate_workload(name, 0, 100, slo=slo, seed=3 + i)
+            for i, (p, name, slo) in enumerate(zip(processes, model_names, slos))])
+        np.testing.assert_array_equal(w.arrivals, ref.arrivals)
+        assert ([w.model_names[i] for i in w.model_ids] ==
+                [ref.model_names[i] for i in ref.model_ids])
+        np.testing.assert_array_equal(w.slos, ref.slos)
+
+    def test_bursty_samplers(self):
+        # The MMPP keeps the mean arrival rate and the np.random seeding
+        process = UniformMMPP([2, 5, 1], [50, 5, 200])
+        arrivals = process.generate_arrivals(10, 2000, seed=1)
+        assert len(arrivals) == int(2000 * process.rate())
+        assert np.all(np.diff(arrivals) >= 0) and arrivals[0] >= 10
+        assert abs(len(arrivals) / (arrivals[-1] - 10) / process.rate() - 1) < 0.2
+        np.testing.assert_array_equal(
+            arrivals, process.generate_arrivals(10, 2000, seed=1))
+
+        # The pareto arrivals match drawing the intervals one by one
+        from scipy.stats import pareto
+        process = ParetoProcess(1.5, 2.0)
+        rs = np.random.RandomState(2)
+        ref = [10]
+        while ref[-1] < 1010:
+            ref.append(ref[-1] + pareto.rvs(1.5, scale=2.0, random_state=rs) - 1.0)
+        np.testing.assert_allclose(
+            process.generate_arrivals(10, 1000, seed=2), ref[1:])
+
+
+    def test_chunked_approximation(self):
+        from alpa_serve.placement_policy.base_policy import (
+            ModelPlacement, ModelPlacementWithReplacement)
+        model_names = ["a", "b", "c"]
+        placements = [
+            ModelPlacement([ParallelConfig(1, 1, 2)] * 2, [[0, 1], [1, 2]]),
+            ModelPlacement([ParallelConfig(1, 1, 1)] * 2, [[0, 2], [1]])]
+        workload = generate_multi_model_workload(
+            [GammaProcess(10, 3), GammaProcess(20, 3), PoissonProcess(5)],
+            model_names, 0, 300, [0.3, 0.5, 0.4])
+
+        def register_models(controller):
+            for name in model_names:
+                controller.register_model.remote(
+                    name, partial(Executable, load_test_prof_result("test-2GB-100ms")))
+
+        for placement in [placements[0],
+                          ModelPlacementWithReplacement([0, 130], placements)]:
+            place_models = lambda controller: placement
+            ref_case = ServingCase(register_models, lambda: workload, place_models)
+            chunk_case = ServingCase(register_models,
+                                     lambda: iter(workload.split_time_interval(40)),
+                                     place_models)
+
+            # Without warmup, the chunked results are exact
+            for fast_stats in [False, True]:
+                ref, _ = approximate_one_case(ref_case, warmup=0, fast_stats=fast_stats)
+                res, _ = approximate_one_case(chunk_case, warmup=0, fast_stats=fast_stats)
+                assert res.num_requests == ref.num_requests
+                assert res.group_num_requests == ref.group_num_requests
+                assert abs(res.goodput - ref.goodput) < 1e-9
+                assert abs(res.latency_mean - ref.latency_mean) < 1e-9
+                for x, y in zip(ref.per_model_stats, res.per_model_stats):
+                    assert x.name == y.name
+                    assert x.num_requests == y.num_requests
+                    assert abs(x.goodput - y.goodput) < 1e-9
+
+            # The warmup is skipped by time instead of by #requests
+            ref, _ = approximate_one_case(ref_case, warmup=20)
+            res, _ = approximate_one_case(chunk_case, warmup=20)
+            assert abs(res.num_requests / ref.num_requests - 1) < 0.05
+            assert abs(res.goodput - ref.goodput) < 0.02
+
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(SimulatorTest("test_query"))
     suite.addTest(SimulatorTest("test_client"))
+    suite.addTest(SimulatorTest("test_heap_engine"))
+    suite.addTest(SimulatorTest("test_dispatch_policy"))
+    suite.addTest(SimulatorTest("test_batching_kernel"))
+    suite.addTest(SimulatorTest("test_columnar_workload"))
+    suite.addTest(SimulatorTest("test_compute_stats"))
+    suite.addTest(SimulatorTest("test_arrival_generation"))
+    suite.addTest(SimulatorTest("test_bursty_samplers"))
+    suite.addTest(SimulatorTest("test_chunked_approximation"))
     return suite
 
 
@@ -0,0 +1,283 @@
+"""Test trace loading and replay"""
+from collections import OrderedDict
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from alpa_serve.simulator.workload import Workload
+from alpa_serve.trace import (Trace, TraceStore, load_trace, convert_trace,
+    preprocess_azure_v1_trace)
+from alpa_serve.trace.trace import fit_arrival_intervals
+
+
+def make_azure_v1_trace(num_functions=20, n_day=14, seed=0):
+    rs = np.random.RandomState(seed)
+    return OrderedDict(
+        (f"f{i}", rs.poisson(rs.uniform(0, 5), size=n_day * 1440).astype(np.int32))
+        for i in range(num_functions))
+
+
+def make_azure_v2_trace(num_functions=20, n_day=14, seed=0, bursty=False):
+    rs = np.random.RandomState(seed)
+    duration = n_day * 24 * 3600
+    if bursty:
+        return OrderedDict(
+            (f"f{i}", np.cumsum(rs.gamma(0.2, 5 * duration / 20000, size=20000)))
+            for i in range(num_functions))
+    return OrderedDict(
+        (f"f{i}", np.sort(rs.uniform(0, duration, size=rs.randint(1, 5000))))
+        for i in range(num_functions))
+
+
+class TraceTest(unittest.TestCase):
+
+    def check_trace_store(self, trace_name, tracelines):
+        models = [f"m{i}" for i in range(4)]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pkl_path = os.path.join(tmp_dir, f"{trace_name}.pkl")
+            with open(pkl_path, "wb") as handle:
+                pickle.dump(tracelines, handle)
+            store_path = convert_trace(pkl_path)
+
+            store = load_trace(store_path)
+            assert isinstance(store, TraceStore)
+            assert list(store.keys()) == list(tracelines.keys())
+            for name, trace in tracelines.items():
+                np.testing.assert_array_equal(store[name], trace)
+
+            pkl_trace = Trace(trace_name, pkl_path)
+            store_trace = Trace(trace_name, store_path)
+            assert pkl_trace.function_names == store_trace.function_names
+            for start_time, end_time in [("0.0.0", "13.23.60"),
+                                         ("5.5.5", "8.8.8"),
+                                         ("13.0.0", "13.0.30")]:
+                ref = pkl_trace.slice(start_time, end_time)
+                res = store_trace.slice(start_time, end_time)
+                assert list(ref.keys()) == list(res.keys())
+                for name in ref:
+                    np.testing.assert_array_equal(ref[name], res[name])
+
+                ref = pkl_trace.replay(models, start_time=start_time,
+                                       end_time=end_time, interval_seconds=3600)
+                res = store_trace.replay(models, start_time=start_time,
+                                         end_time=end_time, interval_seconds=3600)
+                for model in ref:
+                    np.testing.assert_array_equal(ref[model].arrivals,
+                                                  res[model].arrivals)
+
+    def test_trace_store(self):
+        self.check_trace_store("azure_v1", make_azure_v1_trace())
+        self.check_trace_store("azure_v2", make_azure_v2_trace())
+
+    def test_preprocess_azure_v1_trace(self):
+        n_day = 3
+        rs = np.random.RandomState(0)
+        # Functions show up on a random subset of days
+        expected = OrderedDict()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for day in range(n_day):
+                filename = os.path.join(
+                    tmp_dir, f"invocations_per_function_md.anon.d0{day + 1}.csv")
+                with open(filename, "w") as f:
+                    f.write(",".join(["HashOwner", "HashApp", "HashFunction", "Trigger"] +
+                                     [str(j) for j in range(1, 1441)]) + "\n")
+                    for i in rs.permutation(30)[:20]:
+                        name = f"f{i}"
+                        counts = rs.poisson(1.0, size=1440)
+                        if name not in expected:
+                            expected[name] = np.zeros(n_day * 1440, dtype=np.int32)
+                        expected[name][day * 1440:(day + 1) * 1440] = counts
+                        f.write(",".join(["o", "a", name, "http"] +
+                                         [str(c) for c in counts]) + "\n")
+
+            preprocess_azure_v1_trace(tmp_dir, n_day=n_day, chunk_size=7)
+            preprocess_azure_v1_trace(tmp_dir, n_day=n_day, columnar=True, chunk_size=7)
+            for tracelines in [load_trace(os.path.join(tmp_dir, "azure_v1.pkl")),
+                               load_trace(os.path.join(tmp_dir, "azure_v1"))]:
+                assert list(tracelines.keys()) == list(expected.keys())
+                for name in expected:
+                    assert tracelines[name].dtype == np.int32
+                    np.testing.assert_array_equal(tracelines[name], expected[name])
+            assert not os.path.exists(os.path.join(tmp_dir, "azure_v1.histogram.tmp.npy"))
+
+    def test_distribution_fitting(self):
+        models = [f"m{i}" for i in range(4)]
+        kwargs = {"start_time": "0.0.0", "end_time": "1.0.0", "interval_seconds": 600,
+                  "arrival_distribution": "gamma", "rate_scale_factor": 2.0}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pkl_path = os.path.join(tmp_dir, "azure_v2.pkl")
+            with open(pkl_path, "wb") as handle:
+                pickle.dump(make_azure_v2_trace(8, bursty=True), handle)
+            cache_dir = os.path.join(tmp_dir, "cache")
+
+            trace = Trace("azure_v2", pkl_path, cache_dir=cache_dir)
+            ref = trace.replay(models, **kwargs)
+
+            # The fast path with the MLE refinement matches the scipy fit
+            res = Trace("azure_v2", pkl_path).replay(models, fit_method="moments_mle", **kwargs)
+            for model in ref:
+                for x, y in zip(ref[model].arrival_distribution_params,
+                                res[model].arrival_distribution_params):
+                    assert (x is None) == (y is None)
+                    if x is not None:
+                        np.testing.assert_allclose(x, y, rtol=1e-6)
+
+            # Fitting in a process pool gives the same distributions
+            res = Trace("azure_v2", pkl_path).replay(models, num_workers=2, **kwargs)
+            for model in ref:
+                np.testing.assert_array_equal(ref[model].arrivals, res[model].arrivals)
+
+            # Reuse the fitted distributions from the disk cache
+            with mock.patch("alpa_serve.trace.trace.fit_arrival_intervals",
+                            side_effect=AssertionError):
+                res = Trace("azure_v2", pkl_path, cache_dir=cache_dir).replay(models, **kwargs)
+            for model in ref:
+                np.testing.assert_array_equal(ref[model].arrivals, res[model].arrivals)
+
+    def make_trace(self, trace_name, tracelines):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pkl_path = os.path.join(tmp_dir, f"{trace_name}.pkl")
+            with open(pkl_path, "wb") as handle:
+                pickle.dump(tracelines, handle)
+            return Trace(trace_name, pkl_path)
+
+    def test_bucketing(self):
+        models = [f"m{i}" for i in range(3)]
+        interval_seconds = 600
+        # 2h5m: the last interval is partial
+        start_time, end_time = "1.0.0", "1.2.5"
+        start, end = 86400, 86400 + 2 * 3600 + 5 * 60
+        edges = np.append(np.arange(start, end, interval_seconds), end).astype(np.float64)
+
+        def ref_slice(trace, lo, hi):
+            return trace[(trace >= lo) & (trace < hi)]
+
+        def ref_map(sliced, reduce):
+            names = [f for f in sliced if np.sum(sliced[f]) > 0]
+            merged = OrderedDict()
+            for i, f in enumerate(names):
+                m = models[i % len(models)]
+                merged[m] = sliced[f] if m not in merged else reduce(merged[m], sliced[f])
+            return merged
+
+        # azure_v2: include arrivals exactly on the interval edges and just before them
+        rs = np.random.RandomState(0)
+        tracelines = make_azure_v2_trace(7, n_day=2)
+        for i, f in enumerate(tracelines):
+            extra = [edges, np.nextafter(edges, -np.inf), [start, start, end]]
+            if i == 5:
+                # A function without arrivals in the slice
+                tracelines[f] = np.array([float(start - 1), float(end)])
+                continue
+            tracelines[f] = np.sort(np.concatenate([tracelines[f], rs.choice(
+                np.concatenate(extra), size=rs.randint(1, 30))]))
+
+        trace = self.make_trace("azure_v2", tracelines)
+        for lo, hi in [(start, end), (edges[1], edges[3]), (end, end), (0, 2 * 86400)]:
+            res = trace.slice_arrival_seconds(lo, hi)
+            assert list(res.keys()) == list(tracelines.keys())
+            for f in tracelines:
+                np.testing.assert_array_equal(res[f], ref_slice(tracelines[f], lo, hi))
+
+        ref = OrderedDict((m, np.sort(arrivals)) for m, arrivals in ref_map(
+            OrderedDict((f, ref_slice(x, start, end)) for f, x in tracelines.items()),
+            lambda x, y: np.concatenate((x, y))).items())
+        dataset = OrderedDict()
+        estimate_parameters_with_arrivals = Trace.estimate_parameters_with_arrivals
+        def capture(self, arrival_dataset, *args, **kwargs):
+            dataset.update(arrival_dataset)
+            return estimate_parameters_with_arrivals(self, arrival_dataset, *args, **kwargs)
+        with mock.patch.object(Trace, "estimate_parameters_with_arrivals", capture):
+            trace.replay(models, start_time=start_time, end_time=end_time,
+                         interval_seconds=interval_seconds)
+        assert list(dataset.keys()) == list(ref.keys())
+        for m, (arrivals, offsets) in dataset.items():
+            np.testing.assert_array_equal(arrivals, ref[m])
+            assert offsets.size == edges.size
+            ref_intervals = [ref_slice(ref[m], edges[i], edges[i + 1])
+                             for i in range(edges.size - 1)]
+            for i, ref_interval in enumerate(ref_intervals):
+                np.testing.assert_array_equal(arrivals[offsets[i]:offsets[i + 1]], ref_interval)
+
+            fits = fit_arrival_intervals(m, arrivals, offsets, interval_seconds, "exponential")
+            assert len(fits) == len(ref_intervals)
+            for (rate, fit), ref_interval in zip(fits, ref_intervals):
+                assert rate == ref_interval.size / interval_seconds
+                inter_arrival = np.diff(ref_interval) + 1e-6
+                if inter_arrival.size == 0:
+                    assert fit is None
+                else:
+                    assert fit == Trace.estimate_exponential(inter_arrival, "mle")
+
+        # azure_v1: the slice is not a multiple of the interval
+        tracelines = make_azure_v1_trace(7, n_day=2)
+        tracelines["f5"][:] = 0
+        start_slot, end_slot = start // 60, end // 60
+        for n_min_per_interval in [1, 10, 60, 125, 200]:
+            ref = OrderedDict()
+            for m, histogram in ref_map(
+                    OrderedDict((f, x[start_slot:end_slot]) for f, x in tracelines.items()),
+                    lambda x, y: x + y).items():
+                ref[m] = [np.sum(histogram[i:i + n_min_per_interval])
+                          for i in range(0, histogram.size, n_min_per_interval)]
+
+            trace = self.make_trace("azure_v1", tracelines)
+            dataset = OrderedDict()
+            estimate_parameters_with_histogram = Trace.estimate_parameters_with_histogram
+            def capture(self, histogram_dataset, *args, **kwargs):
+                dataset.update(histogram_dataset)
+                return estimate_parameters_with_histogram(self, histogram_dataset, *args, **kwargs)
+            with mock.patch.object(Trace, "estimate_parameters_with_histogram", capture):
+                trace.replay(models, start_time=start_time, end_time=end_time,
+                             interval_seconds=60 * n_min_per_interval)
+            assert list(dataset.keys()) == list(ref.keys())
+            for m in ref:
+                assert dataset[m].dtype == np.int32
+                np.testing.assert_array_equal(dataset[m], ref[m])
+
+    def test_replay_chunks(self):
+        models = [f"m{i}" for i in range(4)]
+        slos = [0.1, 0.2, 0.3, 0.4]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for trace_name, tracelines, kwargs in [
+                ("azure_v1", make_azure_v1_trace(), {"arrival_distribution": "gamma",
+                                                     "cv_scale_factor": 2.0}),
+                ("azure_v2", make_azure_v2_trace(), {"arrival_distribution": "exponential"}),
+                ("azure_v2", make_azure_v2_trace(), {"arrival_distribution": "vanilla",
+                                                     "time_scale_factor": 2.0})]:
+                pkl_path = os.path.join(tmp_dir, f"{trace_name}.pkl")
+                with open(pkl_path, "wb") as handle:
+                    pickle.dump(tracelines, handle)
+                trace = Trace(trace_name, pkl_path)
+                kwargs.update(start_time="1.0.0", end_time="2.3.0", interval_seconds=600)
+
+                replays = trace.replay(models, **kwargs)
+                ref = Workload.merge(*[replays[m].to_workload(slo)
+                                       for m, slo in zip(models, slos)])
+                chunks = list(trace.replay_chunks(models, slos, chunk_seconds=1800, **kwargs))
+                assert len(chunks) > 1
+                assert np.all(np.diff(np.concatenate([c.arrivals for c in chunks])) >= 0)
+                res = Workload.merge(*chunks)
+                np.testing.assert_array_equal(ref.arrivals, res.arrivals)
+                assert ([ref.model_names[i] for i in ref.model_ids] ==
+                        [res.model_names[i] for i in res.model_ids])
+                np.testing.assert_array_equal(ref.slos, res.slos)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(TraceTest("test_trace_store"))
+    suite.addTest(TraceTest("test_preprocess_azure_v1_trace"))
+    suite.addTest(TraceTest("test_distribution_fitting"))
+    suite.addTest(TraceTest("test_bucketing"))
+    suite.addTest(TraceTest("test_replay_chunks"))
+    return suite
+
+
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner()
+    runner.run(suite())